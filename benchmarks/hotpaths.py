@@ -0,0 +1,306 @@
+#!/usr/bin/python
+"""
+Benchmark toupee's hot paths on synthetic data, each case in a fresh
+interpreter, reporting throughput and the memory the benchmarked code
+allocates, and comparing them with a saved baseline
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import sys
+import time
+import json
+import gzip
+import platform
+import atexit
+import shutil
+import cPickle
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import collections
+import numpy
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+#every case is a function of the scale factor, returning a function that
+#runs the benchmarked code once and the number of items it processes
+CASES = collections.OrderedDict()
+
+def case(name):
+    def register(f):
+        CASES[name] = f
+        return f
+    return register
+
+def synthetic_set(n, n_in = 784, n_classes = 10, seed = 0):
+    rng = numpy.random.RandomState(seed)
+    return (rng.rand(n, n_in).astype('float32'),
+            rng.randint(0, n_classes, n).astype('int32'))
+
+def synthetic_dataset(n, n_in = 784):
+    return (synthetic_set(n, n_in, seed = 0),
+            synthetic_set(n // 5, n_in, seed = 1),
+            synthetic_set(n // 5, n_in, seed = 2))
+
+@case('resample')
+def bench_resample(scale):
+    from toupee.data import Resampler
+    n = int(20000 * scale)
+    resampler = Resampler(synthetic_dataset(n))
+    return lambda: resampler.make_new_train(n), n
+
+@case('resample_weighted')
+def bench_resample_weighted(scale):
+    from toupee.data import WeightedResampler
+    n = int(20000 * scale)
+    resampler = WeightedResampler(synthetic_dataset(n))
+    weights = numpy.random.RandomState(0).rand(n)
+    resampler.update_weights(weights / weights.sum())
+    return lambda: resampler.make_new_train(n), n
+
+@case('pad_dataset')
+def bench_pad_dataset(scale):
+    from toupee.data import pad_dataset
+    n = int(5000 * scale)
+    x = synthetic_set(n)[0].reshape(n, 28, 28)
+    return lambda: pad_dataset(x, 32), n
+
+@case('one_hot')
+def bench_one_hot(scale):
+    from toupee.data import one_hot
+    n = int(1000000 * scale)
+    y = synthetic_set(n, n_in = 1)[1]
+    return lambda: one_hot(y), n
+
+@case('transformer')
+def bench_transformer(scale):
+    from toupee.data import Transformer
+    n = int(200 * scale)
+    x = synthetic_set(n)[0]
+    rng = numpy.random.RandomState(0)
+    return lambda: Transformer(x, 28, 28, alpha = 1., beta = 7.5,
+            gamma = 10., sigma = 6., noise_var = 0., rng = rng), n
+
+def temporary_directory():
+    directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory, True)
+    return directory
+
+def save_npz(dataset, directory):
+    prefix = os.path.join(directory, 'bench')
+    for name, (x, y) in zip(['train', 'valid', 'test'], dataset):
+        numpy.savez_compressed(prefix + name + '.npz', x = x, y = y)
+    return prefix
+
+@case('load_data_npz')
+def bench_load_data_npz(scale):
+    from toupee.data import load_data
+    n = int(20000 * scale)
+    directory = temporary_directory()
+    prefix = save_npz(synthetic_dataset(n), directory)
+    return lambda: load_data(prefix, pickled = False), n + 2 * (n // 5)
+
+@case('load_data_pickle')
+def bench_load_data_pickle(scale):
+    from toupee.data import load_data
+    n = int(20000 * scale)
+    directory = temporary_directory()
+    filename = os.path.join(directory, 'bench.pkl.gz')
+    with gzip.open(filename, 'wb') as f:
+        cPickle.dump(synthetic_dataset(n), f, protocol = 2)
+    return lambda: load_data(filename, pickled = True), n + 2 * (n // 5)
+
+class SoftmaxMember:
+    """
+    Stand-in for a Theano member: a random softmax layer
+    """
+
+    def __init__(self, x, n_in, n_out, rng):
+        import theano.tensor as T
+        from toupee.common import sharedX
+        self.W = sharedX(rng.randn(n_in, n_out) * 0.01)
+        self.b = sharedX(numpy.zeros(n_out))
+        self.p_y_given_x = T.nnet.softmax(T.dot(x, self.W) + self.b)
+
+def theano_members(n_members, n_in = 784, n_out = 10):
+    import theano.tensor as T
+    x = T.matrix('x')
+    rng = numpy.random.RandomState(0)
+    return x, [SoftmaxMember(x, n_in, n_out, rng) for i in range(n_members)]
+
+@case('aggregate_averaging')
+def bench_aggregate_averaging(scale):
+    import theano
+    import theano.tensor as T
+    from toupee.ensemble_methods import AveragingRunner
+    n = int(10000 * scale)
+    x, members = theano_members(10)
+    runner = AveragingRunner(members, x, T.ivector('y'), None)
+    f = theano.function([x], runner.y_pred)
+    set_x = synthetic_set(n)[0]
+    return lambda: f(set_x), n
+
+@case('ensemble_predictor')
+def bench_ensemble_predictor(scale):
+    import keras
+    from toupee.serving import EnsemblePredictor
+    n = int(10000 * scale)
+    members = []
+    for i in range(10):
+        m = keras.models.Sequential([keras.layers.Dense(10, input_dim = 784,
+            activation = 'softmax')])
+        m.compile('sgd', 'categorical_crossentropy')
+        members.append(m)
+    predictor = EnsemblePredictor(members, batch_size = 256)
+    set_x = synthetic_set(n)[0]
+    return lambda: predictor.predict(set_x), n
+
+@case('stacking_join_outputs')
+def bench_stacking_join_outputs(scale):
+    import types
+    from toupee.common import sharedX
+    from toupee.ensemble_methods import StackingRunner
+    n = int(5000 * scale)
+    x, members = theano_members(10)
+    #only join_outputs is benchmarked, the stack head is not trained
+    runner = types.InstanceType(StackingRunner, { 'members': members })
+    set_x = sharedX(synthetic_set(n)[0])
+    return lambda: runner.join_outputs(x, set_x, 100), n
+
+@case('boosting_update')
+def bench_boosting_update(scale):
+    import theano.tensor as T
+    from toupee.common import sharedX
+    from toupee.ensemble_methods import boosting_update
+    n = int(50000 * scale)
+    rng = numpy.random.RandomState(0)
+    y = rng.randint(0, 10, n).astype('int32')
+    yhat = numpy.where(rng.rand(n) < 0.8, y, (y + 1) % 10).astype('int32')
+    D = sharedX(numpy.ones(n) / n)
+    errors = T.neq(y, yhat)
+    return lambda: boosting_update(D, errors)[1].eval(), n
+
+def max_rss():
+    #KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def run_case(name, scale, repeats):
+    """
+    Run one case in this interpreter, returning its measurements. The
+    memory is how far the resident set grows above what it is after the
+    setup and a warm-up run, at its peak during the timed runs.
+    """
+    from toupee.autotune import PeakMemory
+    run, items = CASES[name](scale)
+    run()
+    memory = PeakMemory()
+    before = memory.current()
+    if memory.reset():
+        peak = memory.peak
+    else:
+        #only counted when the high-water mark is above the setup's
+        before = max_rss()
+        peak = max_rss
+    times = []
+    for i in range(repeats):
+        start = time.time()
+        run()
+        times.append(time.time() - start)
+    growth = max(peak() - before, 0)
+    times.sort()
+    median = times[len(times) // 2]
+    return { 'min': times[0],
+             'median': median,
+             'items': items,
+             'throughput': items / max(median, 1e-9),
+             'peak_rss_growth_mb': growth / 2. ** 20 }
+
+def spawn_case(name, scale, repeats):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    output = subprocess.check_output([sys.executable, __file__,
+        '--run-case', name, '--scale', str(scale),
+        '--repeats', str(repeats)], env = env)
+    return json.loads(output.strip().split('\n')[-1])
+
+def compare(results, baseline, threshold, memory_slack_mb = 1.):
+    """
+    The regressions of `results` beyond `threshold` (a fraction) in median
+    time or memory growth relative to `baseline`. Memory growing by less
+    than `memory_slack_mb` is never counted, as small cases allocate
+    next to nothing.
+    """
+    regressions = []
+    for name, r in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        b = baseline['cases'][name]
+        for key, slack in [('median', 0.), ('peak_rss_growth_mb',
+                                             memory_slack_mb)]:
+            if r[key] > b[key] * (1. + threshold) and r[key] - b[key] > slack:
+                regressions.append("{0}: {1} {2:.4g} -> {3:.4g} (+{4:.0f}%)"
+                        .format(name, key, b[key], r[key],
+                                100. * (r[key] / max(b[key], 1e-9) - 1.)))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark toupee hot paths')
+    parser.add_argument('cases', nargs='*',
+            help='the cases to run (default: all of {0})'.format(
+                ', '.join(CASES.keys())))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.,
+            help='multiply every problem size by this')
+    parser.add_argument('--output', nargs='?', help='save the results as JSON')
+    parser.add_argument('--baseline', nargs='?',
+            help='compare with the results saved in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+            help='relative slowdown or memory growth counted as a regression')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        #the output of the case itself goes to stderr, the result is the
+        #last line on stdout
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        r = run_case(args.run_case, args.scale, args.repeats)
+        stdout.write(json.dumps(r) + '\n')
+        sys.exit(0)
+
+    results = { 'scale': args.scale,
+                'platform': platform.platform(),
+                'cpus': multiprocessing.cpu_count(),
+                'cases': collections.OrderedDict() }
+    for name in args.cases or CASES.keys():
+        r = spawn_case(name, args.scale, args.repeats)
+        results['cases'][name] = r
+        print "{0:<22} median {1:8.4f}s  {2:12.0f} items/s  +{3:7.1f} MB".format(
+                name, r['median'], r['throughput'], r['peak_rss_growth_mb'])
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale:
+            print "warning: the baseline was run at scale {0}".format(
+                    baseline.get('scale'))
+        if baseline.get('cpus') != results['cpus']:
+            print "warning: the baseline was run on {0} ({1} CPUs)".format(
+                    baseline.get('platform'), baseline.get('cpus'))
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            print "REGRESSION " + r
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+"""
+Benchmark data-parallel training (parallel.py) from 1 to N processes on
+synthetic data, reporting the throughput and the speedup over one process
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import sys
+import time
+import json
+import argparse
+import multiprocessing
+import numpy
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+DEFAULT_MODEL = os.path.join(ROOT, 'examples', 'experiments', 'mnist.model')
+
+
+def synthetic_set(n, input_shape, n_classes, seed = 0):
+    rng = numpy.random.RandomState(seed)
+    x = rng.rand(*([n] + list(input_shape))).astype('float32')
+    y = numpy.zeros((n, n_classes), dtype = 'float32')
+    y[numpy.arange(n), rng.randint(0, n_classes, n)] = 1.
+    return x, y
+
+
+def run(model_file, method, processes, n, batch_size, update_rule):
+    """
+    Train a fresh model for one epoch, returning the samples per second
+    """
+    from toupee import mlp, parallel
+    numpy.random.seed(0)
+    model = mlp.build_model(model_file)
+    model.compile(optimizer = update_rule, loss = 'categorical_crossentropy',
+            metrics = ['accuracy'])
+    x, y = synthetic_set(n, model.inputs[0]._keras_shape[1:],
+            model.outputs[0]._keras_shape[1])
+    start = time.time()
+    if method == 'normal':
+        model.fit(x, y, batch_size = batch_size, nb_epoch = 1, verbose = 0)
+    else:
+        parallel.fit(model, x, y, batch_size, 1, method, processes)
+    return n / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark data-parallel '
+            'training')
+    parser.add_argument('--model', default = DEFAULT_MODEL,
+            help = 'the serialised Keras model to train')
+    parser.add_argument('--processes', type = int,
+            default = multiprocessing.cpu_count(),
+            help = 'the largest number of processes')
+    parser.add_argument('--methods', nargs = '+',
+            default = ['allreduce', 'hogwild'])
+    parser.add_argument('--samples', type = int, default = 6000)
+    parser.add_argument('--batch-size', type = int, default = 100)
+    parser.add_argument('--update-rule', default = 'rmsprop')
+    parser.add_argument('--output', help = 'save the results as JSON')
+    args = parser.parse_args()
+
+    if os.environ.get('OMP_NUM_THREADS') != '1':
+        print "note: set OMP_NUM_THREADS=1 so that the processes do not " \
+                "compete for BLAS threads"
+    counts = sorted(set([1] + [2 ** i for i in range(1, 16)
+                               if 2 ** i < args.processes] + [args.processes]))
+    baseline = run(args.model, 'normal', 1, args.samples, args.batch_size,
+            args.update_rule)
+    results = { 'normal': baseline }
+    print "{0:>10} {1:>9} {2:>14} {3:>8}".format('method', 'processes',
+            'samples/s', 'speedup')
+    print "{0:>10} {1:>9} {2:>14.1f} {3:>8.2f}".format('normal', 1, baseline,
+            1.)
+    for method in args.methods:
+        results[method] = {}
+        for processes in counts:
+            throughput = run(args.model, method, processes, args.samples,
+                    args.batch_size, args.update_rule)
+            results[method][processes] = throughput
+            print "{0:>10} {1:>9} {2:>14.1f} {3:>8.2f}".format(method,
+                    processes, throughput, throughput / baseline)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
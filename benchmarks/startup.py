@@ -0,0 +1,61 @@
+#!/usr/bin/python
+"""
+Measure how long toupee entry points take to import in a fresh interpreter
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CASES = [
+    ('import toupee', 'import toupee'),
+    ('load_data/Resampler', 'from toupee.data import load_data, Resampler'),
+    ('config', 'from toupee import config'),
+    ('serving', 'from toupee import serving'),
+    ('mlp (Keras)', 'from toupee import mlp'),
+    #what every entry point used to pay through toupee/__init__.py
+    ('everything', 'import toupee.data, toupee.ensemble_methods, toupee.mlp, '
+                   'toupee.parameters, toupee.config, theano, scipy.stats, '
+                   'skimage.transform, pymongo'),
+]
+
+def time_import(statement, repeats):
+    times = []
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    for i in range(repeats):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement], env=env)
+        times.append(time.time() - start)
+    return sorted(times)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark toupee imports')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', nargs='?', help='save the results as JSON')
+    args = parser.parse_args()
+
+    #one untimed run of each to warm the OS file cache and compile .pyc files
+    for name, statement in CASES:
+        time_import(statement, 1)
+    results = {}
+    for name, statement in CASES:
+        times = time_import(statement, args.repeats)
+        results[name] = { 'min': times[0], 'median': times[len(times) // 2] }
+        print "{0:<22} min {1:6.3f}s  median {2:6.3f}s".format(name,
+                times[0], times[len(times) // 2])
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
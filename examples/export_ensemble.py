@@ -0,0 +1,34 @@
+#!/usr/bin/python
+"""
+Export an ensemble saved with save_ensemble.py as a NumPy bundle, which
+serve_ensemble.py and toupee.inference.load_bundle run without Theano or
+Keras
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under GPLv2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import time
+import argparse
+
+from toupee import config
+from toupee import inference
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a saved ensemble')
+    parser.add_argument('params_file', help='the experiment description')
+    parser.add_argument('ensemble_file', help='the saved ensemble')
+    parser.add_argument('dest', help='the bundle to write (.npz)')
+    args = parser.parse_args()
+
+    params = config.load_parameters(args.params_file)
+    predictor = inference.export(args.ensemble_file, args.dest,
+            model_file = params.model_file, method = params.method)
+    start = time.time()
+    inference.load_bundle(args.dest)
+    print 'exported {0} members, loading takes {1:.3f}s'.format(
+            len(predictor.members), time.time() - start)
@@ -10,12 +10,23 @@ import dill
 
 from toupee import config
 from toupee.data import *
+from toupee.archive import EnsembleArchive, is_archive
+from toupee.serving import EnsemblePredictor
 
 if __name__ == '__main__':
     params = config.load_parameters(sys.argv[1])
     dataset = load_data(params.dataset,
                               shared = False,
                               pickled = params.pickled)
+    if is_archive(sys.argv[2]):
+        ensemble = EnsemblePredictor.from_archive(EnsembleArchive(sys.argv[2]),
+                batch_size = params.batch_size)
+        test_set_x, test_set_y = dataset[2]
+        if test_set_y.ndim > 1:
+            test_set_y = test_set_y.argmax(axis=1)
+        test_score = np.mean(ensemble.predict(test_set_x) != test_set_y)
+        print 'Final error: {0} %'.format(test_score * 100.)
+        sys.exit(0)
     members = dill.load(open(sys.argv[2]))
     x = members[0].x
     y = members[0].y
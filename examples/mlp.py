@@ -22,5 +22,7 @@ if __name__ == '__main__':
     params = config.load_parameters(sys.argv[1])
     dataset = data.load_data(params.dataset,
                              pickled = params.pickled,
-                             one_hot_y = params.one_hot)
+                             one_hot_y = params.one_hot,
+                             storage_dtype = params.storage_dtype,
+                             input_scale = params.input_scale)
     mlp = sequential_model(dataset, params)
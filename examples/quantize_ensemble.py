@@ -0,0 +1,63 @@
+#!/usr/bin/python
+"""
+Quantize a saved ensemble archive to int8 or float16 weights, calibrated on
+the validation set, and report how its test accuracy, size and speed
+compare with the float32 ensemble
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under GPLv2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import argparse
+
+from toupee import config
+from toupee import data
+from toupee.archive import EnsembleArchive
+from toupee.serving import EnsemblePredictor
+from toupee.inference import NumpyEnsemblePredictor, save_bundle
+from toupee import quantization
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quantize a saved ensemble')
+    parser.add_argument('params_file', help='the experiment description')
+    parser.add_argument('archive', help='the ensemble archive')
+    parser.add_argument('dest', help='the quantized ensemble (.npz)')
+    parser.add_argument('--mode', choices=['int8', 'float16'], default='int8')
+    parser.add_argument('--calibration-size', type=int, default=1000,
+            help='validation instances used to calibrate the int8 ranges')
+    parser.add_argument('--request-size', type=int, default=1,
+            help='instances per request when measuring latency')
+    args = parser.parse_args()
+
+    params = config.load_parameters(args.params_file)
+    dataset = data.load_data(params.dataset,
+                             pickled = params.pickled,
+                             one_hot_y = params.one_hot,
+                             storage_dtype = params.storage_dtype,
+                             input_scale = params.input_scale)
+    archive = EnsembleArchive(args.archive)
+    float_ensemble = NumpyEnsemblePredictor.from_archive(archive,
+            batch_size = params.batch_size)
+    valid_x = dataset[1][0]
+    quantized = quantization.quantize_ensemble(float_ensemble, args.mode,
+            valid_x[:args.calibration_size])
+    save_bundle(args.dest, quantized)
+    #the reference is the float32 Keras aggregator
+    reference = EnsemblePredictor.from_archive(archive,
+            batch_size = params.batch_size)
+    test_x, test_y = dataset[2]
+    report = quantization.accuracy_report(reference, quantized, test_x, test_y,
+            request_size = args.request_size)
+    print "float32: accuracy {0:.4f}, {1:.1f} MB, {2:.2f}s, {3:.2f} ms/request".format(
+            report['reference_accuracy'], report['reference_bytes'] / 1e6,
+            report['reference_seconds'], report['reference_latency'] * 1e3)
+    print "{0}: accuracy {1:.4f}, {2:.1f} MB, {3:.2f}s, {4:.2f} ms/request".format(
+            args.mode, report['quantized_accuracy'],
+            report['quantized_bytes'] / 1e6, report['quantized_seconds'],
+            report['quantized_latency'] * 1e3)
+    print "accuracy delta {0:+.4f}, agreement {1:.4f}".format(
+            report['accuracy_delta'], report['agreement'])
@@ -2,6 +2,7 @@
 
 import gc
 import sys
+import argparse
 import numpy as np
 import numpy.random
 import theano
@@ -10,9 +11,30 @@ import dill
 
 from toupee import config
 from toupee.data import *
+from toupee.checkpoint import EnsembleCheckpoint, train_ensemble
+from toupee import workqueue
 
 if __name__ == '__main__':
-    params = config.load_parameters(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Train and save an ensemble')
+    parser.add_argument('params_file', help='the experiment description')
+    parser.add_argument('dest',
+            help='the ensemble archive, or a .dill file for pickled members')
+    parser.add_argument('--grow', type=int, default=0,
+            help='add this many members to an existing archive')
+    parser.add_argument('--queue',
+            help='train through a work queue in this (shared) directory')
+    parser.add_argument('--worker', action='store_true',
+            help='only train members from the queue, and leave writing the '
+                 'archive to the coordinator')
+    parser.add_argument('--lease', type=float, default=600.,
+            help='seconds after which the claim of a silent worker is '
+                 'taken over')
+    parser.add_argument('--max-loaded', type=int,
+            help='offload trained members to disk, keeping at most this '
+                 'many in memory (default: max_loaded_members)')
+    args = parser.parse_args()
+
+    params = config.load_parameters(args.params_file)
     dataset = load_data(params.dataset,
                               shared = False,
                               pickled = params.pickled)
@@ -22,10 +44,30 @@ if __name__ == '__main__':
     method.prepare(params,dataset)
     train_set = method.resampler.get_train()
     valid_set = method.resampler.get_valid()
-    members = []
-    for i in range(0,params.ensemble_size):
-        print 'training member {0}'.format(i)
-        new_member = method.create_member(x,y)
-        members.append(new_member)
-        gc.collect()
-    dill.dump(members,open(sys.argv[2],"wb"))
+    max_loaded = args.max_loaded
+    if max_loaded is None:
+        max_loaded = params.max_loaded_members
+    if args.queue is not None:
+        #the coordinator trains members as well, then writes the archive
+        queue = workqueue.WorkQueue.create(args.queue, method,
+                params.ensemble_size, lease = args.lease)
+        workqueue.run_worker(queue, method, x, y)
+        if not args.worker:
+            workqueue.assemble(queue, method, params, args.dest)
+    elif args.dest.endswith('.dill'):
+        if method.__dict__.get('head', 'mlp') != 'mlp':
+            raise ValueError("a fitted stack head is only saved in an "
+                    "ensemble archive, not in a .dill file")
+        members = train_ensemble(method, params, x, y, max_loaded = max_loaded)
+        if max_loaded is not None:
+            #pickled as weights, which load_members rebuilds
+            store = members
+            members = [[np.array(w) for w in store.weights(i)]
+                       for i in range(len(store))]
+            store.close()
+        dill.dump(members,open(args.dest,"wb"))
+    else:
+        #the archive is written after every member, and resumed if it exists
+        train_ensemble(method, params, x, y,
+                checkpoint = EnsembleCheckpoint(args.dest), grow = args.grow,
+                max_loaded = max_loaded)
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+"""
+Serve predictions from an ensemble saved with save_ensemble.py
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under GPLv2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import argparse
+
+from toupee import config
+from toupee import serving
+from toupee import archive
+from toupee import inference
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a saved ensemble')
+    parser.add_argument('params_file', help='the experiment description')
+    parser.add_argument('ensemble_file', help='the saved ensemble')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--socket', nargs='?',
+            help='listen on this unix socket instead of host:port')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-latency-ms', type=float, default=5.,
+            help='longest a request waits for its batch to fill up')
+    parser.add_argument('--max-loaded', type=int,
+            help='keep at most this many members of an archive built, or '
+                 'of a quantized bundle dequantized')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    params = config.load_parameters(args.params_file)
+    if inference.is_bundle(args.ensemble_file):
+        #exported with export_ensemble.py, runs without Theano or Keras
+        predictor = inference.load_bundle(args.ensemble_file,
+                batch_size = params.batch_size, max_loaded = args.max_loaded)
+    elif archive.is_archive(args.ensemble_file):
+        predictor = serving.EnsemblePredictor.from_archive(
+                archive.EnsembleArchive(args.ensemble_file),
+                batch_size = params.batch_size, max_loaded = args.max_loaded)
+    else:
+        members = serving.load_members(args.ensemble_file, params.model_file)
+        predictor = serving.EnsemblePredictor.from_method(members,
+                params.method, batch_size = params.batch_size)
+    batcher = serving.MicroBatcher(predictor.predict_proba,
+            max_batch_size = args.max_batch_size,
+            max_latency = args.max_latency_ms / 1000.).start()
+    if args.socket is not None:
+        address = args.socket
+    else:
+        address = (args.host, args.port)
+    server = serving.make_server(batcher, address, verbose = args.verbose,
+            input_shape = predictor.input_shape())
+    print 'serving {0} members on {1}'.format(len(predictor.members),
+            address)
+    try:
+        server.serve_forever()
+    finally:
+        batcher.stop()
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+"""
+Run a hyperparameter sweep from a yaml file with a sweep section, e.g.
+
+sweep:
+  mode: grid
+  workers: 4
+  parameters:
+    batch_size: [50, 100, 200]
+    update_rule: [rmsprop, adam]
+  early_termination:
+    min_epochs: 2
+    reduction_factor: 3
+    metric: val_loss
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under GPLv2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import argparse
+
+from toupee import config
+from toupee import data
+from toupee import sweep
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a hyperparameter sweep')
+    parser.add_argument('params_file', help='the experiment description')
+    parser.add_argument('--workers', type=int, default=None,
+            help='trials run in parallel (default: sweep.workers or one per cpu)')
+    parser.add_argument('--output', nargs='?',
+            help='append every trial result to this JSON lines file')
+    args = parser.parse_args()
+
+    params = config.load_parameters(args.params_file)
+    dataset = data.load_data(params.dataset,
+                             pickled = params.pickled,
+                             one_hot_y = params.one_hot,
+                             storage_dtype = params.storage_dtype,
+                             input_scale = params.input_scale)
+    records = sweep.run_sweep(params, dataset, params.sweep,
+            workers = args.workers, output = args.output)
+    print "best trials:"
+    for r in records[:5]:
+        print "  {0}: valid {1}, test {2}".format(r['overrides'],
+                r.get('best_valid'), r.get('best_test'))
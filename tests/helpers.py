@@ -0,0 +1,82 @@
+"""
+Stand-ins shared by the tests of ensemble training: a Keras model file to
+build members from, and an ensemble method whose members are random weights
+"""
+import os
+import numpy
+
+
+class Crash(Exception):
+    pass
+
+
+def write_model(directory, layers):
+    """
+    Save a Sequential model of `layers` as directory/model.yaml, returning
+    its file name and the shapes of its weights
+    """
+    import keras
+    model = keras.models.Sequential(layers)
+    model_file = os.path.join(directory, 'model.yaml')
+    with open(model_file, 'w') as f:
+        f.write(model.to_yaml())
+    return model_file, [w.shape for w in model.get_weights()]
+
+
+def random_weights(shapes):
+    return [numpy.random.rand(*s).astype('float32') for s in shapes]
+
+
+class RandomMethod:
+    """
+    An ensemble method whose members are random weights drawn from
+    numpy.random, so that resuming has to restore the RNG as well, and
+    that rebuilding a member in between would change the members after it.
+    Its alphas number the members from 1, and it raises Crash instead of
+    creating member `crash_at`.
+    """
+
+    yaml_tag = u'!Random'
+
+    def __init__(self, model_file, shapes, crash_at=None):
+        self.model_file = model_file
+        self.shapes = shapes
+        self.crash_at = crash_at
+        self.members = []
+        self.alphas = []
+
+    def create_member(self, x, y):
+        from toupee.mlp import build_model
+        if len(self.members) == self.crash_at:
+            raise Crash()
+        w = random_weights(self.shapes)
+        self.members.append(w)
+        self.alphas.append(float(len(self.members)))
+        return build_model(self.model_file, w)
+
+    def get_state(self):
+        return {'alphas': list(self.alphas)}
+
+    def set_state(self, state):
+        self.alphas = list(state['alphas'])
+
+    def restore_members(self, archive):
+        self.members = [[numpy.array(w) for w in archive.member_weights(i)]
+                        for i in range(len(archive))]
+
+
+def reference_weights(method, params, seed=1):
+    """
+    The weights of the members `method` trains without interruption
+    """
+    from toupee.checkpoint import train_ensemble
+    numpy.random.seed(seed)
+    members = train_ensemble(method, params, None, None)
+    return [[numpy.array(w) for w in m.get_weights()] for m in members]
+
+
+def assert_same_weights(weights, expected):
+    assert len(weights) == len(expected)
+    for m, e in zip(weights, expected):
+        for a, b in zip(m, e):
+            assert numpy.allclose(a, b)
@@ -0,0 +1,54 @@
+import shutil
+import tempfile
+import numpy
+from toupee.archive import EnsembleArchive, is_archive, save_ensemble
+
+class TestArchive:
+
+    def members(self):
+        rng = numpy.random.RandomState(0)
+        return [[rng.rand(4,3).astype('float32'), rng.rand(3).astype('float32')]
+                for i in range(3)]
+
+    def test_round_trip(self):
+        path = tempfile.mkdtemp()
+        try:
+            members = self.members()
+            save_ensemble(path, 'class_name: Sequential\n', members,
+                    method='AdaBoostM1', alphas=[0.5, 1., 2.])
+            assert is_archive(path)
+            archive = EnsembleArchive(path)
+            assert len(archive) == 3
+            assert archive.method == 'AdaBoostM1'
+            assert archive.alphas == [0.5, 1., 2.]
+            assert archive.architecture == 'class_name: Sequential\n'
+            for i in [2, 0, 1]:
+                weights = archive.member_weights(i)
+                assert isinstance(weights[0], numpy.memmap)
+                for w, expected in zip(weights, members[i]):
+                    assert w.shape == expected.shape
+                    assert numpy.array_equal(w, expected)
+        finally:
+            shutil.rmtree(path)
+
+    def test_incremental(self):
+        path = tempfile.mkdtemp()
+        try:
+            archive = EnsembleArchive.create(path, '', method='DIB')
+            for w in self.members():
+                archive.add_member(w, alpha=0.1)
+            reopened = EnsembleArchive(path)
+            assert len(reopened) == 3
+            assert reopened.alphas == [0.1, 0.1, 0.1]
+        finally:
+            shutil.rmtree(path)
+
+    def test_method_name_only(self):
+        path = tempfile.mkdtemp()
+        try:
+            save_ensemble(path, '', self.members(), method='Bagging')
+            archive = EnsembleArchive(path)
+            assert archive.method == 'Bagging'
+            assert archive.alphas is None
+        finally:
+            shutil.rmtree(path)
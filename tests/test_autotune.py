@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import numpy
+import pytest
+from toupee import autotune
+from toupee.parameters import Parameters
+from helpers import write_model
+
+
+class TestAutotune:
+
+    def setup_method(self, method):
+        import keras
+        self.directory = tempfile.mkdtemp()
+        model_file, _ = write_model(self.directory, [
+            keras.layers.Dense(16, input_dim=8, activation='relu'),
+            keras.layers.Dense(3, activation='softmax')])
+        self.cache = os.path.join(self.directory, 'cache', 'autotune.json')
+        self.params = Parameters(model_file=model_file, update_rule='sgd',
+                                 cost_function='categorical_crossentropy',
+                                 batch_size=100, memory_ceiling=None,
+                                 autotune_cache=self.cache)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def tune(self, **kwargs):
+        return autotune.autotune(self.params, cache_file=self.cache,
+                                 batch_sizes=[8, 32], threads=[1, 2],
+                                 min_time=0.01, **kwargs)
+
+    def test_choice_is_cached(self, monkeypatch):
+        choice = self.tune()
+        for mode in ['training', 'inference']:
+            assert choice[mode]['batch_size'] in [8, 32]
+            assert choice[mode]['threads'] in [1, 2]
+        assert os.path.isfile(self.cache)
+        def retune(*args, **kwargs):
+            raise AssertionError("the cached choice was not used")
+        monkeypatch.setattr(autotune, 'tune', retune)
+        assert self.tune() == choice
+
+    def test_memory_ceiling(self):
+        with pytest.raises(ValueError):
+            self.tune(memory_ceiling=1.)
+
+    def test_tune_parameters(self, monkeypatch):
+        choice = { 'memory_ceiling': 100.,
+                   'training': { 'batch_size': 64, 'threads': 2 },
+                   'inference': { 'batch_size': 512, 'threads': 1 } }
+        monkeypatch.setattr(autotune, 'autotune', lambda *args: choice)
+        assert autotune.inference_batch_size(self.params) == 100
+        autotune.tune_parameters(self.params)
+        assert self.params.batch_size == 64
+        assert self.params.blas_threads == 2
+        assert autotune.inference_batch_size(self.params) == 512
+        assert self.params.inference_blas_threads == 1
+
+    def test_blas_threads(self):
+        previous = os.environ.get('OMP_NUM_THREADS')
+        with autotune.blas_threads(1):
+            assert os.environ['OPENBLAS_NUM_THREADS'] == '1'
+        assert os.environ.get('OMP_NUM_THREADS') == previous
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import numpy
+import pytest
+from toupee import data
+
+
+class TestBlocked:
+
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.block_size = data.BLOCK_SIZE
+        #small blocks, so that every array spans several of them
+        data.BLOCK_SIZE = 1000
+
+    def teardown_method(self, method):
+        data.BLOCK_SIZE = self.block_size
+        shutil.rmtree(self.directory)
+
+    def dataset(self):
+        rng = numpy.random.RandomState(0)
+        return ((rng.rand(300, 7).astype('float32'),
+                 rng.randint(0, 5, 300).astype('int32')),
+                (rng.randint(0, 255, (20, 3, 4)).astype('uint8'),
+                 numpy.arange(20)),
+                (numpy.zeros((0, 7), dtype='float32'),
+                 numpy.zeros(0, dtype='int32')))
+
+    def test_round_trip(self):
+        filename = os.path.join(self.directory, 'set' + data.BLOCKED_EXTENSION)
+        dataset = self.dataset()
+        data.save_blocked(filename, dataset, level=1)
+        for threads in [1, 4]:
+            loaded = data.load_blocked(filename, threads=threads)
+            for (x, y), (ex, ey) in zip(loaded, dataset):
+                assert x.dtype == ex.dtype and x.shape == ex.shape
+                assert y.dtype == ey.dtype and y.shape == ey.shape
+                assert numpy.array_equal(x, ex)
+                assert numpy.array_equal(y, ey)
+        train, valid, test = data.load_data(filename, one_hot_y=False)
+        assert numpy.array_equal(train[0], dataset[0][0])
+
+    def test_not_blocked(self):
+        filename = os.path.join(self.directory, 'other.zblk')
+        with open(filename, 'wb') as f:
+            f.write('not a dataset')
+        with pytest.raises(ValueError):
+            data.load_blocked(filename)
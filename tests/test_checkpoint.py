@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import numpy
+import pytest
+from toupee.archive import EnsembleArchive
+from toupee.checkpoint import EnsembleCheckpoint, train_ensemble
+from toupee.parameters import Parameters
+from toupee.mlp import build_model
+from toupee.ensemble_methods import Stacking
+from helpers import Crash, RandomMethod, write_model, random_weights, \
+        reference_weights, assert_same_weights
+
+
+class RandomStacking(Stacking):
+    """
+    Stacking with a closed-form head, whose members are random weights
+    """
+
+    def __init__(self, model_file, shapes):
+        self.model_file = model_file
+        self.shapes = shapes
+        self.head = 'nnls'
+
+    def create_member(self, x, y):
+        w = random_weights(self.shapes)
+        self.members.append(w)
+        return build_model(self.model_file, w)
+
+
+class TestCheckpoint:
+
+    def setup_method(self, method):
+        import keras
+        self.directory = tempfile.mkdtemp()
+        model_file, self.shapes = write_model(
+            self.directory, [keras.layers.Dense(2, input_dim=3)])
+        self.params = Parameters(model_file=model_file, ensemble_size=4)
+        self.path = os.path.join(self.directory, 'ensemble')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def method(self, crash_at=None):
+        return RandomMethod(self.params.model_file, self.shapes, crash_at)
+
+    def reference(self):
+        return reference_weights(self.method(), self.params)
+
+    def assert_same(self, members, expected):
+        assert_same_weights([m.get_weights() for m in members], expected)
+
+    def test_resume_after_crash(self):
+        expected = self.reference()
+        numpy.random.seed(1)
+        with pytest.raises(Crash):
+            train_ensemble(self.method(crash_at=2),
+                           self.params, None, None,
+                           checkpoint=EnsembleCheckpoint(self.path))
+        assert len(EnsembleArchive(self.path)) == 2
+        method = self.method()
+        members = train_ensemble(method, self.params, None, None,
+                                 checkpoint=EnsembleCheckpoint(self.path))
+        self.assert_same(members, expected)
+        assert method.alphas == [1., 2., 3., 4.]
+        assert EnsembleArchive(self.path).alphas == [1., 2., 3., 4.]
+
+    def test_unmatched_member_is_discarded(self):
+        numpy.random.seed(1)
+        checkpoint = EnsembleCheckpoint(self.path)
+        checkpoint.start(self.method(), self.params)
+        #a crash between writing the first member and its state
+        checkpoint.archive.add_member(
+            [numpy.zeros(s, dtype='float32') for s in self.shapes])
+        assert checkpoint.exists()
+        members = train_ensemble(self.method(), self.params,
+                                 None, None,
+                                 checkpoint=EnsembleCheckpoint(self.path))
+        self.assert_same(members, self.reference())
+
+    def test_grow(self):
+        numpy.random.seed(1)
+        train_ensemble(self.method(), self.params, None, None,
+                       checkpoint=EnsembleCheckpoint(self.path))
+        members = train_ensemble(self.method(), self.params,
+                                 None, None,
+                                 checkpoint=EnsembleCheckpoint(self.path),
+                                 grow=2)
+        assert len(members) == 6
+        assert len(EnsembleArchive(self.path)) == 6
+
+    def test_refuses_archive_without_state(self):
+        EnsembleArchive.create(self.path, '', method='Random').add_member(
+            [numpy.zeros(s) for s in self.shapes])
+        with pytest.raises(ValueError):
+            EnsembleCheckpoint(self.path).start(self.method(),
+                                                self.params)
+
+    def test_stack_head(self):
+        from toupee.serving import EnsemblePredictor
+        rng = numpy.random.RandomState(0)
+        x = rng.rand(20, 3).astype('float32')
+        y = rng.randint(0, 2, 20)
+        self.params.batch_size = 10
+        method = RandomStacking(self.params.model_file, self.shapes)
+        method.prepare(self.params, [(x, y)] * 3)
+        members = train_ensemble(method, self.params, None, None,
+                                 checkpoint=EnsembleCheckpoint(self.path))
+        archive = EnsembleArchive(self.path)
+        assert archive.head().name == 'nnls'
+        assert numpy.allclose(archive.head().weights,
+                              method.stack_head.weights)
+        predictor = EnsemblePredictor.from_archive(archive)
+        expected = EnsemblePredictor(members, head=method.stack_head)
+        assert numpy.allclose(predictor.predict_proba(x),
+                              expected.predict_proba(x))
@@ -0,0 +1,56 @@
+import os
+import sys
+import shutil
+import tempfile
+import cPickle
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+import convert_caffe
+
+def decode(value):
+    return cPickle.loads(value)
+
+def records(n):
+    return [('{0:08d}'.format(i),
+             cPickle.dumps((numpy.full((1,2,2), i % 256, dtype='uint8'), i), 2))
+            for i in range(n)]
+
+class TestConvertCaffe:
+
+    def check(self, source, where, n):
+        x,y = convert_caffe.load_file(source, where, permute=True, workers=2,
+                decode=decode)
+        assert x.shape == (n,1,2,2)
+        assert sorted(y.tolist()) == range(n)
+        assert y.tolist() != range(n)
+        for i in range(n):
+            assert (x[i] == y[i] % 256).all()
+
+    def test_lmdb(self):
+        lmdb = pytest.importorskip('lmdb')
+        path = tempfile.mkdtemp()
+        try:
+            env = lmdb.open(os.path.join(path, 'db'), map_size=1 << 24)
+            with env.begin(write=True) as txn:
+                for k,v in records(2500):
+                    txn.put(k,v)
+            env.close()
+            self.check(os.path.join(path, 'db'), os.path.join(path, 'out_'),
+                    2500)
+        finally:
+            shutil.rmtree(path)
+
+    def test_leveldb(self):
+        leveldb = pytest.importorskip('leveldb')
+        path = tempfile.mkdtemp()
+        try:
+            db = leveldb.LevelDB(os.path.join(path, 'db'))
+            for k,v in records(2500):
+                db.Put(k,v)
+            del db
+            self.check(os.path.join(path, 'db'), os.path.join(path, 'out_'),
+                    2500)
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,69 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+import convert_uci_dataset
+
+
+class TestConvertUCI:
+
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.read_chunks = convert_uci_dataset.read_chunks
+        #two rows per chunk, so that column types change between chunks
+        convert_uci_dataset.read_chunks = \
+            lambda f, header: self.read_chunks(f, header, chunk_size=2)
+
+    def teardown_method(self, method):
+        convert_uci_dataset.read_chunks = self.read_chunks
+        shutil.rmtree(self.directory)
+
+    def write(self, name, lines):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return filename
+
+    def by_first_column(self, x, y):
+        order = numpy.argsort(x[:, 0])
+        return x[order], y[order]
+
+    def test_convert(self):
+        train = self.write('train.csv', ['a,colour,c,label',
+                                         '1,red,5,yes',
+                                         '2,blue,6,no',
+                                         '3,red,x7,yes',
+                                         '',
+                                         '4,green,8,no'])
+        test = self.write('test.csv', ['a,colour,c,label',
+                                       '5,blue,9,no',
+                                       '6,purple,10,yes'])
+        schema = convert_uci_dataset.Schema(labels_first=False)
+        x, y = self.by_first_column(*convert_uci_dataset.csv_to_numpy(
+            train, schema, header=True, dtype='float32'))
+        assert x.dtype == numpy.float32 and y.dtype == numpy.int32
+        assert x[:, 0].tolist() == [1., 2., 3., 4.]
+        assert x[:, 1].tolist() == [0., 1., 0., 2.]
+        #numeric in the first chunk, categorical from the second one on
+        assert x[:, 2].tolist() == [5., 6., 0., 8.]
+        assert schema.numeric == [True, False, False]
+        assert y.tolist() == [0, 1, 0, 1]
+        x, y = self.by_first_column(*convert_uci_dataset.csv_to_numpy(
+            test, schema, header=True, offset=1))
+        #codes are shared with the first file
+        assert x[:, 1].tolist() == [1., 3.]
+        assert y.tolist() == [2, 1]
+
+    def test_labels_first_memmap(self):
+        train = self.write('train.csv', ['0,1.5', '1,2.5', '0,3.5'])
+        schema = convert_uci_dataset.Schema(labels_first=True)
+        prefix = os.path.join(self.directory, 'tmp_')
+        x, y = convert_uci_dataset.csv_to_numpy(train, schema,
+                                                memmap_prefix=prefix)
+        assert isinstance(x, numpy.memmap)
+        x, y = self.by_first_column(x, y)
+        assert x[:, 0].tolist() == [1.5, 2.5, 3.5]
+        assert y.tolist() == [0, 1, 0]
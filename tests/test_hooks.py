@@ -0,0 +1,57 @@
+import os
+import json
+import tempfile
+from toupee import common
+from toupee.parameters import Parameters
+
+
+class TestHooks:
+
+    def test_training_hooks(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        seen = []
+        common.toupee_global_instance.add_epoch_hook(seen.append)
+        try:
+            t = common.training_hooks(Parameters(epoch_log=path, trial=3))
+            t.training_reset()
+            t.epoch_done({'epoch': 1, 'wall_time': 0.5})
+            t.epoch_done({'epoch': 2, 'wall_time': 0.25})
+            with open(path) as f:
+                records = [json.loads(l) for l in f]
+        finally:
+            common.toupee_global_instance.reset()
+            os.remove(path)
+        assert [s['epoch'] for s in seen] == [1, 2]
+        assert records[1] == {'epoch': 2, 'wall_time': 0.25, 'trial': 3}
+
+    def test_no_db_without_results_db(self):
+        t = common.training_hooks(Parameters(epoch_stats_table='epochs'))
+        assert t.epoch_hooks == []
+
+    def test_results_db_hook(self):
+        inserted = []
+
+        class Table:
+            full_name = 'toupee.epochs'
+
+            def insert(self, record):
+                inserted.append(record)
+
+        class Client(dict):
+            def __missing__(self, name):
+                return {'epochs': Table()}
+
+        common.mongo_clients['dbhost'] = Client()
+        try:
+            params = Parameters(results_db='toupee', results_host='dbhost',
+                                epoch_stats_table='epochs', trial=1)
+            t = common.training_hooks(params)
+            t.epoch_done({'epoch': 1})
+            hook = t.epoch_hooks[0]
+            table = hook.table
+            t.epoch_done({'epoch': 2})
+            assert hook.table is table
+        finally:
+            del common.mongo_clients['dbhost']
+        assert inserted == [{'epoch': 1, 'trial': 1}, {'epoch': 2, 'trial': 1}]
@@ -0,0 +1,30 @@
+import os
+import imp
+
+hotpaths = imp.load_source('hotpaths', os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'benchmarks', 'hotpaths.py'))
+
+
+class TestHotpaths:
+
+    def test_run_case(self):
+        r = hotpaths.spawn_case('one_hot', 0.001, 2)
+        assert r['items'] == 1000
+        assert r['median'] >= r['min'] > 0.
+        assert r['throughput'] > 0. and r['peak_rss_growth_mb'] >= 0.
+
+    def test_regressions(self):
+        baseline = {'cases': {
+            'one_hot': {'median': 1., 'peak_rss_growth_mb': 100.},
+            'resample': {'median': 2., 'peak_rss_growth_mb': 50.},
+            'transformer': {'median': 1., 'peak_rss_growth_mb': 0.}}}
+        results = {'cases': {
+            'one_hot': {'median': 1.1, 'peak_rss_growth_mb': 130.},
+            'resample': {'median': 3., 'peak_rss_growth_mb': 50.},
+            'transformer': {'median': 1., 'peak_rss_growth_mb': 0.5},
+            'pad_dataset': {'median': 9., 'peak_rss_growth_mb': 9.}}}
+        regressions = sorted(hotpaths.compare(results, baseline, 0.2))
+        assert len(regressions) == 2
+        assert regressions[0].startswith('one_hot: peak_rss_growth_mb')
+        assert regressions[1].startswith('resample: median')
+        assert hotpaths.compare(results, baseline, 0.6) == []
@@ -0,0 +1,94 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import numpy
+import dill
+from toupee import inference
+from toupee.archive import save_ensemble
+from toupee.parameters import Parameters
+
+
+class Method:
+    yaml_tag = u'!Bagging'
+
+    def __init__(self, voting=False):
+        self.voting = voting
+
+
+def member(seed):
+    import keras
+    numpy.random.seed(seed)
+    m = keras.models.Sequential([
+        keras.layers.Dense(16, input_dim=12, activation='tanh'),
+        keras.layers.Dense(3, activation='softmax')])
+    m.compile('sgd', 'categorical_crossentropy')
+    return m
+
+
+class TestInference:
+
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.x = numpy.random.RandomState(0).rand(40, 12).astype('float32')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def reference(self, members):
+        return numpy.mean([m.predict(self.x) for m in members], axis=0)
+
+    def test_export_archive(self):
+        members = [member(i) for i in range(3)]
+        path = os.path.join(self.directory, 'ensemble')
+        save_ensemble(path, members[0].to_yaml(), members, method=Method())
+        filename = os.path.join(self.directory, 'bundle.npz')
+        inference.export(path, filename)
+        assert inference.is_bundle(filename)
+        predictor = inference.load_bundle(filename)
+        assert numpy.allclose(predictor.predict_proba(self.x),
+                              self.reference(members), atol=1e-5)
+
+    def test_export_pickled_weights(self):
+        members = [member(i) for i in range(2)]
+        model_file = os.path.join(self.directory, 'model.yaml')
+        with open(model_file, 'w') as f:
+            f.write(members[0].to_yaml())
+        pickled = os.path.join(self.directory, 'members.dill')
+        with open(pickled, 'wb') as f:
+            dill.dump([m.get_weights() for m in members], f)
+        filename = os.path.join(self.directory, 'bundle.npz')
+        inference.export(pickled, filename, model_file=model_file,
+                         method=Method(voting=True))
+        predictor = inference.load_bundle(filename)
+        assert predictor.voting
+        votes = [numpy.eye(3)[m.predict(self.x).argmax(axis=1)]
+                 for m in members]
+        assert numpy.allclose(predictor.predict_proba(self.x),
+                              numpy.mean(votes, axis=0))
+
+    def test_cold_start(self):
+        members = [member(i) for i in range(5)]
+        path = os.path.join(self.directory, 'ensemble')
+        save_ensemble(path, members[0].to_yaml(), members, method=Method())
+        filename = os.path.join(self.directory, 'bundle.npz')
+        inference.export(path, filename)
+        numpy.save(os.path.join(self.directory, 'x.npy'), self.x)
+        script = ("import sys, time, json, numpy\n"
+                  "start = time.time()\n"
+                  "from toupee.inference import load_bundle\n"
+                  "p = load_bundle(sys.argv[1])\n"
+                  "y = p.predict(numpy.load(sys.argv[2]))\n"
+                  "print json.dumps({'seconds': time.time() - start,\n"
+                  "    'modules': [m for m in ['keras', 'theano', 'dill']\n"
+                  "                if m in sys.modules]})\n")
+        root = os.path.join(os.path.dirname(__file__), '..')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+        output = subprocess.check_output([sys.executable, '-c', script,
+            filename, os.path.join(self.directory, 'x.npy')], env=env)
+        result = json.loads(output.strip().split('\n')[-1])
+        assert result['modules'] == []
+        assert result['seconds'] < 1.
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import numpy
+import pytest
+from toupee.archive import EnsembleArchive
+from toupee.checkpoint import EnsembleCheckpoint, train_ensemble
+from toupee.member_store import MemberStore
+from toupee.parameters import Parameters
+from toupee.serving import EnsemblePredictor
+from toupee.mlp import build_model
+from helpers import RandomMethod, write_model, reference_weights, \
+        assert_same_weights
+
+
+class TestMemberStore:
+
+    def setup_method(self, method):
+        import keras
+        self.directory = tempfile.mkdtemp()
+        model_file, self.shapes = write_model(
+            self.directory, [keras.layers.Dense(2, input_dim=3),
+                             keras.layers.Activation('softmax')])
+        self.params = Parameters(model_file=model_file, ensemble_size=4,
+                                 batch_size=10)
+        self.x = numpy.random.RandomState(0).rand(7, 3).astype('float32')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def method(self):
+        return RandomMethod(self.params.model_file, self.shapes)
+
+    def reference(self):
+        return reference_weights(self.method(), self.params)
+
+    def assert_same(self, store, expected):
+        assert_same_weights([store.weights(i) for i in range(len(store))],
+                            expected)
+        assert_same_weights([m.get_weights() for m in store], expected)
+
+    def test_bounded_training(self):
+        expected = self.reference()
+        numpy.random.seed(1)
+        method = self.method()
+        store = train_ensemble(method, self.params, None, None, max_loaded=1,
+                               cached_sets={'valid': self.x})
+        try:
+            assert isinstance(store, MemberStore)
+            assert len(store.models) == 0
+            assert all(isinstance(w, numpy.memmap)
+                       for m in method.members for w in m)
+            assert EnsembleArchive(store.archive.path).alphas == \
+                [1., 2., 3., 4.]
+            #rebuilding members leaves the random state alone
+            state = numpy.random.get_state()[1].copy()
+            self.assert_same(store, expected)
+            assert numpy.array_equal(numpy.random.get_state()[1], state)
+            assert len(store.models) == 1
+            assert store[-1] is store[3]
+            assert len(store[1:3]) == 2
+            with pytest.raises(IndexError):
+                store[4]
+            predictor = EnsemblePredictor(store, batch_size=10)
+            assert numpy.allclose(predictor.combine(store.outputs('valid')),
+                                  predictor.predict_proba(self.x))
+            assert store.outputs('test') is None
+        finally:
+            store.close()
+        assert not os.path.exists(store.archive.path)
+
+    def test_checkpoint_store(self):
+        expected = self.reference()
+        path = os.path.join(self.directory, 'ensemble')
+        numpy.random.seed(1)
+        self.params.ensemble_size = 2
+        train_ensemble(self.method(), self.params, None, None,
+                       checkpoint=EnsembleCheckpoint(path), max_loaded=2)
+        self.params.ensemble_size = 4
+        store = train_ensemble(self.method(), self.params, None, None,
+                               checkpoint=EnsembleCheckpoint(path),
+                               max_loaded=2, cached_sets={'valid': self.x})
+        assert store.archive.path == path
+        assert len(EnsembleArchive(path)) == 4
+        self.assert_same(store, expected)
+        assert store.outputs('valid') is not None
+        store.close()
+        assert os.path.isdir(path)
+
+    def test_outputs_need_a_store(self):
+        with pytest.raises(ValueError):
+            train_ensemble(self.method(), self.params, None, None,
+                           cached_sets={'valid': self.x})
+
+    def test_lazy_predictor(self):
+        from toupee.archive import save_ensemble
+        rng = numpy.random.RandomState(2)
+        weights = [[rng.rand(*s).astype('float32') for s in self.shapes]
+                   for i in range(3)]
+        path = os.path.join(self.directory, 'ensemble')
+        with open(self.params.model_file) as f:
+            save_ensemble(path, f.read(), weights)
+        expected = numpy.mean([build_model(self.params.model_file, w)
+                               .predict(self.x) for w in weights], axis=0)
+        predictor = EnsemblePredictor.from_archive(EnsembleArchive(path),
+                                                   batch_size=10)
+        assert len(predictor.members.models) == 0
+        assert numpy.allclose(predictor.predict_proba(self.x), expected)
+        assert len(predictor.members.models) == 3
+        predictor = EnsemblePredictor.from_archive(EnsembleArchive(path),
+                                                   max_loaded=1)
+        assert numpy.allclose(predictor.predict_proba(self.x), expected)
+        assert len(predictor.members.models) == 1
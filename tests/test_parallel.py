@@ -0,0 +1,67 @@
+import numpy
+import pytest
+import keras
+from toupee import parallel
+
+
+class StopAfterFirstEpoch(keras.callbacks.Callback):
+
+    def on_epoch_end(self, epoch, logs={}):
+        self.model.stop_training = True
+
+
+class TestParallel:
+
+    def dataset(self):
+        rng = numpy.random.RandomState(0)
+        x = rng.randn(300, 5).astype('float32')
+        labels = (x[:, 0] > 0).astype('int32') + (x[:, 1] > 0)
+        y = numpy.zeros((300, 3), dtype='float32')
+        y[numpy.arange(300), labels] = 1.
+        return x, y
+
+    def model(self):
+        numpy.random.seed(3)
+        model = keras.models.Sequential([
+            keras.layers.Dense(8, input_dim=5, activation='relu'),
+            keras.layers.Dense(3, activation='softmax')])
+        model.compile('rmsprop', 'categorical_crossentropy',
+                      metrics=['accuracy'])
+        return model
+
+    def test_allreduce_matches_single_process(self):
+        x, y = self.dataset()
+        reference = self.model()
+        expected = reference.fit(x, y, batch_size=30, nb_epoch=2,
+                                 shuffle=False, verbose=0)
+        for processes in [2, 3]:
+            model = self.model()
+            history = parallel.fit(model, x, y, 30, 2, 'allreduce',
+                                   processes, shuffle=False,
+                                   validate=lambda: model.evaluate(
+                                       x, y, verbose=0))
+            for a, b in zip(reference.get_weights(), model.get_weights()):
+                assert numpy.allclose(a, b, atol=1e-5)
+            assert numpy.allclose(history.history['loss'],
+                                  expected.history['loss'], atol=1e-5)
+            assert len(history.history['val_loss']) == 2
+
+    def test_hogwild_learns(self):
+        x, y = self.dataset()
+        model = self.model()
+        before = model.evaluate(x, y, verbose=0)[0]
+        parallel.fit(model, x, y, 10, 5, 'hogwild', 3,
+                     rng=numpy.random.RandomState(0))
+        assert model.evaluate(x, y, verbose=0)[0] < before
+
+    def test_callbacks_stop_every_process(self):
+        x, y = self.dataset()
+        model = self.model()
+        history = parallel.fit(model, x, y, 30, 5, 'allreduce', 2,
+                               callbacks=[StopAfterFirstEpoch()])
+        assert len(history.history['loss']) == 1
+
+    def test_unknown_method(self):
+        x, y = self.dataset()
+        with pytest.raises(ValueError):
+            parallel.fit(self.model(), x, y, 30, 1, 'greedy', 2)
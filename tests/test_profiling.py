@@ -0,0 +1,36 @@
+import os
+import json
+import tempfile
+from toupee.profiling import Profiler
+
+
+class TestProfiler:
+
+    def test_disabled(self):
+        p = Profiler()
+        with p.phase('fit'):
+            pass
+        assert p.records == []
+
+    def test_members(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        p = Profiler()
+        p.enable(output=path, report_at_exit=False)
+        with p.phase('load_data'):
+            pass
+        for i in range(2):
+            with p.phase('create_member', member=True):
+                with p.phase('fit'):
+                    pass
+                with p.phase('fit'):
+                    pass
+        p.finish()
+        with open(path) as f:
+            summary = json.load(f)
+        os.remove(path)
+        assert summary['phases']['create_member/fit'][0] == 4
+        assert summary['phases']['load_data'][0] == 1
+        assert len(summary['members']) == 2
+        assert summary['members'][1]['create_member/fit'][0] == 2
+        assert 'load_data' not in summary['members'][0]
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import numpy
+import pytest
+from toupee import quantization
+from toupee.archive import save_ensemble
+from toupee.inference import NumpyModel, NumpyEnsemblePredictor, \
+        save_bundle, load_bundle
+from toupee.serving import EnsemblePredictor
+
+
+def mlp(seed):
+    import keras
+    numpy.random.seed(seed)
+    m = keras.models.Sequential([
+        keras.layers.Dense(32, input_dim=20, activation='relu'),
+        keras.layers.Dropout(0.5),
+        keras.layers.Dense(4),
+        keras.layers.Activation('softmax')])
+    m.compile('sgd', 'categorical_crossentropy')
+    return m
+
+
+def cnn():
+    import keras
+    from keras.layers import Convolution2D, MaxPooling2D, Flatten, Dense
+    numpy.random.seed(0)
+    m = keras.models.Sequential([
+        Convolution2D(4, 3, 3, border_mode='same', activation='relu',
+                      input_shape=(2, 8, 8)),
+        Convolution2D(3, 3, 2, border_mode='valid'),
+        MaxPooling2D((2, 2)),
+        Flatten(),
+        Dense(5, activation='softmax')])
+    m.compile('sgd', 'categorical_crossentropy')
+    return m
+
+
+class TestQuantization:
+
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def ensemble(self):
+        members = [mlp(i) for i in range(3)]
+        path = os.path.join(self.directory, 'ensemble')
+        archive = save_ensemble(path, members[0].to_yaml(), members,
+                                method='AdaBoost_M1', alphas=[1., 2., 0.5])
+        return members, archive
+
+    def test_numpy_forward_pass(self):
+        for m, shape in [(mlp(0), (13, 20)), (cnn(), (6, 2, 8, 8))]:
+            x = numpy.random.RandomState(1).rand(*shape).astype('float32')
+            n = NumpyModel.from_architecture(m.to_yaml(), m.get_weights())
+            assert numpy.allclose(n.predict(x, batch_size=4), m.predict(x),
+                                  atol=1e-5)
+
+    def test_per_channel_int8(self):
+        w = numpy.random.RandomState(0).randn(20, 6).astype('float32')
+        w[:, 2] *= 100.
+        q = quantization.QuantizedArray.quantize(w, 1)
+        assert q.values.dtype == numpy.int8
+        assert q.scale.shape == (1, 6)
+        #every column keeps its own precision
+        assert numpy.all(numpy.abs(q.dequantize() - w) <=
+                         q.scale / 2. + 1e-6)
+        assert q.nbytes < w.nbytes / 3
+
+    def test_quantized_ensemble(self):
+        members, archive = self.ensemble()
+        x = numpy.random.RandomState(2).rand(300, 20).astype('float32')
+        reference = EnsemblePredictor.from_archive(archive)
+        y = reference.predict(x)
+        float_ensemble = NumpyEnsemblePredictor.from_archive(archive)
+        assert numpy.allclose(float_ensemble.predict_proba(x),
+                              reference.predict_proba(x), atol=1e-5)
+        for mode in ['int8', 'float16']:
+            quantized = quantization.quantize_ensemble(float_ensemble, mode,
+                                                       x[:100])
+            assert quantized.weights == [1., 2., 0.5]
+            report = quantization.accuracy_report(reference, quantized, x, y)
+            assert report['reference_accuracy'] == 1.
+            assert report['agreement'] > 0.95
+            assert abs(report['accuracy_delta']) < 0.05
+            assert report['quantized_bytes'] < report['reference_bytes'] / 1.9
+            assert report['quantized_latency'] > 0.
+
+    def test_bundle(self):
+        members, archive = self.ensemble()
+        x = numpy.random.RandomState(3).rand(50, 20).astype('float32')
+        quantized = quantization.quantize_ensemble(
+            NumpyEnsemblePredictor.from_archive(archive), 'int8', x)
+        filename = os.path.join(self.directory, 'q.npz')
+        save_bundle(filename, quantized)
+        loaded = load_bundle(filename)
+        assert isinstance(loaded.members[0].get_weights()[0],
+                          quantization.QuantizedArray)
+        assert loaded.weights == [1., 2., 0.5]
+        assert numpy.allclose(loaded.predict_proba(x),
+                              quantized.predict_proba(x))
+
+    def test_dequantized_once(self):
+        members, archive = self.ensemble()
+        x = numpy.random.RandomState(4).rand(30, 20).astype('float32')
+        quantized = quantization.quantize_ensemble(
+            NumpyEnsemblePredictor.from_archive(archive), 'int8', x)
+        expected = quantized.predict_proba(x)
+        assert len(quantized.loaded) == 3
+        member = quantized.members[0]
+        #kept from the first request, not dequantized again
+        assert quantized.member_weights(member) is \
+            quantized.member_weights(member)
+        bounded = NumpyEnsemblePredictor(quantized.members,
+                                         weights=quantized.weights,
+                                         max_loaded=1)
+        assert numpy.allclose(bounded.predict_proba(x), expected)
+        assert len(bounded.loaded) == 1
+        with pytest.raises(ValueError):
+            NumpyEnsemblePredictor(quantized.members, max_loaded=0)
+
+    def test_unknown_mode(self):
+        members, archive = self.ensemble()
+        with pytest.raises(ValueError):
+            quantization.quantize_ensemble(
+                NumpyEnsemblePredictor.from_archive(archive), 'int4')
@@ -0,0 +1,100 @@
+import numpy
+import pytest
+from toupee import mlp
+from toupee.ensemble_methods import Bagging, AdaBoost_M1, DIB, \
+    bootstrap_counts
+from toupee.parameters import Parameters
+
+
+class Model:
+    """
+    A member that predicts class 0 for everything
+    """
+
+    def __init__(self):
+        self.inputs = [type('Input', (), {'_keras_shape': (None, 3)})]
+
+    def get_weights(self):
+        return [numpy.zeros(2)]
+
+    def predict(self, x, batch_size=None, verbose=0):
+        p = numpy.zeros((len(x), 2), dtype='float32')
+        p[:, 0] = 1.
+        return p
+
+
+class TestSampleWeighting:
+
+    def setup_method(self, method):
+        self.calls = []
+        self.original = mlp.sequential_model
+
+        def sequential_model(dataset, params, pretraining_set=None,
+                             model_weights=None, callbacks=None,
+                             sample_weight=None):
+            self.calls.append((dataset[0], sample_weight))
+            return Model()
+        mlp.sequential_model = sequential_model
+
+    def teardown_method(self, method):
+        mlp.sequential_model = self.original
+
+    def dataset(self, n=100):
+        x = numpy.arange(n * 3, dtype='float32').reshape((n, 3))
+        y = (numpy.arange(n) % 4 == 0).astype('int32')
+        return [(x, y)] * 3
+
+    def params(self):
+        return Parameters(n_epochs=1, resample_size=100, pretraining=None,
+                          random_seed=None, batch_size=16)
+
+    def test_bootstrap_counts(self):
+        rng = numpy.random.RandomState(0)
+        counts = bootstrap_counts(1000, 1000, 'multinomial', rng)
+        assert counts.sum() == 1000
+        #about 1 - 1/e of the instances are drawn at least once
+        assert 0.58 < numpy.mean(counts > 0) < 0.68
+        counts = bootstrap_counts(1000, 500, 'poisson', rng)
+        assert 400 < counts.sum() < 600
+        with pytest.raises(ValueError):
+            bootstrap_counts(10, 10, 'uniform', rng)
+
+    def test_bagging(self):
+        method = Bagging()
+        method.sample_weighting = 'multinomial'
+        dataset = self.dataset()
+        method.prepare(self.params(), dataset)
+        method.create_member(None, None)
+        train, weights = self.calls[0]
+        #the training set itself, not a copy
+        assert train[0] is dataset[0][0]
+        assert weights.shape == (100,) and weights.sum() == 100
+
+    def test_bagging_resamples_by_default(self):
+        method = Bagging()
+        method.prepare(self.params(), self.dataset())
+        method.create_member(None, None)
+        train, weights = self.calls[0]
+        assert weights is None and len(train[0]) == 100
+
+    def test_adaboost(self):
+        method = AdaBoost_M1.__new__(AdaBoost_M1)
+        method.sample_weighting = 'distribution'
+        method.prepare(self.params(), self.dataset())
+        method.create_member(None, None)
+        method.create_member(None, None)
+        first, second = [w for train, w in self.calls]
+        assert numpy.allclose(first, 1.)
+        #the 25 misclassified instances now carry half of the weight
+        assert numpy.isclose(second.mean(), 1.)
+        assert numpy.isclose(second[::4].sum(), 50.)
+
+    def test_unsupported(self):
+        method = AdaBoost_M1.__new__(AdaBoost_M1)
+        method.sample_weighting = 'poisson'
+        with pytest.raises(ValueError):
+            method.prepare(self.params(), self.dataset())
+        method = DIB.__new__(DIB)
+        method.sample_weighting = 'distribution'
+        with pytest.raises(ValueError):
+            method.prepare(self.params(), self.dataset())
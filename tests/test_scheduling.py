@@ -0,0 +1,62 @@
+import os
+import tempfile
+import multiprocessing
+import pytest
+from toupee.scheduling import SuccessiveHalving
+
+
+def report_losses(args):
+    path, run = args
+    scheduler = SuccessiveHalving(path, min_epochs=1, reduction_factor=2,
+                                  max_epochs=10)
+    return scheduler.report(run, 1, float(run))
+
+
+class TestSuccessiveHalving:
+
+    def test_rungs(self):
+        assert SuccessiveHalving(min_epochs=2, reduction_factor=3,
+                                 max_epochs=50).rungs == [2, 6, 18]
+
+    def test_reduction_factor_refused(self):
+        for factor in [1, 0.5, 0]:
+            with pytest.raises(ValueError):
+                SuccessiveHalving.from_config({'reduction_factor': factor})
+
+    def test_min_epochs_refused(self):
+        for epochs in [0, -1]:
+            with pytest.raises(ValueError):
+                SuccessiveHalving.from_config({'min_epochs': epochs})
+
+    def test_mode_refused(self):
+        with pytest.raises(ValueError):
+            SuccessiveHalving.from_config({'mode': 'maximum'})
+
+    def test_stops_worse_runs(self):
+        scheduler = SuccessiveHalving(min_epochs=1, reduction_factor=3)
+        assert scheduler.report(0, 1, 1.0)
+        assert scheduler.report(1, 1, 2.0)
+        assert not scheduler.report(2, 1, 3.0)
+        assert scheduler.report(3, 1, 0.5)
+        assert scheduler.report(3, 2, 100.)
+
+    def test_max_mode(self):
+        scheduler = SuccessiveHalving(min_epochs=1, reduction_factor=2,
+                                      metric='val_acc', mode='max')
+        assert scheduler.report(0, 1, 90.)
+        assert not scheduler.report(1, 1, 80.)
+        assert scheduler.report(2, 1, 95.)
+
+    def test_shared_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            pool = multiprocessing.Pool(4)
+            kept = pool.map(report_losses, [(path, i) for i in range(8)])
+            pool.close()
+            pool.join()
+            scheduler = SuccessiveHalving(path, min_epochs=1)
+            assert len(scheduler._update(1, 'check', 0.)) == 9
+            assert kept[0]
+        finally:
+            os.remove(path)
@@ -0,0 +1,143 @@
+import json
+import threading
+import httplib
+import numpy
+import pytest
+from toupee.serving import MicroBatcher, make_server, EnsemblePredictor
+
+class TestServing:
+
+    def predictor(self):
+        self.calls = []
+        def f(x):
+            self.calls.append(x.shape[0])
+            return numpy.concatenate([x, -x], axis=1)
+        return f
+
+    def test_micro_batching(self):
+        batcher = MicroBatcher(self.predictor(), max_batch_size=8,
+                max_latency=0.2).start()
+        requests = [batcher.submit(numpy.asarray([[float(i)]]))
+                    for i in range(6)]
+        results = [r.wait(5.) for r in requests]
+        batcher.stop()
+        for i, r in enumerate(results):
+            assert r.tolist() == [[float(i), -float(i)]]
+        assert self.calls == [6]
+        metrics = batcher.metrics.snapshot()
+        assert metrics['requests'] == 6
+        assert metrics['batches'] == 1
+        assert metrics['batch_rows']['max'] == 6
+
+    def test_max_batch_size(self):
+        batcher = MicroBatcher(self.predictor(), max_batch_size=4,
+                max_latency=0.2).start()
+        requests = [batcher.submit(numpy.ones((3,1))) for i in range(3)]
+        for r in requests:
+            assert r.wait(5.).shape == (3,2)
+        batcher.stop()
+        assert self.calls == [3,3,3]
+
+    def test_mixed_shapes(self):
+        batcher = MicroBatcher(self.predictor(), max_batch_size=8,
+                max_latency=0.2).start()
+        requests = [batcher.submit(numpy.ones((1, 1))),
+                    batcher.submit(numpy.ones((1, 2))),
+                    batcher.submit(numpy.ones((2, 2)))]
+        shapes = [r.wait(5.).shape for r in requests]
+        batcher.stop()
+        assert shapes == [(1, 2), (1, 4), (2, 4)]
+        assert self.calls == [1, 3]
+
+    def test_http(self):
+        batcher = MicroBatcher(self.predictor()).start()
+        server = make_server(batcher, ('127.0.0.1', 0))
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        conn = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+        conn.request('POST', '/predict', json.dumps({'x': [[1.],[-2.]]}))
+        reply = json.loads(conn.getresponse().read())
+        assert reply['y'] == [0, 1]
+        conn.request('GET', '/metrics')
+        metrics = json.loads(conn.getresponse().read())
+        assert metrics['requests'] == 1
+        server.shutdown()
+        batcher.stop()
+
+    def test_http_refuses_wrong_shape(self):
+        batcher = MicroBatcher(self.predictor()).start()
+        server = make_server(batcher, ('127.0.0.1', 0), input_shape=[1])
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        conn = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+        for x in [[[1., 2.]], [[1.], [2., 3.]]]:
+            conn.request('POST', '/predict', json.dumps({'x': x}))
+            response = conn.getresponse()
+            assert response.status == 400
+            assert 'error' in json.loads(response.read())
+        conn.request('POST', '/predict', json.dumps({'x': [2.]}))
+        assert json.loads(conn.getresponse().read())['y'] == [0]
+        server.shutdown()
+        batcher.stop()
+        assert self.calls == [1]
+
+
+class Member:
+
+    def __init__(self, outputs):
+        self.outputs = numpy.asarray(outputs)
+        self.inputs = [type('Input', (), {'_keras_shape': (None, 1)})]
+
+    def predict(self, x, batch_size=None, verbose=0):
+        return self.outputs[:x.shape[0]]
+
+
+class TestEnsemblePredictor:
+
+    def members(self):
+        return [Member([[0.6, 0.4], [0.1, 0.9]]),
+                Member([[0.3, 0.7], [0.2, 0.8]]),
+                Member([[0.4, 0.6], [0.7, 0.3]])]
+
+    def test_averaging(self):
+        p = EnsemblePredictor(self.members()).predict_proba(numpy.zeros((2, 1)))
+        assert numpy.allclose(p, [[1.3 / 3, 1.7 / 3], [1. / 3, 2. / 3]])
+        assert EnsemblePredictor(self.members()).input_shape() == [1]
+
+    def test_weighted(self):
+        predictor = EnsemblePredictor(self.members(), weights=[3., 1., 0.])
+        p = predictor.predict_proba(numpy.zeros((2, 1)))
+        assert numpy.allclose(p, [[0.525, 0.475], [0.125, 0.875]])
+        assert predictor.predict(numpy.zeros((2, 1))).tolist() == [0, 1]
+
+    def test_voting(self):
+        predictor = EnsemblePredictor(self.members(), voting=True)
+        p = predictor.predict_proba(numpy.zeros((2, 1)))
+        assert numpy.allclose(p, [[1. / 3, 2. / 3], [1. / 3, 2. / 3]])
+
+    def test_refuses_stacking(self):
+        from toupee.ensemble_methods import Stacking
+        method = Stacking.__new__(Stacking)
+        with pytest.raises(ValueError):
+            EnsemblePredictor.from_method(self.members(), method)
+
+    def test_weighted_needs_alphas(self):
+        from toupee.ensemble_methods import DIB
+        #as loaded from the YAML, without the alphas learnt in training
+        method = DIB.__new__(DIB)
+        with pytest.raises(ValueError):
+            EnsemblePredictor.from_method(self.members(), method)
+        method.alphas = [3., 1.]
+        with pytest.raises(ValueError):
+            EnsemblePredictor.from_method(self.members(), method)
+        method.alphas = [3., 1., 0.]
+        predictor = EnsemblePredictor.from_method(self.members(), method)
+        assert predictor.weights == [3., 1., 0.]
+
+if __name__ == "__main__":
+    t = TestServing()
+    t.test_micro_batching()
+    t.test_max_batch_size()
+    t.test_http()
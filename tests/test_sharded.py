@@ -0,0 +1,88 @@
+import shutil
+import tempfile
+import numpy
+from toupee import sharded
+
+class TestSharded:
+
+    def dataset(self):
+        x = numpy.arange(230 * 3, dtype='float32').reshape((230, 3))
+        y = numpy.arange(230) % 7
+        return x, y
+
+    def test_gather(self):
+        path = tempfile.mkdtemp()
+        try:
+            x, y = self.dataset()
+            sharded.write_sharded(path, [(x, y), (x[:10], y[:10]),
+                                         (x[:20], y[:20])], shard_size=50)
+            sx, sy = sharded.load_split(path, 'train', cache_size=2)
+            assert sx.shape == (230, 3)
+            assert sy.n_classes == 7
+            idx = numpy.random.RandomState(0).randint(0, 230, 500)
+            assert numpy.array_equal(sx[idx], x[idx])
+            assert numpy.array_equal(sy[idx], y[idx])
+            assert numpy.array_equal(sx[45:55], x[45:55])
+            assert numpy.array_equal(sx[-1], x[-1])
+            assert len(sx.cache.shards) <= 2
+            sub = sx.subset(idx).subset([3, 1])
+            assert numpy.array_equal(sub[:], x[idx[[3, 1]]])
+            assert sx.reshape((230, 3, 1))[:2].shape == (2, 3, 1)
+        finally:
+            shutil.rmtree(path)
+
+    def test_minibatches(self):
+        path = tempfile.mkdtemp()
+        try:
+            x, y = self.dataset()
+            sharded.write_sharded(path, [(x, y)] * 3, shard_size=50)
+            sx, sy = sharded.load_split(path, 'valid')
+            seen = []
+            rng = numpy.random.RandomState(1)
+            for bx, by in sharded.iterate_minibatches(sx, sy, 32,
+                    shuffle=True, rng=rng):
+                assert numpy.array_equal((bx[:, 0] / 3) % 7, by)
+                seen.extend(by.tolist())
+            assert len(seen) == 230
+            assert sorted(seen) == sorted(y.tolist())
+        finally:
+            shutil.rmtree(path)
+
+    def test_member_errors(self):
+        import keras
+        from toupee.ensemble_methods import member_errors, Stacking
+        path = tempfile.mkdtemp()
+        try:
+            x, y = self.dataset()
+            sharded.write_sharded(path, [(x, y)] * 3, shard_size=50)
+            sx, sy = sharded.load_split(path, 'train')
+            model = keras.models.Sequential([keras.layers.Dense(7,
+                input_dim=3, activation='softmax')])
+            expected = member_errors(model, (x, y), 64)
+
+            def refuse(self, dtype=None):
+                raise AssertionError("the whole set was read into memory")
+            original = sharded.ShardedArray.__array__
+            sharded.ShardedArray.__array__ = refuse
+            try:
+                errors = member_errors(model, (sx, sy), 64)
+            finally:
+                sharded.ShardedArray.__array__ = original
+            assert numpy.array_equal(errors, expected)
+            assert errors.shape == (230,)
+            try:
+                Stacking.__new__(Stacking).prepare(None, [(sx, sy)] * 3)
+                assert False
+            except ValueError:
+                pass
+        finally:
+            shutil.rmtree(path)
+
+    def test_minibatch_weights(self):
+        x, y = self.dataset()
+        w = numpy.arange(230, dtype='float32')
+        batches = list(sharded.iterate_minibatches(x, y, 64, shuffle=True,
+                                                   weights=w))
+        for bx, by, bw in batches:
+            assert numpy.array_equal(bx[:, 0] / 3, bw)
+        assert sum(len(b[2]) for b in batches) == 230
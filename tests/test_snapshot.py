@@ -0,0 +1,60 @@
+import math
+import numpy
+import keras
+from toupee import mlp
+from toupee.ensemble_methods import Snapshot
+from toupee.parameters import Parameters
+
+
+class Optimizer:
+
+    def __init__(self, lr):
+        self.lr = keras.backend.variable(lr)
+
+
+class Model:
+
+    def __init__(self):
+        self.optimizer = Optimizer(0.1)
+        self.step = 0
+
+    def get_weights(self):
+        return [numpy.asarray([float(self.step)])]
+
+
+class TestSnapshot:
+
+    def dataset(self):
+        return [(numpy.zeros((4, 2)), numpy.zeros(4))] * 3
+
+    def test_schedule(self):
+        callback = mlp.CosineAnnealingSnapshots(cycle_epochs=2,
+                                                batches_per_epoch=2)
+        model = Model()
+        callback.model = model
+        callback.on_train_begin()
+        lrs = []
+        for epoch in range(4):
+            for batch in range(2):
+                callback.on_batch_begin(batch)
+                lrs.append(float(keras.backend.get_value(model.optimizer.lr)))
+                model.step += 1
+            callback.on_epoch_end(epoch)
+        expected = [0.05 * (math.cos(math.pi * t) + 1.)
+                    for t in [0., .25, .5, .75]] * 2
+        assert numpy.allclose(lrs, expected)
+        #a snapshot at the end of every cycle, after epochs 2 and 4
+        assert [s[0][0] for s in callback.snapshots] == [4., 8.]
+
+    def test_state_keeps_pending_snapshots(self):
+        method = Snapshot.__new__(Snapshot)
+        method.prepare(Parameters(model_file=None), self.dataset())
+        method.snapshots = [[numpy.full(2, float(i))] for i in range(4)]
+        method.members = method.snapshots[:3]
+        state = method.get_state()
+        assert len(state['snapshots']) == 1
+        restored = Snapshot.__new__(Snapshot)
+        restored.prepare(Parameters(model_file=None), self.dataset())
+        restored.set_state(state)
+        assert restored.snapshots[3][0][0] == 3.
+        assert restored.snapshots[:3] == [None] * 3
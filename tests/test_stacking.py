@@ -0,0 +1,222 @@
+import os
+import shutil
+import tempfile
+import numpy
+import pytest
+from toupee import stacking
+from toupee.parameters import Parameters
+
+
+def seen_by_member(train_set, valid_set, x, params):
+    """
+    A fake member whose first output says whether it was trained on each
+    instance (x holds instance ids), and whose second depends on its seed
+    """
+    log = os.path.join(os.path.dirname(params.model_file), 'calls')
+    with open(log, 'a') as f:
+        f.write('x\n')
+    train_ids = numpy.asarray(train_set[0])[:, 0]
+    x = numpy.asarray(x)[:, 0]
+    return numpy.stack([numpy.in1d(x, train_ids),
+                        numpy.ones(len(x)) * numpy.random.rand()], axis=1)
+
+
+class TestStacking:
+
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        model_file = os.path.join(self.directory, 'model.yaml')
+        with open(model_file, 'w') as f:
+            f.write('model')
+        self.params = Parameters(model_file=model_file, resample_size=60,
+                                 random_seed=5, n_epochs=3, batch_size=10)
+        n = 60
+        x = numpy.arange(n, dtype='float32').reshape((n, 1))
+        y = numpy.arange(n) % 2
+        self.dataset = ((x, y), (x[:10], y[:10]), (x[:10], y[:10]))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def calls(self):
+        with open(os.path.join(self.directory, 'calls')) as f:
+            return len(f.readlines())
+
+    def features(self, cache, workers, params=None):
+        return stacking.out_of_fold_features(params or self.params,
+                self.dataset, 3, 4, cache_dir=os.path.join(self.directory,
+                                                            cache),
+                workers=workers, train=seen_by_member)
+
+    def test_out_of_fold(self):
+        features = self.features('serial', 1)
+        assert features.shape == (60, 3, 2)
+        #no member has predicted an instance it was trained on
+        assert not numpy.any(features[:, :, 0])
+        assert numpy.all(features[:, :, 1] > 0.)
+        assert self.calls() == 12
+        assert 'member_number' not in self.params.__dict__
+
+    def test_parallel_matches_serial(self):
+        serial = numpy.array(self.features('serial', 1))
+        parallel = numpy.array(self.features('parallel', 3))
+        assert numpy.array_equal(serial, parallel)
+
+    def test_cache(self):
+        first = numpy.array(self.features('cache', 1))
+        second = numpy.array(self.features('cache', 2))
+        assert self.calls() == 12
+        assert numpy.array_equal(first, second)
+        self.params.n_epochs = 4
+        self.features('cache', 1)
+        assert self.calls() == 24
+        #the same dataset, regenerated in place
+        self.dataset[0][1][0] = 1
+        self.features('cache', 1)
+        assert self.calls() == 36
+
+    def test_resume(self):
+        cache = os.path.join(self.directory, 'cache')
+        self.features('cache', 1)
+        directory = os.path.join(cache, os.listdir(cache)[0])
+        os.remove(os.path.join(directory, 'member_0001_fold_02.done'))
+        self.features('cache', 1)
+        assert self.calls() == 13
+
+    def test_folds(self):
+        with pytest.raises(ValueError):
+            stacking.out_of_fold_features(self.params, self.dataset, 3, 1)
+
+    def test_trained_members(self):
+        import keras
+        model = keras.models.Sequential([
+            keras.layers.Dense(2, input_dim=1),
+            keras.layers.Activation('softmax')])
+        with open(self.params.model_file, 'w') as f:
+            f.write(model.to_yaml())
+        params = Parameters(model_file=self.params.model_file,
+                            resample_size=60, random_seed=5, n_epochs=2,
+                            batch_size=10, update_rule='sgd',
+                            cost_function='categorical_crossentropy',
+                            training_method='normal', early_stopping=None,
+                            online_transform=None, shuffle_dataset=False)
+        x = self.dataset[0][0] / 60.
+        y = numpy.eye(2)[self.dataset[0][1]].astype('float32')
+        self.dataset = ((x, y), (x[:10], y[:10]))
+        for workers in [1, 2]:
+            features = stacking.out_of_fold_features(params, self.dataset,
+                    2, 3, cache_dir=os.path.join(self.directory,
+                                                 str(workers)),
+                    workers=workers)
+            assert features.shape == (60, 2, 2)
+            assert numpy.allclose(features.sum(axis=2), 1.)
+
+    def test_folds_need_a_fitted_head(self):
+        from toupee.ensemble_methods import Stacking
+        x = numpy.zeros((4, 1), dtype='float32')
+        dataset = [(x, numpy.zeros(4))] * 3
+        method = Stacking.__new__(Stacking)
+        method.folds = 5
+        with pytest.raises(ValueError):
+            method.prepare(Parameters(), dataset)
+        method = Stacking.__new__(Stacking)
+        method.folds = 5
+        method.head = 'ridge'
+        method.prepare(Parameters(), dataset)
+
+
+class TestHeads:
+
+    def features(self, n=600, seed=0):
+        """
+        Three members: an accurate one, a noisy one and a useless one
+        """
+        rng = numpy.random.RandomState(seed)
+        y = rng.randint(0, 3, n)
+        good = numpy.eye(3)[y] * 0.7 + 0.1
+        noisy = numpy.where(rng.rand(n, 1) < 0.6, good,
+                            numpy.eye(3)[rng.randint(0, 3, n)] * 0.7 + 0.1)
+        useless = rng.dirichlet(numpy.ones(3), n)
+        return numpy.stack([good, noisy, useless], axis=1), y
+
+    def test_heads(self):
+        features, y = self.features()
+        test_features, test_y = self.features(seed=1)
+        for name in ['logistic', 'nnls', 'ridge']:
+            head = stacking.make_head(name).fit(features, y)
+            p = head.predict_proba(test_features)
+            assert p.shape == (600, 3)
+            assert numpy.allclose(p.sum(axis=1), 1.)
+            assert numpy.mean(p.argmax(axis=1) == test_y) > 0.99
+            state = dict((k, numpy.asarray(v))
+                         for k, v in head.get_state().items())
+            loaded = stacking.load_head(name, state)
+            assert numpy.allclose(loaded.predict_proba(test_features), p)
+
+    def test_nnls_weights(self):
+        features, y = self.features()
+        head = stacking.make_head('nnls').fit(features, numpy.eye(3)[y])
+        assert numpy.all(head.weights >= 0.)
+        assert numpy.isclose(head.weights.sum(), 1.)
+        assert head.weights.argmax() == 0
+        assert head.weights[2] < 0.1
+
+    def test_nnls_l2(self):
+        features, y = self.features()
+        plain = stacking.make_head('nnls').fit(features, y)
+        shrunk = stacking.make_head('nnls', l2=10.).fit(features, y)
+        #the penalty pulls the weights towards each other
+        assert shrunk.weights.std() < plain.weights.std()
+        assert numpy.isclose(shrunk.weights.sum(), 1.)
+
+    def test_logistic_matches_gradient(self):
+        import scipy.optimize
+        features, y = self.features(n=50)
+        head = stacking.LogisticHead(l2=0.1).fit(features, y)
+        #at the optimum of a strictly convex loss
+        x = head.inputs(features)
+        p = stacking.softmax(x.dot(head.W))
+        grad = x.T.dot(p - numpy.eye(3)[y]) / 50.
+        grad[:-1] += 0.1 * head.W[:-1]
+        assert numpy.abs(grad).max() < 1e-4
+
+    def test_unknown_head(self):
+        with pytest.raises(ValueError):
+            stacking.make_head('svm')
+
+    def test_archive_and_serving(self):
+        from toupee.archive import EnsembleArchive
+        from toupee.serving import EnsemblePredictor, check_aggregation
+
+        class Member:
+            def __init__(self, p):
+                self.p = numpy.asarray(p, dtype='float32')
+
+            def predict(self, x, batch_size=None, verbose=0):
+                return numpy.repeat(self.p[None], len(x), axis=0)
+
+            def get_weights(self):
+                return [self.p]
+
+        features, y = self.features()
+        head = stacking.make_head('nnls').fit(features, y)
+        directory = tempfile.mkdtemp()
+        try:
+            archive = EnsembleArchive.create(directory, '', method='Stacking')
+            archive.set_head(head)
+            loaded = EnsembleArchive(directory).head()
+            assert numpy.allclose(loaded.weights, head.weights)
+        finally:
+            shutil.rmtree(directory)
+        check_aggregation('Stacking', 'ridge')
+        with pytest.raises(ValueError):
+            check_aggregation('Stacking', 'mlp')
+        members = [Member([0.8, 0.1, 0.1]), Member([0.1, 0.1, 0.8]),
+                   Member([0.1, 0.8, 0.1])]
+        predictor = EnsemblePredictor(members, head=head)
+        predictor.member_output = lambda m, x: m.predict(x)
+        p = predictor.predict_proba(numpy.zeros((2, 1)))
+        expected = numpy.tensordot(numpy.stack([m.p for m in members]),
+                                   head.weights, axes=([0], [0]))
+        assert numpy.allclose(p, [expected, expected])
+
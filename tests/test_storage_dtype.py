@@ -0,0 +1,117 @@
+import shutil
+import tempfile
+import os
+import numpy
+import pytest
+from toupee import data, sharded
+
+class TestStorageDtype:
+
+    def dataset(self):
+        rng = numpy.random.RandomState(0)
+        return tuple((rng.randint(0, 256, (n, 16)).astype('uint8'),
+                      rng.randint(0, 4, n).astype('int32'))
+                     for n in [50, 20, 10])
+
+    def save(self, dataset):
+        directory = tempfile.mkdtemp()
+        prefix = os.path.join(directory, 'd')
+        for name, (x, y) in zip(['train', 'valid', 'test'], dataset):
+            numpy.savez(prefix + name + '.npz', x = x, y = y)
+        return directory, prefix
+
+    def test_compact_storage(self):
+        dataset = self.dataset()
+        directory, prefix = self.save(dataset)
+        try:
+            train, valid, test = data.load_data(prefix, pickled = False,
+                    storage_dtype = 'uint8', input_scale = 1. / 255)
+            x, y = train
+            assert isinstance(x, data.CompactArray)
+            assert x.base.dtype == numpy.uint8
+            assert x.nbytes == dataset[0][0].nbytes
+            assert y.dtype == numpy.uint8 and y.shape == (50, 4)
+            batch = x[numpy.arange(5)]
+            assert batch.dtype == numpy.float32
+            assert numpy.allclose(batch, dataset[0][0][:5] / 255.)
+            assert numpy.allclose(numpy.asarray(test[0]),
+                                  dataset[2][0] / 255.)
+            sub = x.subset([3, 1]).reshape((2, 4, 4))
+            assert sub.base.dtype == numpy.uint8
+            assert numpy.allclose(sub[:],
+                    dataset[0][0][[3, 1]].reshape((2, 4, 4)) / 255.)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_normalise_per_batch(self):
+        dataset = self.dataset()
+        directory, prefix = self.save(dataset)
+        try:
+            compact = data.load_data(prefix, pickled = False,
+                    center_and_normalise = True, storage_dtype = 'uint8')
+            full = data.load_data(prefix, pickled = False,
+                    center_and_normalise = True)
+            for (cx, cy), (fx, fy) in zip(compact, full):
+                assert numpy.allclose(numpy.asarray(cx), fx, atol = 1e-4)
+                assert numpy.array_equal(cy, fy)
+            compact = data.load_data(prefix, pickled = False,
+                    center_and_normalise = True, storage_dtype = 'uint8',
+                    join_train_and_valid = True)
+            full = data.load_data(prefix, pickled = False,
+                    center_and_normalise = True, join_train_and_valid = True)
+            for (cx, cy), (fx, fy) in zip(compact, full):
+                assert numpy.allclose(numpy.asarray(cx), fx, atol = 1e-4)
+                assert numpy.array_equal(cy, fy)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_lossy_cast_refused(self):
+        x = numpy.linspace(0., 1., 10).reshape((5, 2))
+        with pytest.raises(ValueError):
+            data.to_storage_dtype(x, 'uint8')
+        assert data.to_storage_dtype(x * 0 + 3., 'uint8').dtype == numpy.uint8
+        assert data.to_storage_dtype(x, 'float16').dtype == numpy.float16
+        #every value is checked, not only the first rows
+        x = numpy.ones((3000, 2)) * 3.
+        x[2500, 1] = 0.5
+        with pytest.raises(ValueError):
+            data.to_storage_dtype(x, 'uint8', chunk_size = 1000)
+        x[2500, 1] = 256.
+        with pytest.raises(ValueError):
+            data.to_storage_dtype(x, 'uint8', chunk_size = 1000)
+        x[2500, 1] = numpy.nan
+        with pytest.raises(ValueError):
+            data.to_storage_dtype(x, 'uint8', chunk_size = 1000)
+        #integers wrap around in a narrower integer dtype
+        x = numpy.arange(300, dtype = 'int64').reshape((150, 2))
+        with pytest.raises(ValueError):
+            data.to_storage_dtype(x, 'uint8')
+        assert data.to_storage_dtype(x, 'int16').dtype == numpy.int16
+        with pytest.raises(ValueError):
+            data.to_storage_dtype(-x, 'uint16')
+        #and large floats overflow to inf in float16
+        x = numpy.ones((5, 2)) * 1e5
+        with pytest.raises(ValueError):
+            data.to_storage_dtype(x, 'float16')
+
+    def test_sharded(self):
+        directory = tempfile.mkdtemp()
+        try:
+            sharded.write_sharded(directory, self.dataset(), shard_size = 20)
+            train, valid, test = data.load_data(directory, pickled = False,
+                    storage_dtype = 'uint8')
+            assert train[0].dtype == numpy.uint8
+            with pytest.raises(ValueError):
+                data.load_data(directory, pickled = False,
+                        storage_dtype = 'float16')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_minibatches(self):
+        x, y = self.dataset()[0]
+        cx = data.CompactArray(x, scale = 0.5)
+        seen = []
+        for bx, by in sharded.iterate_minibatches(cx, y, 16):
+            assert bx.dtype == numpy.float32
+            seen.append(bx)
+        assert numpy.allclose(numpy.concatenate(seen), x * 0.5)
@@ -0,0 +1,78 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy
+from toupee import sweep
+from toupee.parameters import Parameters
+
+
+def fake_sequential_model(dataset, params, return_results=False,
+                          callbacks=None):
+    """
+    Scores a trial by its batch size, without training anything
+    """
+    results = Parameters(best_valid=float(params.batch_size),
+                         best_test=float(len(dataset[2][0])), best_epoch=1)
+    return None, results
+
+
+class TestSweep:
+
+    def test_grid(self):
+        trials = sweep.expand({'parameters': {'batch_size': [50, 100],
+                                              'update_rule': ['sgd', 'adam'],
+                                              'n_epochs': 3}})
+        assert len(trials) == 4
+        assert {'batch_size': 50, 'update_rule': 'adam', 'n_epochs': 3} in trials
+
+    def test_random(self):
+        spec = {'mode': 'random', 'n_trials': 10, 'seed': 1,
+                'parameters': {'lr': {'distribution': 'log_uniform',
+                                      'low': 1e-4, 'high': 1e-1},
+                               'batch_size': [32, 64]}}
+        trials = sweep.expand(spec)
+        assert len(trials) == 10
+        assert trials == sweep.expand(spec)
+        for t in trials:
+            assert 1e-4 <= t['lr'] <= 1e-1
+            assert t['batch_size'] in [32, 64]
+
+    def test_overrides(self):
+        params = Parameters(batch_size=100, method=Parameters(voting=False))
+        p = sweep.apply_overrides(params, {'batch_size': 10,
+                                           'method.voting': True})
+        assert p.batch_size == 10 and p.method.voting
+        assert params.batch_size == 100 and not params.method.voting
+
+    def test_share_dataset(self):
+        x = numpy.arange(12, dtype='float32').reshape((4, 3))
+        shared = sweep.share_dataset([(x, x[:, 0])])
+        assert numpy.array_equal(shared[0][0], x)
+        assert not shared[0][0].flags.writeable
+
+    def test_run_sweep(self, monkeypatch):
+        from toupee import mlp
+        monkeypatch.setattr(mlp, 'sequential_model', fake_sequential_model)
+        directory = tempfile.mkdtemp()
+        try:
+            output = os.path.join(directory, 'trials.json')
+            x = numpy.zeros((6, 2), dtype='float32')
+            dataset = [(x, numpy.zeros(6))] * 3
+            spec = {'parameters': {'batch_size': [10, 20]}}
+            records = sweep.run_sweep(Parameters(batch_size=5, n_epochs=1),
+                                      dataset, spec, workers=2,
+                                      output=output)
+            assert [r['trial'] for r in records] == [1, 0]
+            assert [r['overrides'] for r in records] == \
+                [{'batch_size': 20}, {'batch_size': 10}]
+            assert [r['best_valid'] for r in records] == [20., 10.]
+            assert all(r['best_test'] == 6. and 'error' not in r
+                       for r in records)
+            with open(output) as f:
+                saved = [json.loads(line) for line in f]
+            assert sorted(saved, key=lambda r: r['trial']) == \
+                sorted(json.loads(json.dumps(records)),
+                       key=lambda r: r['trial'])
+        finally:
+            shutil.rmtree(directory)
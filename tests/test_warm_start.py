@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import numpy
+import pytest
+from toupee import mlp
+from toupee.ensemble_methods import Bagging, DIB, Snapshot
+from toupee.parameters import Parameters
+
+
+class Model:
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def get_weights(self):
+        return self.weights
+
+
+class TestWarmStart:
+
+    def setup_method(self, method):
+        self.calls = []
+        self.original = mlp.sequential_model
+
+        def sequential_model(dataset, params, pretraining_set=None,
+                             model_weights=None, callbacks=None,
+                             sample_weight=None):
+            self.calls.append((model_weights, params.n_epochs))
+            #every member ends with weights equal to its number
+            n = float(len(self.calls))
+            return Model([numpy.full((20, 10), n), numpy.full(10, n)])
+        mlp.sequential_model = sequential_model
+
+    def teardown_method(self, method):
+        mlp.sequential_model = self.original
+
+    def train(self, n_members=3, **options):
+        method = Bagging()
+        method.__dict__.update(options)
+        params = Parameters(n_epochs=10, resample_size=8, pretraining=None,
+                            random_seed=1)
+        x = numpy.zeros((8, 3), dtype='float32')
+        y = numpy.zeros(8, dtype='int32')
+        method.prepare(params, [(x, y)] * 3)
+        for i in range(n_members):
+            method.create_member(None, None)
+        return [w for w, epochs in self.calls], [e for w, e in self.calls]
+
+    def test_cold(self):
+        weights, epochs = self.train()
+        assert weights == [None, None, None]
+        assert epochs == [10, 10, 10]
+
+    def test_previous(self):
+        weights, epochs = self.train(warm_start='previous',
+                                     n_epochs_after_first=2)
+        assert weights[0] is None
+        assert [w[0][0, 0] for w in weights[1:]] == [1., 2.]
+        assert epochs == [10, 2, 2]
+
+    def test_first(self):
+        weights, epochs = self.train(warm_start='first')
+        assert weights[0] is None
+        assert [w[0][0, 0] for w in weights[1:]] == [1., 1.]
+        assert epochs == [10, 10, 10]
+
+    def test_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'base.npz')
+            numpy.savez(filename, numpy.full((20, 10), 7.), numpy.zeros(10))
+            weights, epochs = self.train(warm_start_file=filename,
+                                         n_epochs_after_first=4)
+        finally:
+            shutil.rmtree(directory)
+        assert [w[0][0, 0] for w in weights] == [7., 7., 7.]
+        assert epochs == [4, 4, 4]
+
+    def test_noise(self):
+        base = numpy.random.RandomState(0).normal(0., 2., (20, 10))
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'base.npz')
+            numpy.savez(filename, base, numpy.zeros(10))
+            weights, epochs = self.train(warm_start_file=filename,
+                                         warm_start_noise=0.1)
+        finally:
+            shutil.rmtree(directory)
+        noise = weights[0][0] - base
+        assert 0.1 < noise.std() < 0.3
+        assert not numpy.array_equal(weights[0][0], weights[1][0])
+        #arrays with no spread are left as they are
+        assert numpy.array_equal(weights[0][1], numpy.zeros(10))
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            self.train(warm_start='last')
+
+    def test_rejected_options(self):
+        for cls, option in [(DIB, 'warm_start'), (Snapshot, 'warm_start'),
+                            (Snapshot, 'early_termination')]:
+            method = cls.__new__(cls)
+            setattr(method, option, 'previous')
+            with pytest.raises(ValueError):
+                method.prepare(Parameters(random_seed=None), None)
@@ -0,0 +1,142 @@
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+import numpy
+import pytest
+from toupee import workqueue
+from toupee.archive import EnsembleArchive
+from toupee.parameters import Parameters
+from helpers import RandomMethod, random_weights
+
+
+class IndependentMethod(RandomMethod):
+    """
+    A stand-in for Bagging whose members are random weights, with a bias
+    holding the number of the member
+    """
+
+    yaml_tag = u'!Independent'
+    independent_members = True
+
+    def __init__(self, params):
+        RandomMethod.__init__(self, params.model_file, [(3, 2)])
+        self.params = params
+
+    def create_member(self, x, y):
+        w = random_weights(self.shapes) + \
+            [numpy.full(2, len(self.members), dtype='float32')]
+        self.members.append(w)
+        return w
+
+
+class StackingMethod(IndependentMethod):
+    """
+    A stand-in for Stacking with a closed-form head, which it fits as an
+    average of the members
+    """
+
+    yaml_tag = u'!Stacking'
+
+    def __init__(self, params):
+        IndependentMethod.__init__(self, params)
+        self.head = 'nnls'
+        self.resampler = type('Resampler', (), {
+            'get_train': lambda self: None, 'get_valid': lambda self: None})()
+
+    def create_aggregator(self, params, members, x, y, train_set, valid_set):
+        from toupee.stacking import NNLSHead
+        self.stack_head = NNLSHead()
+        self.stack_head.weights = numpy.ones(len(members)) / len(members)
+
+
+def expected_member(index, seed):
+    numpy.random.seed([seed, index])
+    return numpy.random.rand(3, 2).astype('float32')
+
+
+def work(path, params):
+    queue = workqueue.WorkQueue(path)
+    workqueue.run_worker(queue, IndependentMethod(params), None, None,
+                         poll=0.05)
+
+
+class TestWorkQueue:
+
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'queue')
+        model_file = os.path.join(self.directory, 'model.yaml')
+        with open(model_file, 'w') as f:
+            f.write('model')
+        self.params = Parameters(model_file=model_file, ensemble_size=6,
+                                 random_seed=3, n_epochs=1)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def test_several_workers(self):
+        method = IndependentMethod(self.params)
+        queue = workqueue.WorkQueue.create(self.path, method, 6)
+        workers = [multiprocessing.Process(target=work,
+                                           args=(self.path, self.params))
+                   for i in range(3)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+            assert w.exitcode == 0
+        assert queue.finished()
+        archive = workqueue.assemble(queue, method, self.params,
+                                     os.path.join(self.directory, 'ensemble'))
+        assert len(archive) == 6
+        assert archive.method == 'Independent'
+        for i in range(6):
+            w = archive.member_weights(i)
+            #the same member, whichever worker trained it
+            assert numpy.array_equal(w[0], expected_member(i, 3))
+            assert numpy.array_equal(w[1], [i, i])
+        assert len(method.members) == 6
+
+    def test_claims_are_exclusive(self):
+        method = IndependentMethod(self.params)
+        queue = workqueue.WorkQueue.create(self.path, method, 2)
+        other = workqueue.WorkQueue(self.path)
+        assert queue.claim() == 0
+        assert other.claim() == 1
+        assert queue.claim() is None
+        with pytest.raises(ValueError):
+            workqueue.assemble(queue, method, self.params,
+                               os.path.join(self.directory, 'ensemble'))
+
+    def test_stale_claim_taken_over(self):
+        method = IndependentMethod(self.params)
+        queue = workqueue.WorkQueue.create(self.path, method, 1, lease=60.)
+        assert queue.claim() == 0
+        assert queue.claim() is None
+        old = time.time() - 120.
+        os.utime(queue.claim_file(0), (old, old))
+        assert queue.claim() == 0
+        queue.complete(0, [numpy.zeros(2)])
+        assert queue.finished()
+        assert queue.claim() is None
+
+    def test_dependent_methods_refused(self):
+        method = IndependentMethod(self.params)
+        method.independent_members = False
+        queue = workqueue.WorkQueue.create(self.path, method, 1)
+        with pytest.raises(ValueError):
+            workqueue.run_worker(queue, method, None, None)
+        with pytest.raises(ValueError):
+            queue.check(type('Other', (), {'yaml_tag': u'!Other'})())
+
+    def test_stack_head(self):
+        method = StackingMethod(self.params)
+        queue = workqueue.WorkQueue.create(self.path, method, 3)
+        workqueue.run_worker(queue, method, None, None)
+        archive = workqueue.assemble(queue, method, self.params,
+                                     os.path.join(self.directory, 'ensemble'))
+        head = EnsembleArchive(archive.path).head()
+        assert head.name == 'nnls'
+        assert numpy.allclose(head.weights, [1. / 3] * 3)
@@ -1,32 +1,156 @@
 #!/usr/bin/python
 
-import cPickle
-import numpy as np
-import leveldb
+import os
 import sys
 import argparse
-import caffe
+import itertools
+import multiprocessing
+import numpy as np
 import numpy
-from caffe.proto import caffe_pb2
+import numpy.lib.format
+
+CHUNK_SIZE = 1000
+
+class LevelDBSource:
+
+    def __init__(self,filename):
+        import leveldb
+        self.db = leveldb.LevelDB(filename)
+
+    def count(self):
+        return sum(1 for key in self.db.RangeIter(include_value=False))
+
+    def values(self):
+        for key, value in self.db.RangeIter():
+            yield value
 
-def load_file(filename):
-    db = leveldb.LevelDB(filename)
+class LMDBSource:
+
+    def __init__(self,filename):
+        import lmdb
+        self.env = lmdb.open(filename, readonly=True, lock=False)
+
+    def count(self):
+        return self.env.stat()['entries']
+
+    def values(self):
+        with self.env.begin() as txn:
+            for key, value in txn.cursor():
+                yield value
+
+def open_source(filename):
+    if os.path.isfile(os.path.join(filename, 'data.mdb')):
+        return LMDBSource(filename)
+    return LevelDBSource(filename)
+
+def decode_datum(value):
+    """
+    The same as caffe.io.datum_to_array, without importing the whole of caffe
+    """
+    from caffe.proto import caffe_pb2
     datum = caffe_pb2.Datum()
-    X = []
-    Y = []
-    for key, value in db.RangeIter():
-        datum.ParseFromString(value)
-        label = datum.label
-        data = caffe.io.datum_to_array(datum)
-        X.append(data)
-        Y.append(label)
-    return X,Y
+    datum.ParseFromString(value)
+    shape = (datum.channels, datum.height, datum.width)
+    if len(datum.data) > 0:
+        data = np.fromstring(datum.data, dtype=np.uint8).reshape(shape)
+    else:
+        data = np.array(datum.float_data).astype(float).reshape(shape)
+    return data, datum.label
+
+worker_state = {}
+
+def init_worker(x_file,y_file,decode):
+    worker_state['x'] = np.load(x_file, mmap_mode='r+')
+    worker_state['y'] = np.load(y_file, mmap_mode='r+')
+    worker_state['decode'] = decode
+
+def decode_chunk(positions,values):
+    X = worker_state['x']
+    Y = worker_state['y']
+    decode = worker_state['decode']
+    for p,value in zip(positions,values):
+        X[p],Y[p] = decode(value)
+    X.flush()
+    Y.flush()
+    return len(values)
+
+def load_file(filename,where,permute=False,workers=None,dtype='float32',
+        decode=decode_datum):
+    """
+    Decode a LevelDB or LMDB dataset into memory-mapped `where`x.npy and
+    `where`y.npy. The records are counted first so the arrays can be
+    allocated up front, then workers decode chunks of records straight into
+    their final position, which is a random permutation if `permute`.
+    """
+    source = open_source(filename)
+    n = source.count()
+    if n == 0:
+        raise ValueError("{0} is empty".format(filename))
+    values = source.values()
+    first = next(values)
+    x, y = decode(first)
+    X = numpy.lib.format.open_memmap(where + 'x.npy', mode='w+',
+            dtype=dtype, shape=(n,) + np.asarray(x).shape)
+    Y = numpy.lib.format.open_memmap(where + 'y.npy', mode='w+',
+            dtype='int32', shape=(n,))
+    if permute:
+        positions = numpy.random.permutation(n)
+    else:
+        positions = numpy.arange(n)
+    X[positions[0]],Y[positions[0]] = x, y
+    del X, Y
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers, initializer=init_worker,
+            initargs=(where + 'x.npy', where + 'y.npy', decode))
+    pending = []
+    start = 1
+    while True:
+        chunk = list(itertools.islice(values, CHUNK_SIZE))
+        if len(chunk) == 0:
+            break
+        #bound the number of raw chunks held in memory
+        if len(pending) >= 2 * workers:
+            pending.pop(0).get()
+        pending.append(pool.apply_async(decode_chunk,
+            (positions[start:start + len(chunk)], chunk)))
+        start += len(chunk)
+    for p in pending:
+        p.get()
+    pool.close()
+    pool.join()
+    return np.load(where + 'x.npy', mmap_mode='r'), \
+           np.load(where + 'y.npy', mmap_mode='r')
 
 def save(where,set_x,set_y):
-    set_x = numpy.asarray(set_x, dtype='float32')
-    set_y = numpy.asarray(set_y, dtype='int32')
     np.savez_compressed(where,x=set_x,y=set_y)
 
+def convert(args):
+    dest = args.dest + '/'
+    tmp = []
+    def load(source,name,permute=False):
+        tmp.extend([dest + name + '_tmp_x.npy', dest + name + '_tmp_y.npy'])
+        return load_file(source, dest + name + '_tmp_', permute=permute,
+                workers=args.workers, dtype=args.dtype)
+
+    print "... converting"
+    if args.source_valid is None:
+        X,Y = load(args.source_train,'train',permute=True)
+        train_split = int(len(X) * 0.8)
+        save(dest + 'train',X[:train_split],Y[:train_split])
+        save(dest + 'valid',X[train_split:],Y[train_split:])
+    else:
+        train_x,train_y = load(args.source_train,'train')
+        save(dest + 'train',train_x,train_y)
+        valid_x,valid_y = load(args.source_valid,'valid')
+        save(dest + 'valid',valid_x,valid_y)
+
+    test_x,test_y = load(args.source_test,'test')
+    save(dest + 'test',test_x,test_y)
+    if not args.keep_npy:
+        for f in tmp:
+            os.remove(f)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Convert a Caffe/LMDB dataset')
     parser.add_argument('--dest', help='the destination for the dataset')
@@ -35,30 +159,11 @@ if __name__ == '__main__':
             help='optional test set source')
     parser.add_argument('--source-valid', nargs='?',
             help='optional valid set source (only works if you have test too)')
+    parser.add_argument('--workers', type=int, default=None,
+            help='decoding processes (default: one per cpu)')
+    parser.add_argument('--dtype', default='float32',
+            help='the type the inputs are stored as')
+    parser.add_argument('--keep-npy', action='store_true',
+            help='keep the uncompressed memory-mappable .npy files')
     args=parser.parse_args()
-
-    X,Y = load_file(args.source_train)
-
-    print "... saving"
-    if args.source_valid is None:
-        data_size = len(X)
-        shuffled_X = []
-        shuffled_Y = []
-        for i in numpy.random.permutation(data_size):
-            shuffled_X.append(numpy.asarray(X[i]))
-            shuffled_Y.append(numpy.asarray(Y[i]))
-        train_split = int(data_size * 0.8)
-        train_x = numpy.asarray(shuffled_X[:train_split])
-        train_y = numpy.asarray(shuffled_Y[:train_split])
-        valid_x = numpy.asarray(shuffled_X[train_split:])
-        valid_y = numpy.asarray(shuffled_Y[train_split:])
-        save(args.dest + '/train',train_x,train_y)
-        save(args.dest + '/valid',valid_x,valid_y)
-    else:
-        train_x,train_y = X,Y
-        valid_x,valid_y = load_file(args.source_valid)
-        save(args.dest + '/train',train_x,train_y)
-        save(args.dest + '/valid',valid_x,valid_y)
-
-    test_x,test_y = load_file(args.source_test)
-    save(args.dest + '/test',test_x,test_y)
+    convert(args)
@@ -0,0 +1,31 @@
+#!/usr/bin/python
+
+import os
+import sys
+import gzip
+import cPickle
+import argparse
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from toupee.data import save_blocked, BLOCKED_EXTENSION
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='Convert a gzipped pickle dataset (e.g. mnist.pkl.gz) '
+                        'to the blocked format that loads in parallel')
+    parser.add_argument('--source', help='the gzipped pickle')
+    parser.add_argument('--dest', nargs='?',
+            help='the destination (default: next to the source)')
+    parser.add_argument('--level', type=int, default=6,
+            help='zlib compression level')
+    args=parser.parse_args()
+
+    dest = args.dest
+    if dest is None:
+        dest = args.source.replace('.pkl.gz', '') + BLOCKED_EXTENSION
+    with gzip.open(args.source, 'rb') as f:
+        dataset = cPickle.load(f)
+    dataset = [(numpy.asarray(x), numpy.asarray(y)) for x,y in dataset]
+    print "... saving"
+    save_blocked(dest, dataset, args.level)
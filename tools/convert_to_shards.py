@@ -0,0 +1,30 @@
+#!/usr/bin/python
+
+import os
+import sys
+import argparse
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from toupee.sharded import SPLITS, write_split, write_index
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='Convert a dataset of .npz files to sharded form')
+    parser.add_argument('--source',
+            help='the directory with train.npz, valid.npz and test.npz')
+    parser.add_argument('--dest', help='the destination for the shards')
+    parser.add_argument('--shard-size', type=int, default=10000,
+            help='rows per shard')
+    args=parser.parse_args()
+
+    index = {}
+    for split in SPLITS:
+        #one split in memory at a time
+        f = numpy.load(os.path.join(args.source, split + '.npz'))
+        index[split] = write_split(args.dest, split, f['x'], f['y'],
+                args.shard_size)
+        print "{0}: {1} rows in {2} shards".format(split, index[split]['n'],
+                len(index[split]['shards']))
+        del f
+    write_index(args.dest, index)
@@ -1,75 +1,141 @@
 #!/usr/bin/python
 
+import os
 import csv
 import argparse
+import itertools
 import numpy
+import numpy.lib.format
+
+CHUNK_SIZE = 10000
 
 def split_label_and_data(data,label_first):
+    """
+    Split a row (or the columns of a chunk) into (features, label)
+    """
     if label_first:
-        return data[0],data[1:]
+        return data[1:],data[0]
     else:
         return data[:len(data) - 1],data[len(data) - 1]
 
-def convert_input(row,column_index = {}):
-    ret = []
-    i = 0
-    for entry in row:
-        try:
-            ret.append(float(entry))
-        except:
-            if i not in column_index.keys():
-                column_index[i] = {}
-            if entry not in column_index[i].keys():
-                if len(column_index[i].values()) > 0:
-                    next_value = max(column_index[i].values()) + 1
-                    #print "{0} = {1}".format(entry,next_value)
-                else:
-                    next_value = 0.
-                column_index[i][entry] = next_value
-            
-            ret.append(float(column_index[i][entry]))
-        i += 1
-    return ret
+def read_rows(file_name,header):
+    """
+    Iterate over the non-empty rows of a csv file, skipping the header
+    """
+    with open(file_name, 'rb') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        if header:
+            next(reader, None)
+        for row in reader:
+            if len(row) > 0:
+                yield row
+
+def read_chunks(file_name,header,chunk_size=CHUNK_SIZE):
+    rows = read_rows(file_name,header)
+    while True:
+        chunk = list(itertools.islice(rows,chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def count_rows(file_name,header):
+    return sum(1 for row in read_rows(file_name,header))
 
-def convert_label(entry,column_index = {}):
-    i = 0
+def is_number(entry):
     try:
-        return float(entry)
-    except:
-        if entry not in column_index.keys():
-            if len(column_index.values()) > 0:
-                next_value = max(column_index.values()) + 1
+        float(entry)
+        return True
+    except ValueError:
+        return False
+
+def encode(values,index):
+    """
+    Numbers are kept as they are, anything else gets the next free integer
+    code in this column's index, in order of first appearance. Values seen
+    before are a single dictionary lookup.
+    """
+    ret = numpy.empty(len(values))
+    for i,entry in enumerate(values):
+        code = index.get(entry)
+        if code is None:
+            try:
+                code = float(entry)
+            except ValueError:
+                code = float(len(index))
+                index[entry] = code
+        ret[i] = code
+    return ret
+
+def convert_column(values,numeric,index):
+    """
+    Convert one column of a chunk. Columns inferred as numeric are parsed
+    by numpy in one go, falling back to encode() if they turn out not to be.
+    Returns the converted values and whether the column is still numeric.
+    """
+    if numeric:
+        try:
+            return numpy.asarray(values,dtype='float64'),True
+        except ValueError:
+            pass
+    return encode(values,index),False
+
+class Schema:
+    """
+    Column types and categorical encodings, inferred once from the first
+    chunk of the first file and shared by all the files of a dataset so
+    that every split gets the same codes.
+    """
+
+    def __init__(self,labels_first):
+        self.labels_first = labels_first
+        self.numeric = None
+        self.label_numeric = None
+        self.x_index = None
+        self.y_index = {}
+
+    def infer(self,chunk):
+        if self.numeric is not None:
+            return
+        x,y = split_label_and_data(zip(*chunk),self.labels_first)
+        self.numeric = [all(is_number(v) for v in col) for col in x]
+        self.label_numeric = all(is_number(v) for v in y)
+        self.x_index = [{} for col in x]
+
+def csv_to_numpy(file_name,schema,header=False,offset=0,dtype='float64',
+        memmap_prefix=None):
+    """
+    Convert a csv file chunk by chunk, writing every chunk straight into its
+    shuffled position in preallocated (optionally memory-mapped) arrays.
+    """
+    n_rows = count_rows(file_name,header)
+    permutation = numpy.random.permutation(n_rows)
+    X = None
+    Y = None
+    start = 0
+    for chunk in read_chunks(file_name,header):
+        schema.infer(chunk)
+        if X is None:
+            n_features = len(chunk[0]) - 1
+            if memmap_prefix is not None:
+                X = numpy.lib.format.open_memmap(memmap_prefix + 'x.npy',
+                        mode='w+', dtype=dtype, shape=(n_rows,n_features))
             else:
-                next_value = 0.
-            column_index[entry] = next_value
-        return float(column_index[entry])
+                X = numpy.empty((n_rows,n_features),dtype=dtype)
+            Y = numpy.empty(n_rows,dtype='float64')
+        rows = permutation[start:start + len(chunk)]
+        x,y = split_label_and_data(zip(*chunk),schema.labels_first)
+        for i,col in enumerate(x):
+            X[rows,i],schema.numeric[i] = convert_column(col,
+                    schema.numeric[i],schema.x_index[i])
+        Y[rows],schema.label_numeric = convert_column(y,
+                schema.label_numeric,schema.y_index)
+        start += len(chunk)
+    if offset != 0:
+        Y += offset
+    return X,Y.astype('int32')
 
-def csv_to_numpy(file_name,labels_first,offset=0.):
-    with open(file_name, 'rb') as csvfile:
-        X = []
-        Y = []
-        X_column_index = {}
-        Y_column_index = {}
-        reader = csv.reader(csvfile, delimiter=',')
-        start_line = 0
-        if args.header:
-            start_line = 1
-        line_count = 0
-        for row in reader:
-            if line_count > start_line and len(row) > 0:
-                x,y = split_label_and_data(row,labels_first)
-                X.append(convert_input(x,X_column_index))
-                Y.append(convert_label(y,Y_column_index))
-            line_count += 1
-    if args.labels_offset != 0:
-        Y = numpy.add(Y,args.labels_offset)
-    shuffled_X = []
-    shuffled_Y = []
-    for i in numpy.random.permutation(len(X)):
-        shuffled_X.append(numpy.asarray(X[i]))
-        shuffled_Y.append(numpy.asarray(Y[i]))
-
-    return numpy.asarray(shuffled_X),numpy.asarray(shuffled_Y)
+def save(where,set_x,set_y):
+    numpy.savez_compressed(where,x=set_x,y=set_y)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert a UCI dataset')
@@ -83,38 +149,57 @@ if __name__ == "__main__":
     parser.add_argument('--labels-first', action='store_true',
             help='labels are in the first column instead of the last')
     parser.add_argument('--labels-offset', type=int, default=0,
-            help='fixed int to remove from the label')
+            help='fixed int to add to the label')
+    parser.add_argument('--dtype', default='float64',
+            help='the type the features are stored as')
+    parser.add_argument('--memmap', action='store_true',
+            help='build the arrays in memory-mapped files next to dest')
+    parser.add_argument('--seed', type=int, default=None,
+            help='seed for the shuffle')
     args=parser.parse_args()
 
-    X,Y = csv_to_numpy(args.source,args.labels_first,args.labels_offset)
+    numpy.random.seed(args.seed)
+    schema = Schema(args.labels_first)
+    def convert(source,name):
+        memmap_prefix = None
+        if args.memmap:
+            memmap_prefix = args.dest + name + '_tmp_'
+        return csv_to_numpy(source,schema,args.header,args.labels_offset,
+                args.dtype,memmap_prefix)
+
+    X,Y = convert(args.source,'all')
     data_size = len(X)
     if args.source_test is not None:
         train_x,train_y = X,Y
         if args.source_valid is not None:
-            valid_x,valid_y = csv_to_numpy(args.source_valid,args.labels_first,args.labels_offset)
+            valid_x,valid_y = convert(args.source_valid,'valid')
         else:
-            valid_split = data_size * 0.9
+            valid_split = int(data_size * 0.9)
             valid_x = train_x[valid_split:]
             valid_y = train_y[valid_split:]
             train_x = train_x[:valid_split]
             train_y = train_y[:valid_split]
-            test_x,test_y = csv_to_numpy(args.source_test,args.labels_first,args.labels_offset)
+        test_x,test_y = convert(args.source_test,'test')
     else:
-        train_split = data_size * 0.8
-        test_split = data_size * 0.9
+        train_split = int(data_size * 0.8)
+        test_split = int(data_size * 0.9)
         train_x = X[:train_split]
         train_y = Y[:train_split]
         valid_x = X[train_split:test_split]
         valid_y = Y[train_split:test_split]
         test_x = X[test_split:]
         test_y = Y[test_split:]
-    numpy.savez_compressed(args.dest + 'train',x=train_x,y=train_y)
-    numpy.savez_compressed(args.dest + 'valid',x=valid_x,y=valid_y)
-    numpy.savez_compressed(args.dest + 'test',x=test_x,y=test_y)
+    save(args.dest + 'train',train_x,train_y)
+    save(args.dest + 'valid',valid_x,valid_y)
+    save(args.dest + 'test',test_x,test_y)
+    if args.memmap:
+        for name in ['all','valid','test']:
+            if os.path.exists(args.dest + name + '_tmp_x.npy'):
+                os.remove(args.dest + name + '_tmp_x.npy')
 
     print "{0} features, {1} classes, {2} training, {3} validation, {4} test".format(
-        len(train_x[0]),
-        int(max(train_y)) + 1,
+        train_x.shape[1],
+        int(train_y.max()) + 1,
         len(train_x),
         len(valid_x),
         len(test_x),
@@ -1,5 +1,34 @@
-import data
-import ensemble_methods
-import mlp
-import parameters
-import config
+"""
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import sys
+import types
+import importlib
+
+#submodules are imported on first access, so that e.g. `toupee.data` does
+#not pull in Theano and Keras through `toupee.mlp`
+submodules = ['data', 'ensemble_methods', 'mlp', 'parameters', 'config',
+              'common', 'utils', 'serving', 'archive', 'checkpoint', 'sharded',
+              'sweep', 'scheduling', 'profiling', 'workqueue', 'inference',
+              'quantization', 'stacking', 'member_store',
+              'parallel', 'autotune']
+
+class Package(types.ModuleType):
+
+    def __getattr__(self, name):
+        if name in submodules:
+            return importlib.import_module(self.__name__ + '.' + name)
+        raise AttributeError("'module' object has no attribute '{0}'"
+                .format(name))
+
+package = Package(__name__, __doc__)
+package.__dict__.update(sys.modules[__name__].__dict__)
+#keep the original module alive, or Python 2 clears the globals used above
+package._module = sys.modules[__name__]
+sys.modules[__name__] = package
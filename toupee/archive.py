@@ -0,0 +1,224 @@
+#!/usr/bin/python
+"""
+Ensemble archives: a directory holding the architecture, a manifest and the
+raw weights of every member
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import json
+import numpy
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+ARCHITECTURE = 'model.yaml'
+MEMBERS_DIR = 'members'
+HEAD = 'head.npz'
+
+
+def is_archive(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def method_name(method):
+    """
+    The name an ensemble method is stored under, i.e. its YAML tag
+    """
+    if method is None:
+        return None
+    if isinstance(method, basestring):
+        return method
+    return method.yaml_tag.lstrip('!')
+
+
+class EnsembleArchive:
+    """
+    An ensemble stored as:
+    - model.yaml: the serialised Keras architecture shared by all members
+    - manifest.json: the method, its aggregation weights (alphas) and the
+      member order, with the shape of every weight array
+    - members/member_NNNN.npy: the weights of one member, flattened and
+      concatenated into a single uncompressed array
+    - head.npz: the parameters of a closed-form stack head, if any
+
+    Opening an archive only reads the manifest. Member weights are memory
+    mapped when they are first asked for, so any single member can be loaded
+    without touching the others.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest['format_version'] > FORMAT_VERSION:
+            raise ValueError("{0} was written by a newer toupee (format {1})"
+                    .format(path, self.manifest['format_version']))
+
+    @classmethod
+    def create(cls, path, model_yaml, method = None, params = None):
+        """
+        Start a new, empty archive at `path`
+        """
+        members_dir = os.path.join(path, MEMBERS_DIR)
+        if not os.path.isdir(members_dir):
+            os.makedirs(members_dir)
+        with open(os.path.join(path, ARCHITECTURE), 'w') as f:
+            f.write(model_yaml)
+        manifest = { 'format_version': FORMAT_VERSION,
+                     'method': method_name(method),
+                     'voting': bool(getattr(method, 'voting', False)),
+                     'alphas': None,
+                     'members': [],
+                   }
+        if params is not None:
+            manifest['params'] = json.loads(json.dumps(params.__dict__,
+                default = str))
+        _write_manifest(path, manifest)
+        return cls(path)
+
+    def __len__(self):
+        return len(self.manifest['members'])
+
+    @property
+    def method(self):
+        return self.manifest['method']
+
+    @property
+    def voting(self):
+        return self.manifest['voting']
+
+    @property
+    def alphas(self):
+        return self.manifest['alphas']
+
+    @property
+    def architecture_file(self):
+        return os.path.join(self.path, ARCHITECTURE)
+
+    @property
+    def architecture(self):
+        with open(self.architecture_file) as f:
+            return f.read()
+
+    def add_member(self, weights, alpha = None):
+        """
+        Append one member's weights, then rewrite the manifest so that a
+        reader never sees a member whose weights are not fully written.
+        """
+        index = len(self.manifest['members'])
+        weights = [numpy.asarray(w) for w in weights]
+        dtype = numpy.result_type(*weights)
+        flat = numpy.concatenate([w.astype(dtype).ravel() for w in weights])
+        filename = os.path.join(MEMBERS_DIR, 'member_{0:04d}.npy'.format(index))
+        numpy.save(os.path.join(self.path, filename), flat)
+        self.manifest['members'].append({
+            'file': filename,
+            'dtype': dtype.str,
+            'shapes': [list(w.shape) for w in weights],
+        })
+        if alpha is not None:
+            if self.manifest['alphas'] is None:
+                self.manifest['alphas'] = []
+            self.manifest['alphas'].append(float(alpha))
+        _write_manifest(self.path, self.manifest)
+        return index
+
+    def truncate(self, n_members):
+        """
+        Forget every member after the first `n_members`
+        """
+        self.manifest['members'] = self.manifest['members'][:n_members]
+        if self.manifest['alphas'] is not None:
+            self.manifest['alphas'] = self.manifest['alphas'][:n_members]
+        _write_manifest(self.path, self.manifest)
+
+    def set_alphas(self, alphas):
+        self.manifest['alphas'] = [float(a) for a in alphas]
+        _write_manifest(self.path, self.manifest)
+
+    def set_head(self, head):
+        """
+        Save a closed-form stack head (see stacking.py)
+        """
+        with open(os.path.join(self.path, HEAD), 'wb') as f:
+            numpy.savez(f, **head.get_state())
+        self.manifest['head'] = head.name
+        _write_manifest(self.path, self.manifest)
+
+    def head(self):
+        name = self.manifest.get('head')
+        if name is None:
+            return None
+        import stacking
+        state = numpy.load(os.path.join(self.path, HEAD))
+        return stacking.load_head(name, dict((k, state[k]) for k in state.files))
+
+    def member_weights(self, index):
+        """
+        The weights of one member, as read-only views on its memory map
+        """
+        entry = self.manifest['members'][index]
+        flat = numpy.load(os.path.join(self.path, entry['file']),
+                mmap_mode = 'r')
+        weights = []
+        start = 0
+        for shape in entry['shapes']:
+            size = int(numpy.prod(shape))
+            weights.append(flat[start:start + size].reshape(shape))
+            start += size
+        return weights
+
+    def load_member(self, index):
+        """
+        Rebuild one member as a Keras model
+        """
+        import mlp
+        return mlp.build_model(self.architecture_file,
+                self.member_weights(index))
+
+    def iter_members(self):
+        for i in range(len(self)):
+            yield self.load_member(i)
+
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    os.rename(tmp, os.path.join(path, MANIFEST))
+
+
+def save_ensemble(path, model_yaml, members, method = None, alphas = None,
+        params = None):
+    """
+    Write a whole ensemble at once. `members` can be models or lists of
+    weight arrays.
+    """
+    archive = EnsembleArchive.create(path, model_yaml, method, params)
+    for m in members:
+        if not isinstance(m, (list, tuple)):
+            m = m.get_weights()
+        archive.add_member(m)
+    if alphas is None:
+        alphas = getattr(method, 'alphas', None)
+    if alphas is not None and len(alphas) > 0:
+        archive.set_alphas(alphas)
+    return archive
+
+
+def load_weights(path, index = 0):
+    """
+    Read the weights of a single model, either a member of an ensemble
+    archive or a .npz file written with numpy.savez(f, *model.get_weights())
+    """
+    if is_archive(path):
+        return [numpy.array(w) for w in
+                EnsembleArchive(path).member_weights(index)]
+    f = numpy.load(path)
+    return [f['arr_{0}'.format(i)] for i in range(len(f.files))]
@@ -0,0 +1,355 @@
+#!/usr/bin/python
+"""
+Pick the batch sizes and BLAS thread counts with the highest throughput for
+a model on this host, separately for training and for inference, by timing
+a few batches of every candidate under a memory ceiling. The choice is
+cached per model file and host, so later runs reuse it.
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import json
+import time
+import ctypes
+import socket
+import hashlib
+import contextlib
+import multiprocessing
+import numpy
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.toupee',
+        'autotune.json')
+BATCH_SIZES = [16, 32, 64, 128, 256, 512, 1024]
+#the thread count setter of every BLAS library that may be loaded
+BLAS_SETTERS = [('openblas', ['openblas_set_num_threads']),
+                ('mkl', ['MKL_Set_Num_Threads', 'mkl_set_num_threads']),
+                ('blis', ['bli_thread_set_num_threads'])]
+BLAS_ENVIRONMENT = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS']
+
+
+def loaded_libraries():
+    try:
+        with open('/proc/self/maps') as f:
+            paths = set(line.split()[-1] for line in f
+                        if line.rstrip().endswith('.so') or '.so.' in line)
+    except IOError:
+        return []
+    return sorted(paths)
+
+
+def set_library_threads(n):
+    """
+    Set the number of threads of every BLAS library loaded in this process,
+    returning whether there was any
+    """
+    found = False
+    for path in loaded_libraries():
+        name = os.path.basename(path).lower()
+        for library, setters in BLAS_SETTERS:
+            if library not in name:
+                continue
+            lib = ctypes.CDLL(path)
+            for setter in setters:
+                if hasattr(lib, setter):
+                    getattr(lib, setter)(ctypes.c_int(n))
+                    found = True
+                    break
+    return found
+
+
+def set_blas_threads(n):
+    """
+    Set the number of BLAS threads, of the libraries loaded in this process
+    and of those loaded later on or by child processes
+    """
+    for variable in BLAS_ENVIRONMENT:
+        os.environ[variable] = str(n)
+    return set_library_threads(n)
+
+
+@contextlib.contextmanager
+def blas_threads(n):
+    """
+    Run with `n` BLAS threads, if `n` is not None
+    """
+    if n is None:
+        yield
+        return
+    previous = dict((v, os.environ.get(v)) for v in BLAS_ENVIRONMENT)
+    set_blas_threads(n)
+    try:
+        yield
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                del os.environ[variable]
+            else:
+                os.environ[variable] = value
+        #BLAS libraries start with a thread per CPU, unless told otherwise
+        counts = [int(v) for v in previous.values() if v is not None]
+        set_library_threads(min(counts) if counts else
+                multiprocessing.cpu_count())
+
+
+def thread_counts(cpus = None):
+    if cpus is None:
+        cpus = multiprocessing.cpu_count()
+    counts = [1]
+    while counts[-1] * 2 < cpus:
+        counts.append(counts[-1] * 2)
+    if cpus > 1:
+        counts.append(cpus)
+    return counts
+
+
+def available_memory():
+    """
+    The memory available to this process, in bytes
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+
+class PeakMemory:
+    """
+    The peak resident memory of this process since reset(), where Linux
+    allows resetting it
+    """
+
+    def reset(self):
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+            return True
+        except IOError:
+            return False
+
+    def read(self, field):
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith(field + ':'):
+                        return int(line.split()[1]) * 1024
+        except IOError:
+            pass
+        return None
+
+    def current(self):
+        return self.read('VmRSS')
+
+    def peak(self):
+        return self.read('VmHWM')
+
+
+def activation_count(model):
+    """
+    The number of values every layer of a model outputs for one instance
+    """
+    total = 0
+    for layer in model.layers:
+        shape = layer.output_shape
+        if isinstance(shape, list):
+            shape = shape[0]
+        total += int(numpy.prod([d for d in shape[1:] if d is not None]))
+    return total
+
+
+def estimate_memory(model, batch_size, training):
+    """
+    A rough upper bound of the memory a batch needs: the weights, with
+    their gradients and two optimizer accumulators when training, and every
+    layer's activations, kept for the backward pass when training
+    """
+    itemsize = 4
+    weights = model.count_params() * itemsize
+    activations = activation_count(model) * batch_size * itemsize
+    if training:
+        return 4 * weights + 3 * activations
+    return weights + activations
+
+
+def synthetic_batch(model, n, rng):
+    input_shape = list(model.inputs[0]._keras_shape[1:])
+    n_classes = model.outputs[0]._keras_shape[1]
+    x = rng.rand(*([n] + input_shape)).astype('float32')
+    y = numpy.zeros((n, n_classes), dtype = 'float32')
+    y[numpy.arange(n), rng.randint(0, n_classes, n)] = 1.
+    return x, y
+
+
+def throughput(step, batch_size, min_time):
+    """
+    The instances per second of `step`, run after a warm-up batch until at
+    least `min_time` seconds have passed
+    """
+    step()
+    n = 0
+    start = time.time()
+    while n == 0 or time.time() - start < min_time:
+        step()
+        n += 1
+    return n * batch_size / (time.time() - start)
+
+
+def tune(model, training, memory_ceiling, batch_sizes = BATCH_SIZES,
+        threads = None, min_time = 0.2, seed = 0):
+    """
+    Time a compiled model on every (batch size, thread count) candidate
+    that keeps the resident memory of the process below `memory_ceiling`
+    bytes, returning the fastest and every measurement
+    """
+    if threads is None:
+        threads = thread_counts()
+    rng = numpy.random.RandomState(seed)
+    x, y = synthetic_batch(model, max(batch_sizes), rng)
+    memory = PeakMemory()
+    results = []
+    for n_threads in threads:
+        with blas_threads(n_threads):
+            for batch_size in sorted(batch_sizes):
+                if (memory.current() or 0) + estimate_memory(model,
+                        batch_size, training) > memory_ceiling:
+                    break
+                bx, by = x[:batch_size], y[:batch_size]
+                if training:
+                    step = lambda: model.train_on_batch(bx, by)
+                else:
+                    step = lambda: model.predict_on_batch(bx)
+                measured = memory.reset()
+                speed = throughput(step, batch_size, min_time)
+                used = None
+                if measured:
+                    used = memory.peak()
+                    if used > memory_ceiling:
+                        break
+                results.append({ 'batch_size': batch_size,
+                                 'threads': n_threads,
+                                 'instances_per_second': speed,
+                                 'memory': used })
+    if len(results) == 0:
+        raise ValueError("no batch size fits in {0:.0f} MB".format(
+            memory_ceiling / 2. ** 20))
+    best = max(results, key = lambda r: r['instances_per_second'])
+    return best, results
+
+
+def cache_key(params, batch_sizes, threads):
+    with open(params.model_file) as f:
+        model = f.read()
+    description = json.dumps({ 'model': model,
+                               'update_rule': str(params.update_rule),
+                               'cost_function': str(params.cost_function),
+                               'batch_sizes': batch_sizes,
+                               'threads': threads,
+                               'cpus': multiprocessing.cpu_count() },
+                             sort_keys = True)
+    return hashlib.sha1(description).hexdigest()
+
+
+def fits(choice, memory_ceiling):
+    """
+    Whether a cached choice was measured to fit under a ceiling in MB, or
+    was tuned under one at least as low
+    """
+    for mode in ['training', 'inference']:
+        used = choice[mode]['memory']
+        if used is None:
+            if choice['memory_ceiling'] > memory_ceiling:
+                return False
+        elif used > memory_ceiling * 2. ** 20:
+            return False
+    return True
+
+
+def read_cache(filename):
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def write_cache(filename, cache):
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = '{0}.{1}.tmp'.format(filename, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent = 2)
+    os.rename(tmp, filename)
+
+
+def autotune(params, memory_ceiling = None, cache_file = None,
+        batch_sizes = BATCH_SIZES, threads = None, min_time = 0.2):
+    """
+    The fastest training and inference settings of `params.model_file` on
+    this host, from the cache or measured on a fresh copy of the model.
+    `memory_ceiling` bounds the resident memory of the process, in MB, and
+    is by default what it uses now plus half of the available memory.
+    """
+    import mlp
+    if cache_file is None:
+        cache_file = DEFAULT_CACHE
+    if memory_ceiling is None:
+        used = PeakMemory().current() or 0
+        available = available_memory()
+        if available is None:
+            available = 2 ** 33
+        memory_ceiling = (used + available / 2) / 2. ** 20
+    key = cache_key(params, batch_sizes, threads)
+    host = socket.gethostname()
+    cached = read_cache(cache_file).get(host, {}).get(key)
+    if cached is not None and fits(cached, memory_ceiling):
+        return cached
+    print "autotuning batch size and BLAS threads..."
+    model = mlp.build_model(params.model_file)
+    model.compile(optimizer = params.update_rule, loss = params.cost_function)
+    choice = { 'memory_ceiling': memory_ceiling }
+    for mode, training in (('training', True), ('inference', False)):
+        best, results = tune(model, training, memory_ceiling * 2. ** 20,
+                batch_sizes, threads, min_time)
+        choice[mode] = best
+        print "{0}: batch size {1} on {2} thread(s), {3:.0f} instances/s" \
+                .format(mode, best['batch_size'], best['threads'],
+                        best['instances_per_second'])
+    del model
+    #re-read, in case another run has written it in the meantime
+    cache = read_cache(cache_file)
+    cache.setdefault(host, {})[key] = choice
+    write_cache(cache_file, cache)
+    return choice
+
+
+def tune_parameters(params):
+    """
+    Set the batch sizes and thread counts of an experiment from autotune()
+    """
+    choice = autotune(params, params.memory_ceiling, params.autotune_cache)
+    params.batch_size = choice['training']['batch_size']
+    params.blas_threads = choice['training']['threads']
+    params.inference_batch_size = choice['inference']['batch_size']
+    params.inference_blas_threads = choice['inference']['threads']
+    return params
+
+
+def inference_batch_size(params):
+    """
+    The batch size to predict with, which is the training one unless it
+    has been set apart, e.g. by autotune
+    """
+    size = params.__dict__.get('inference_batch_size')
+    if size is None:
+        return params.batch_size
+    return size
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+"""
+Per-member checkpointing of ensemble training, so that an interrupted run can
+be resumed and a finished ensemble can be grown
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import gc
+import cPickle
+import numpy.random
+
+from archive import EnsembleArchive, is_archive, method_name
+from member_store import MemberStore
+from autotune import inference_batch_size
+
+STATE_FILE = 'method_state.pkl'
+
+
+class EnsembleCheckpoint:
+    """
+    An ensemble archive that is written to after every member, together with
+    the state of the ensemble method (e.g. the boosting distribution and
+    alphas) and of the random number generator used for resampling.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.archive = None
+
+    def exists(self):
+        return is_archive(self.path) and \
+                os.path.isfile(os.path.join(self.path, STATE_FILE))
+
+    def start(self, method, params):
+        """
+        Create the archive along with the state of the untrained method, so
+        that a crash before the first member is saved can still be resumed
+        """
+        if is_archive(self.path) and len(EnsembleArchive(self.path)) > 0:
+            raise ValueError("{0} already holds an ensemble without "
+                    "checkpoint state".format(self.path))
+        with open(params.model_file) as f:
+            model_yaml = f.read()
+        self.archive = EnsembleArchive.create(self.path, model_yaml, method,
+                params)
+        self.write_state(method, 0)
+
+    def save(self, method, member):
+        """
+        Record a member that has just been created. The weights are written
+        before the state, so a crash in between leaves an extra member
+        behind, which is discarded on restore.
+        """
+        if isinstance(member, (list, tuple)):
+            weights = member
+        else:
+            weights = member.get_weights()
+        self.write_state(method,
+                self.archive.add_member(weights, last_alpha(method)) + 1)
+
+    def write_state(self, method, n_members):
+        state = { 'n_members': n_members,
+                  'method_state': method.get_state(),
+                  'rng_state': numpy.random.get_state(),
+                }
+        tmp = os.path.join(self.path, STATE_FILE + '.tmp')
+        with open(tmp, 'wb') as f:
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, os.path.join(self.path, STATE_FILE))
+
+    def restore(self, method, rebuild = True):
+        """
+        Reload the state of a prepared ensemble method, returning the members
+        trained so far, or nothing without `rebuild`
+        """
+        self.archive = EnsembleArchive(self.path)
+        if self.archive.method != method_name(method):
+            raise ValueError("{0} holds a {1} ensemble, not {2}".format(
+                self.path, self.archive.method, method_name(method)))
+        with open(os.path.join(self.path, STATE_FILE), 'rb') as f:
+            state = cPickle.load(f)
+        if len(self.archive) > state['n_members']:
+            print "discarding {0} incomplete member(s)".format(
+                    len(self.archive) - state['n_members'])
+            self.archive.truncate(state['n_members'])
+        method.set_state(state['method_state'])
+        method.restore_members(self.archive)
+        #rebuilding the models draws initial weights, so it has to happen
+        #before the random state is put back
+        members = None
+        if rebuild:
+            members = list(self.archive.iter_members())
+        numpy.random.set_state(state['rng_state'])
+        return members
+
+
+def last_alpha(method):
+    if 'alphas' in method.__dict__ and len(method.alphas) > 0:
+        return method.alphas[-1]
+    return None
+
+
+def offload(method, store, index):
+    """
+    Swap the method's own copy of a member for the weights memory mapped
+    from the store
+    """
+    if 'members' in method.__dict__ and index < len(method.members):
+        method.members[index] = store.weights(index)
+
+
+def save_head(method, members, archive):
+    """
+    Fit the closed-form stack head of a Stacking method (head: logistic,
+    nnls or ridge) on its trained members and save it in the archive, which
+    cannot be served or exported without it
+    """
+    if method.__dict__.get('head', 'mlp') == 'mlp':
+        return
+    method.create_aggregator(method.params, members, None, None,
+            method.resampler.get_train(), method.resampler.get_valid())
+    archive.set_head(method.stack_head)
+
+
+def save_outputs(store, index, model, cached_sets, batch_size):
+    import serving
+    for name, x in cached_sets.items():
+        if not store.has_outputs(name, index):
+            store.save_outputs(name, index,
+                    serving.member_output(model, numpy.asarray(x), batch_size))
+
+
+def train_ensemble(method, params, x, y, checkpoint = None, grow = 0,
+        max_loaded = None, cached_sets = None):
+    """
+    Train the members of a prepared ensemble method. With a checkpoint, every
+    member is saved as soon as it is trained, and an existing checkpoint is
+    resumed from its last completed member. `grow` adds that many members
+    beyond those already in the checkpoint, instead of training up to
+    `ensemble_size`. A closed-form stack head is fitted on all the members
+    and saved in the checkpoint's archive at the end.
+
+    With `max_loaded`, the members are not kept in memory: each is written
+    to a MemberStore (in the checkpoint's archive, or a temporary one) as
+    soon as it is trained and the model is freed. The store is returned
+    instead of a list, and rebuilds at most `max_loaded` members at a time.
+    Its outputs on every set of `cached_sets`, a dict of names to inputs,
+    are stored along with each member.
+    """
+    if cached_sets and max_loaded is None:
+        raise ValueError("member outputs are only cached by a member store")
+    members = []
+    if checkpoint is not None:
+        if checkpoint.exists():
+            members = checkpoint.restore(method, rebuild = max_loaded is None)
+            if members is None:
+                members = MemberStore(checkpoint.archive, max_loaded)
+            print "resuming after member {0}".format(len(members))
+        else:
+            checkpoint.start(method, params)
+            if max_loaded is not None:
+                members = MemberStore(checkpoint.archive, max_loaded)
+    elif max_loaded is not None:
+        with open(params.model_file) as f:
+            members = MemberStore.create(f.read(), method, params, max_loaded)
+    store = members if isinstance(members, MemberStore) else None
+    if store is not None:
+        for i in range(len(store)):
+            offload(method, store, i)
+            if cached_sets:
+                save_outputs(store, i, store[i], cached_sets,
+                        inference_batch_size(params))
+    if grow > 0:
+        ensemble_size = len(members) + grow
+    else:
+        ensemble_size = params.ensemble_size
+    for i in range(len(members), ensemble_size):
+        print 'training member {0}'.format(i)
+        new_member = method.create_member(x,y)
+        if checkpoint is not None:
+            checkpoint.save(method, new_member)
+        if store is None:
+            members.append(new_member)
+        else:
+            if checkpoint is None:
+                store.add(new_member, last_alpha(method))
+            if cached_sets:
+                save_outputs(store, i, new_member, cached_sets,
+                        inference_batch_size(params))
+            offload(method, store, i)
+            del new_member
+        gc.collect()
+    if checkpoint is not None:
+        save_head(method, members, checkpoint.archive)
+    return members
@@ -8,9 +8,43 @@ All code released under Apachev2.0 licensing.
 """
 __docformat__ = 'restructedtext en'
 
+import importlib
+import types
+import json
 import numpy
 import yaml
 
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is only imported when one of its attributes
+    is first used, so that heavy backends (Theano, Keras, scipy) are not
+    loaded by tools that never need them
+    """
+
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr):
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            #submodules that the package does not import itself
+            return importlib.import_module(self.__name__ + '.' + attr)
+
+def sharedX(value):
+    """
+    A Theano shared variable of floatX holding `value`
+    """
+    import theano
+    return theano.shared(numpy.asarray(value, dtype=theano.config.floatX))
+
 class Toupee:
     
     def __init__(self):
@@ -28,6 +62,73 @@ class Toupee:
         if hook not in self.reset_hooks:
             self.reset_hooks.append(hook)
 
+    def epoch_done(self, stats):
+        for hook in self.epoch_hooks:
+            hook(stats)
+
+    def training_reset(self):
+        for hook in self.reset_hooks:
+            hook()
+
+#hooks called for every model trained in this process, on top of the ones
+#configured in the experiment description
+if 'toupee_global_instance' not in locals():
+    toupee_global_instance = Toupee()
+
+class JSONLinesHook:
+    """
+    Epoch hook appending every epoch's statistics to a JSON lines file
+    """
+
+    def __init__(self, filename, **extra):
+        self.filename = filename
+        self.extra = extra
+
+    def __call__(self, stats):
+        record = dict(self.extra)
+        record.update(stats)
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(record, default=serialize) + '\n')
+
+class ResultsDBHook:
+    """
+    Epoch hook inserting every epoch's statistics into the results DB, in
+    the epoch_stats_table table (default: epochs)
+    """
+
+    def __init__(self, params, **extra):
+        self.params = params
+        self.extra = extra
+        self.table = None
+
+    def __call__(self, stats):
+        if self.table is None:
+            self.table = results_table(self.params, self.params.__dict__.get(
+                'epoch_stats_table') or 'epochs')
+        record = dict(self.extra)
+        record.update(stats)
+        self.table.insert(json.loads(json.dumps(record,default=serialize)))
+
+def training_hooks(params):
+    """
+    The global hooks plus those asked for by the experiment: epoch_log
+    names a JSON lines file, and epoch_stats_table a results DB table
+    """
+    t = Toupee()
+    for hook in toupee_global_instance.epoch_hooks:
+        t.add_epoch_hook(hook)
+    for hook in toupee_global_instance.reset_hooks:
+        t.add_reset_hook(hook)
+    extra = {}
+    if 'trial' in params.__dict__:
+        extra['trial'] = params.trial
+    if params.__dict__.get('epoch_log') is not None:
+        t.add_epoch_hook(JSONLinesHook(params.epoch_log, **extra))
+    if 'results_db' in params.__dict__ and \
+            params.__dict__.get('epoch_stats_table') is not None:
+        t.add_epoch_hook(ResultsDBHook(params, **extra))
+    return t
+
 class Results:
 
     def __init__(self,params):
@@ -44,6 +145,33 @@ class Results:
         self.best_epoch = epoch
         self.params = self.params.serialize()
 
+#one MongoDB client per host, shared by everything that saves results
+mongo_clients = {}
+
+def results_table(params, table_name=None):
+    """
+    The MongoDB collection given by results_db, results_host and
+    results_table (or `table_name`)
+    """
+    host = params.__dict__.get('results_host')
+    if host not in mongo_clients:
+        from pymongo import MongoClient
+        mongo_clients[host] = MongoClient(host=host)
+    if table_name is None:
+        table_name = params.__dict__.get('results_table', 'results')
+    return mongo_clients[host][params.results_db][table_name]
+
+def save_results(record, params, table_name=None):
+    """
+    Insert a results record into the results DB, if the experiment has a
+    results_db
+    """
+    if 'results_db' not in params.__dict__:
+        return
+    table = results_table(params, table_name)
+    print "saving results to {0}".format(table.full_name)
+    table.insert(json.loads(json.dumps(record,default=serialize)))
+
 class ConfiguredObject(yaml.YAMLObject):
 
     def _default_value(self, param_name, value):
@@ -68,6 +196,3 @@ def serialize(o):
                     return str(o)
             else:
                 raise Exception("don't know how to save {0}".format(type(o)))
-
-if 'toupee_global_instance' not in locals():
-    toupee_global_instance = Toupee()
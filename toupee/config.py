@@ -11,6 +11,8 @@ __docformat__ = 'restructedtext en'
 import yaml 
 import ensemble_methods
 import parameters
+import profiling
+import autotune
 
 defaults = { 'random_seed': None,
              'save_images': False,
@@ -25,8 +27,21 @@ defaults = { 'random_seed': None,
              #TODO:'pretraining': None,
              'early_stopping' : None,
              'training_method' : 'normal',
+             'training_processes' : None,
              'pretraining_passes' : 0,
              'one_hot' : True,
+             'epoch_log' : None,
+             'epoch_stats_table' : None,
+             'profile' : False,
+             'storage_dtype' : None,
+             'input_scale' : None,
+             'max_loaded_members' : None,
+             'autotune' : False,
+             'autotune_cache' : None,
+             'memory_ceiling' : None,
+             'inference_batch_size' : None,
+             'blas_threads' : None,
+             'inference_blas_threads' : None,
            }
 
 def load_parameters(filename):
@@ -35,4 +50,8 @@ def load_parameters(filename):
     for d in defaults:
         if d not in r:
             r[d] = defaults[d]
-    return parameters.Parameters(**r)
+    profiling.configure(r['profile'])
+    params = parameters.Parameters(**r)
+    if params.autotune:
+        autotune.tune_parameters(params)
+    return params
@@ -14,15 +14,24 @@ import os
 import gc
 import sys
 import numpy as np
-import scipy.ndimage as ni
-import scipy.stats
 import numpy.random
 import gzip
 import cPickle
 import math
-from skimage import transform as tf
+import json
+import zlib
+import struct
 import multiprocessing
-from scipy.misc import imsave
+import multiprocessing.pool
+
+import common
+import sharded
+from profiling import timed
+
+#only needed for weighted resampling and the Transformer
+ni = common.LazyModule('scipy.ndimage')
+scipy = common.LazyModule('scipy')
+tf = common.LazyModule('skimage.transform')
 
 def corrupt(data,p):
     return mask(1-p,data.shape,dtype=floatX) * data
@@ -37,32 +46,174 @@ def std_norm(d):
     x = x / np.std(x,axis=0)
     return(x,y)
 
+class CompactArray:
+    """
+    An input array kept in a compact storage dtype (e.g. uint8 pixels), that
+    is cast to `dtype`, multiplied by `scale` and centred and normalised with
+    `mean` and `std` one minibatch at a time, when it is indexed.
+    `subset` and `reshape` keep the storage dtype.
+    """
+
+    def __init__(self, base, scale = None, mean = None, std = None,
+            dtype = 'float32'):
+        self.base = base
+        self.scale = scale
+        self.mean = mean
+        self.std = std
+        self.dtype = np.dtype(dtype)
+
+    def __len__(self):
+        return len(self.base)
+
+    @property
+    def shape(self):
+        return self.base.shape
+
+    @property
+    def ndim(self):
+        return self.base.ndim
+
+    @property
+    def nbytes(self):
+        return self.base.nbytes
+
+    def _view(self, **changes):
+        attrs = dict(base = self.base, scale = self.scale, mean = self.mean,
+                     std = self.std, dtype = self.dtype)
+        attrs.update(changes)
+        return CompactArray(**attrs)
+
+    def convert(self, x):
+        x = np.asarray(x).astype(self.dtype)
+        if self.scale is not None:
+            x *= self.scale
+        if self.mean is not None:
+            x -= self.mean
+        if self.std is not None:
+            x /= self.std
+        return x
+
+    def subset(self, positions):
+        return self._view(base = self.base[positions])
+
+    def reshape(self, shape):
+        shape = tuple(shape)
+        row_shape = shape[1:]
+        stats = {}
+        for name in ['mean', 'std']:
+            if getattr(self, name) is not None:
+                stats[name] = getattr(self, name).reshape(row_shape)
+        return self._view(base = self.base.reshape(shape), **stats)
+
+    def __getitem__(self, key):
+        return self.convert(self.base[key])
+
+    def __array__(self, dtype = None):
+        a = self.convert(self.base)
+        if dtype is not None:
+            a = a.astype(dtype)
+        return a
+
+def feature_stats(x, scale = None, chunk_size = 10000):
+  """
+  The per-feature mean and standard deviation of `x` after scaling, computed
+  a chunk of rows at a time so that `x` is never converted as a whole
+  """
+  total = np.zeros(x.shape[1:], dtype = 'float64')
+  total_sq = np.zeros(x.shape[1:], dtype = 'float64')
+  for start in xrange(0, len(x), chunk_size):
+    chunk = x[start:start + chunk_size].astype('float64')
+    if scale is not None:
+      chunk *= scale
+    total += chunk.sum(axis = 0)
+    total_sq += (chunk ** 2).sum(axis = 0)
+  mean = total / len(x)
+  std = np.sqrt(np.maximum(total_sq / len(x) - mean ** 2, 0.))
+  return mean.astype('float32'), std.astype('float32')
+
+def is_integral(x, chunk_size = 10000):
+  chunks = (x[start:start + chunk_size]
+            for start in xrange(0, len(x), chunk_size))
+  return all(np.all(c == np.round(c)) for c in chunks)
+
+def to_storage_dtype(x, storage_dtype, chunk_size = 10000):
+  """
+  Cast `x` to `storage_dtype`, refusing to round non-integral values into
+  an integer dtype, or to wrap or overflow values out of its range. Every
+  value is checked, a chunk of rows at a time.
+  """
+  storage_dtype = np.dtype(storage_dtype)
+  x = np.asarray(x)
+  if x.dtype == storage_dtype:
+    return x
+  if storage_dtype.kind in 'iu':
+    info = np.iinfo(storage_dtype)
+  elif storage_dtype.kind == 'f':
+    info = np.finfo(storage_dtype)
+  else:
+    info = None
+  lossy = False
+  if info is not None and x.size > 0:
+    lossy = x.min() < info.min or x.max() > info.max
+    if storage_dtype.kind in 'iu' and x.dtype.kind == 'f':
+      lossy = lossy or not is_integral(x, chunk_size)
+  if lossy:
+    raise ValueError("the data cannot be stored as {0} without losing "
+                     "precision, use a wider storage_dtype or "
+                     "input_scale".format(storage_dtype))
+  return x.astype(storage_dtype)
+
+def compact_set(d, scale = None, center_and_normalise = False):
+  x,y = d
+  if center_and_normalise:
+    mean, std = feature_stats(x, scale)
+    #constant features are left unscaled rather than divided by zero
+    std[std == 0] = 1.
+    return (CompactArray(x, scale, mean, std), y)
+  return (CompactArray(x, scale), y)
+
+@timed('load_data')
 def load_data(dataset, resize_to = None, pickled = True,
               center_and_normalise = False, join_train_and_valid = False,
-              one_hot_y = True):
+              one_hot_y = True, storage_dtype = None, input_scale = None):
   ''' Loads the dataset
 
   :type dataset: string
   :param dataset: the path to the dataset (here MNIST)
+
+  With `storage_dtype` (e.g. uint8 or float16) or `input_scale`, x is kept
+  in memory in its storage dtype as a CompactArray, and cast, scaled by
+  `input_scale` and normalised a minibatch at a time.
   '''
 
   data_dir, data_file = os.path.split(dataset)
+  if not pickled and sharded.is_sharded(dataset):
+    return load_sharded_data(dataset, resize_to, center_and_normalise,
+                             join_train_and_valid, one_hot_y, input_scale,
+                             storage_dtype)
   if pickled:
     if data_dir == "" and not os.path.isfile(dataset):
       new_path = os.path.join(os.path.split(__file__)[0], "..", "data", dataset)
       if os.path.isfile(new_path) or data_file == 'mnist.pkl.gz':
         dataset = new_path
     print('loading data...')
-    f = gzip.open(dataset, 'rb')
-    train_set, valid_set, test_set = cPickle.load(f)
-    f.close()
+    if dataset.endswith(BLOCKED_EXTENSION):
+      train_set, valid_set, test_set = load_blocked(dataset)
+    else:
+      f = gzip.open(dataset, 'rb')
+      train_set, valid_set, test_set = cPickle.load(f)
+      f.close()
   else:
-    tr = np.load(dataset + 'train.npz')
-    v = np.load(dataset + 'valid.npz')
-    te = np.load(dataset + 'test.npz')
-    train_set = (tr['x'],tr['y'])
-    valid_set = (v['x'],v['y'])
-    test_set = (te['x'],te['y'])
+    #the three splits are decompressed concurrently, zlib releases the GIL
+    pool = multiprocessing.pool.ThreadPool(3)
+    train_set, valid_set, test_set = pool.map(load_npz,
+        [dataset + 'train.npz', dataset + 'valid.npz', dataset + 'test.npz'])
+    pool.close()
+  compact = storage_dtype is not None or input_scale is not None
+  if storage_dtype is not None:
+    train_set, valid_set, test_set = [
+        (to_storage_dtype(x, storage_dtype), y)
+        for x, y in (train_set, valid_set, test_set)]
   if resize_to is not None:
     orig_size = math.sqrt(train_set[0].shape[1])
     train_set = (
@@ -86,10 +237,6 @@ def load_data(dataset, resize_to = None, pickled = True,
                       ),
                       resize_to),
                   test_set[1])
-  if center_and_normalise:
-    train_set = std_norm(sub_mean(train_set))
-    valid_set = std_norm(sub_mean(valid_set))
-    test_set  = std_norm(sub_mean(test_set))
   if join_train_and_valid:
     set_x = numpy.concatenate([
                 train_set[0],
@@ -101,12 +248,122 @@ def load_data(dataset, resize_to = None, pickled = True,
             ])
     train_set = (set_x,set_y)
     valid_set = train_set
+  #every set is normalised on its own statistics, after joining train and
+  #valid, whether it is kept compact or not
+  if compact:
+    train_set = compact_set(train_set, input_scale, center_and_normalise)
+    valid_set = compact_set(valid_set, input_scale, center_and_normalise)
+    test_set  = compact_set(test_set, input_scale, center_and_normalise)
+  elif center_and_normalise:
+    train_set = std_norm(sub_mean(train_set))
+    valid_set = std_norm(sub_mean(valid_set))
+    test_set  = std_norm(sub_mean(test_set))
   if one_hot_y:
-      train_set = (train_set[0], one_hot(train_set[1]))
-      valid_set = (valid_set[0], one_hot(valid_set[1]))
-      test_set = (test_set[0], one_hot(test_set[1]))
+      #the labels are only ever 0 or 1, so they are stored compactly too
+      y_dtype = 'uint8' if compact else 'float32'
+      train_set = (train_set[0], one_hot(train_set[1], dtype = y_dtype))
+      valid_set = (valid_set[0], one_hot(valid_set[1], dtype = y_dtype))
+      test_set = (test_set[0], one_hot(test_set[1], dtype = y_dtype))
   return (train_set, valid_set, test_set)
 
+def load_sharded_data(dataset, resize_to = None, center_and_normalise = False,
+                      join_train_and_valid = False, one_hot_y = True,
+                      input_scale = None, storage_dtype = None):
+  """
+  Open a sharded dataset (see sharded.py) without reading it into memory.
+  The y arrays are one-hot encoded, and the x arrays scaled by
+  `input_scale`, a minibatch at a time. The shards are read in the dtype
+  they were written in, which `storage_dtype` has to match.
+  """
+  if resize_to is not None or center_and_normalise or join_train_and_valid:
+    raise ValueError("resizing, normalising and joining train and valid are "
+                     "not supported for sharded datasets")
+  sets = [sharded.load_split(dataset, split) for split in sharded.SPLITS]
+  if storage_dtype is not None:
+    for x, y in sets:
+      if x.dtype != np.dtype(storage_dtype):
+        raise ValueError("{0} is sharded as {1}, convert it again to store "
+                         "it as {2}".format(dataset, x.dtype, storage_dtype))
+  if input_scale is not None:
+    sets = [(x.with_transform(
+                lambda b: b.astype('float32') * np.float32(input_scale)), y)
+            for x, y in sets]
+  if one_hot_y:
+    n_classes = max(y.n_classes for x, y in sets) or None
+    sets = [(x, y.with_transform(lambda b: one_hot(b, n_classes)))
+            for x, y in sets]
+  return tuple(sets)
+
+def load_npz(filename):
+  f = np.load(filename)
+  return (f['x'],f['y'])
+
+BLOCKED_EXTENSION = '.zblk'
+BLOCKED_MAGIC = 'TOUPEEZB1\n'
+BLOCK_SIZE = 1 << 22
+
+def save_blocked(filename, dataset, level = 6):
+  """
+  Save a (train, valid, test) dataset as zlib-compressed blocks of
+  BLOCK_SIZE bytes, preceded by a JSON index of the arrays and their blocks,
+  so that load_blocked can decompress the blocks in parallel.
+  """
+  index = {}
+  with open(filename, 'wb') as f:
+    payload = []
+    offset = 0
+    for split, (x, y) in zip(['train', 'valid', 'test'], dataset):
+      for name, a in ((split + '_x', x), (split + '_y', y)):
+        raw = np.ascontiguousarray(a).view(np.uint8).ravel()
+        blocks = []
+        for start in xrange(0, len(raw), BLOCK_SIZE):
+          block = zlib.compress(raw[start:start + BLOCK_SIZE].tostring(), level)
+          blocks.append([offset, len(block), start])
+          payload.append(block)
+          offset += len(block)
+        index[name] = { 'dtype': np.asarray(a).dtype.str,
+                        'shape': list(np.shape(a)),
+                        'blocks': blocks }
+    header = json.dumps(index)
+    f.write(BLOCKED_MAGIC)
+    f.write(struct.pack('<Q', len(header)))
+    f.write(header)
+    for block in payload:
+      f.write(block)
+
+def load_blocked(filename, threads = None):
+  """
+  Load a dataset written by save_blocked, decompressing its blocks on
+  `threads` threads straight into the final arrays
+  """
+  with open(filename, 'rb') as f:
+    if f.read(len(BLOCKED_MAGIC)) != BLOCKED_MAGIC:
+      raise ValueError("{0} is not a blocked dataset".format(filename))
+    header_size, = struct.unpack('<Q', f.read(8))
+    index = json.loads(f.read(header_size))
+    data_start = f.tell()
+  arrays = {}
+  tasks = []
+  for name, info in index.items():
+    a = np.empty(info['shape'], dtype = info['dtype'])
+    arrays[name] = a
+    raw = a.reshape(-1).view(np.uint8)
+    tasks.extend((raw, offset, size, start)
+                 for offset, size, start in info['blocks'])
+  def decompress(task):
+    raw, offset, size, start = task
+    with open(filename, 'rb') as f:
+      f.seek(data_start + offset)
+      block = zlib.decompress(f.read(size))
+    raw[start:start + len(block)] = np.frombuffer(block, dtype = np.uint8)
+  if threads is None:
+    threads = multiprocessing.cpu_count()
+  pool = multiprocessing.pool.ThreadPool(threads)
+  pool.map(decompress, tasks)
+  pool.close()
+  return tuple((arrays[split + '_x'], arrays[split + '_y'])
+               for split in ['train', 'valid', 'test'])
+
 def make_pretraining_set(datasets,mode):
   if mode is not None:
     return (datasets[0][0],datasets[0][1])
@@ -132,6 +389,7 @@ class Resampler:
         self.s_test = None
         np.random.seed(seed)
         
+    @timed('resample')
     def make_new_train(self,sample_size,distribution=None):
         if distribution is None:
             sample = np.random.randint(low=0,
@@ -141,14 +399,16 @@ class Resampler:
             values = (range(len(distribution)),distribution)
             d = scipy.stats.rv_discrete(a=0,b=len(distribution),values=values)
             sample = d.rvs(size=sample_size)
-        sampled_x = []
-        sampled_y = []
-        for s in sample:
-            sampled_x.append(self.train_x[s])
-            sampled_y.append(self.train_y[s])
-        sampled_x = numpy.asarray(sampled_x)
-        sampled_y = numpy.asarray(sampled_y)
-        self.r_train = (sampled_x,sampled_y)
+        if isinstance(self.train_x, sharded.ShardedArray):
+            #a lazy view, the sample is gathered a minibatch at a time
+            self.r_train = (self.train_x.subset(sample),
+                            self.train_y.subset(sample))
+        elif isinstance(self.train_x, CompactArray):
+            self.r_train = (self.train_x.subset(sample),
+                            numpy.asarray(self.train_y)[sample])
+        else:
+            self.r_train = (numpy.asarray(self.train_x)[sample],
+                            numpy.asarray(self.train_y)[sample])
         return self.r_train
 
     def get_train(self):
@@ -284,7 +544,9 @@ class Transformer:
     def get_data(self):
         return np.array(self.final_x)
 
-def one_hot(dataset):
-    b = np.zeros((dataset.size, dataset.max()+1),dtype='float32')
+def one_hot(dataset, n_classes = None, dtype = 'float32'):
+    if n_classes is None:
+        n_classes = dataset.max()+1
+    b = np.zeros((dataset.size, n_classes),dtype=dtype)
     b[np.arange(dataset.size), dataset] = 1.
     return b
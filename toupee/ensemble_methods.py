@@ -11,20 +11,26 @@ __docformat__ = 'restructedtext en'
 import sys
 import numpy as np
 import numpy.random
-import theano
-import theano.tensor as T
 import yaml
 import math
 import copy
 
-import mlp
 from data import Resampler, Transformer, load_data, \
         make_pretraining_set, WeightedResampler
 from parameters import Parameters
 import common
-import utils
-
-floatX = theano.config.floatX
+from common import sharedX
+import archive
+import sharded
+import scheduling
+import stacking
+import autotune
+import profiling
+from profiling import timed
+
+#Theano is only imported once an aggregator or a boosting update needs it
+theano = common.LazyModule('theano')
+T = common.LazyModule('theano.tensor')
 
 class Aggregator:
     """
@@ -34,12 +40,14 @@ class Aggregator:
         pass
 
     def compute(self, set_x):
+        import utils
         return utils.batched_computation(self.x, set_x, self.p_y_given_x,
-                self.params.batch_size)
+                autotune.inference_batch_size(self.params))
 
     def classify(self, set_x):
+        import utils
         return utils.batched_computation(self.x, set_x, self.y_pred,
-                self.params.batch_size)
+                autotune.inference_batch_size(self.params))
 
 class AveragingRunner(Aggregator):
     """
@@ -53,7 +61,8 @@ class AveragingRunner(Aggregator):
         self.y = y
         self.p_y_given_x = sum([m.p_y_given_x for m in self.members]) / len(members)
         self.y_pred = T.argmax(self.p_y_given_x, axis=1)
-        self.errors = T.mean(T.neq(self.y_pred, y), dtype=floatX, acc_dtype=floatX)
+        self.errors = T.mean(T.neq(self.y_pred, y), dtype=theano.config.floatX,
+                acc_dtype=theano.config.floatX)
 
 
 class MajorityVotingRunner(Aggregator):
@@ -69,7 +78,8 @@ class MajorityVotingRunner(Aggregator):
         self.p_y_given_x = sum([T.eq(T.max(m.p_y_given_x),m.p_y_given_x)
             for m in self.members])
         self.y_pred = T.argmax(self.p_y_given_x, axis=1)
-        self.errors = T.mean(T.neq(self.y_pred, y), dtype=floatX, acc_dtype=floatX)
+        self.errors = T.mean(T.neq(self.y_pred, y), dtype=theano.config.floatX,
+                acc_dtype=theano.config.floatX)
 
 
 class WeightedAveragingRunner(Aggregator):
@@ -85,7 +95,8 @@ class WeightedAveragingRunner(Aggregator):
         self.p_y_given_x = sum([self.members[i].p_y_given_x * weights[i]
             for i in range(len(self.members))])
         self.y_pred = T.argmax(self.p_y_given_x, axis=1)
-        self.errors = T.mean(T.neq(self.y_pred, y), dtype=floatX, acc_dtype=floatX)
+        self.errors = T.mean(T.neq(self.y_pred, y), dtype=theano.config.floatX,
+                acc_dtype=theano.config.floatX)
 
 
 class StackingRunner(Aggregator):
@@ -94,6 +105,8 @@ class StackingRunner(Aggregator):
     """
 
     def join_outputs(self, x, set_x_shared, batch_size, p=0.):
+        if isinstance(set_x_shared, sharded.ShardedArray):
+            raise ValueError("stacking does not support sharded datasets")
         rng = numpy.random.RandomState()
         set_x = set_x_shared.eval()
         n_instances = set_x.shape[0]
@@ -121,9 +134,12 @@ class StackingRunner(Aggregator):
             p = 0.
         else:
             p = params.dropstack_prob
-        self.train_input_x = self.join_outputs(x, train_set_x, params.batch_size, p)
-        self.valid_input_x = self.join_outputs(x, valid_set_x, params.batch_size, p)
+        self.train_input_x = self.join_outputs(x, train_set_x,
+                autotune.inference_batch_size(params), p)
+        self.valid_input_x = self.join_outputs(x, valid_set_x,
+                autotune.inference_batch_size(params), p)
         print 'training stack head'
+        import mlp
         self.head_x = T.concatenate([m.p_y_given_x
                                     for m in self.members],axis=1)
         dataset = ((self.train_input_x,train_set_y),
@@ -137,6 +153,51 @@ class StackingRunner(Aggregator):
         self.errors = self.stack_head.errors(y)
 
 
+def member_errors(model, dataset, batch_size):
+    """
+    1 for every instance of an (x, y) set that a Keras member misclassifies,
+    0 otherwise. Sharded sets are predicted one minibatch at a time.
+    """
+    set_x, set_y = dataset
+    shape = list(model.inputs[0]._keras_shape[1:])
+    errors = []
+    for x, y in sharded.iterate_minibatches(set_x, set_y, batch_size):
+        x = numpy.asarray(x)
+        y = numpy.asarray(y)
+        if y.ndim > 1:
+            y = y.argmax(axis = 1)
+        p = model.predict(x.reshape([x.shape[0]] + shape),
+                batch_size = batch_size, verbose = 0)
+        errors.append(p.argmax(axis = 1) != y)
+    return numpy.concatenate(errors).astype(theano.config.floatX)
+
+
+def bootstrap_counts(n, sample_size, mode, rng = numpy.random):
+    """
+    How many times each of `n` instances is drawn into a bootstrap sample of
+    `sample_size` instances: exactly (multinomial), or independently for
+    every instance (poisson)
+    """
+    if mode == 'multinomial':
+        counts = rng.multinomial(sample_size, numpy.ones(n) / n)
+    elif mode == 'poisson':
+        counts = rng.poisson(float(sample_size) / n, n)
+    else:
+        raise ValueError("unknown bootstrap mode {0}".format(mode))
+    return counts.astype(theano.config.floatX)
+
+
+def boosting_update(D, errors):
+    """
+    The AdaBoost.M1 update: the weight alpha of a member from its error
+    weighted by the distribution D, and the new distribution
+    """
+    e = T.sum((errors * D)).eval()
+    alpha = .5 * math.log((1-e)/e)
+    w = T.switch(T.eq(errors,1), D * T.exp(alpha), D * T.exp(-alpha))
+    return alpha, w / w.sum()
+
+
 class EnsembleMethod(common.ConfiguredObject):
 
     def _default_value(self, param_name, value):
@@ -153,6 +214,7 @@ class EnsembleMethod(common.ConfiguredObject):
         raise NotImplementedException()
 
     def load_weights(self,weights,x,y,index):
+        import mlp
         self.members = []
         for w in weights:
             rng = numpy.random.RandomState(self.params.random_seed)
@@ -161,6 +223,133 @@ class EnsembleMethod(common.ConfiguredObject):
             self.members.append(m)
         return self.members
 
+    def prepare_warm_start(self):
+        """
+        Optionally start each member from the weights of the previous member
+        (warm_start: previous) or of the first one (warm_start: first), and
+        train it for n_epochs_after_first epochs instead of n_epochs.
+        warm_start_file gives the weights of a base model to start from
+        instead, and warm_start_noise perturbs the starting weights with
+        gaussian noise scaled by the standard deviation of each array.
+        """
+        self._default_value('warm_start', None)
+        self._default_value('warm_start_file', None)
+        self._default_value('warm_start_noise', 0.)
+        self._default_value('n_epochs_after_first', None)
+        if self.warm_start not in (None, 'previous', 'first'):
+            raise ValueError("unknown warm start policy {0}".format(
+                self.warm_start))
+        self.warm_weights = None
+        if self.warm_start_file is not None:
+            self.warm_weights = archive.load_weights(self.warm_start_file)
+
+    def reject_options(self, *names):
+        """
+        Fail on options that this method would otherwise silently ignore
+        """
+        for name in names:
+            if self.__dict__.get(name) is not None:
+                raise ValueError("{0} does not support {1}".format(
+                    archive.method_name(self), name))
+
+    def initial_weights(self):
+        if self.warm_weights is None:
+            return None
+        if self.warm_start_noise <= 0.:
+            return self.warm_weights
+        if self.params.random_seed is None:
+            rng = numpy.random.RandomState()
+        else:
+            rng = numpy.random.RandomState([self.params.random_seed,
+                                            self.params.member_number])
+        return [w + rng.normal(0., self.warm_start_noise * w.std(),
+                               w.shape).astype(w.dtype)
+                for w in self.warm_weights]
+
+    def prepare_sample_weighting(self, modes):
+        """
+        With sample_weighting set, every member is trained on the whole
+        training set with a weight per instance, instead of on a resampled
+        copy of it: bootstrap counts (poisson or multinomial) for bagging,
+        the boosting distribution (distribution) for boosting
+        """
+        self._default_value('sample_weighting', None)
+        if self.sample_weighting is not None and \
+                self.sample_weighting not in modes:
+            raise ValueError("{0} supports sample_weighting {1}, not {2}"
+                    .format(archive.method_name(self), ', '.join(modes),
+                            self.sample_weighting))
+
+    def bootstrap_train(self):
+        """
+        The training set of a new bagged member and its instance weights
+        """
+        if self.sample_weighting is None:
+            return self.resampler.make_new_train(self.params.resample_size), None
+        train = self.resampler.get_train()
+        return train, bootstrap_counts(len(train[0]),
+                self.params.resample_size, self.sample_weighting)
+
+    def train_member(self, dataset, pretraining_set, sample_weight = None):
+        """
+        Train one member on `dataset`, warm starting it if configured to
+        """
+        import mlp
+        params = self.params
+        weights = self.initial_weights()
+        if weights is not None and self.n_epochs_after_first is not None:
+            params = copy.copy(self.params)
+            params.n_epochs = self.n_epochs_after_first
+        m = mlp.sequential_model(dataset, params,
+                pretraining_set = pretraining_set, model_weights = weights,
+                callbacks = self.member_callbacks(),
+                sample_weight = sample_weight)
+        if self.warm_start == 'previous' or \
+                (self.warm_start == 'first' and self.warm_weights is None):
+            self.warm_weights = [numpy.array(w) for w in m.get_weights()]
+        return m
+
+    def member_callbacks(self):
+        """
+        With early_termination set (a dict of scheduling.SuccessiveHalving
+        arguments), a member whose validation metric falls behind most of the
+        previous members' at the same epoch is stopped early, and kept with
+        the best weights it reached
+        """
+        import mlp
+        config = self.__dict__.get('early_termination')
+        if not config:
+            return []
+        if self.__dict__.get('scheduler') is None:
+            self.scheduler = scheduling.SuccessiveHalving.from_config(config,
+                    max_epochs = self.params.n_epochs)
+            self.members_started = 0
+        self.members_started += 1
+        return [mlp.SuccessiveHalvingStopping(self.scheduler,
+            self.members_started - 1)]
+
+    def get_state(self):
+        """
+        Everything, besides the members' weights, needed to carry on training
+        """
+        state = { 'warm_weights': self.__dict__.get('warm_weights') }
+        if self.__dict__.get('scheduler') is not None:
+            state['scheduler_results'] = self.scheduler.results
+            state['members_started'] = self.members_started
+        return state
+
+    def set_state(self, state):
+        self.warm_weights = state['warm_weights']
+        if 'scheduler_results' in state:
+            self.scheduler = scheduling.SuccessiveHalving.from_config(
+                    self.early_termination, max_epochs = self.params.n_epochs)
+            self.scheduler.results = state['scheduler_results']
+            self.members_started = state['members_started']
+
+    def restore_members(self, archive):
+        self.members = [[numpy.array(w) for w in archive.member_weights(i)]
+                        for i in range(len(archive))]
+
     def serialize(self):
         return 'UnknownEnsemble'
 
@@ -171,26 +360,30 @@ class Bagging(EnsembleMethod):
     """
 
     yaml_tag = u'!Bagging'
+    independent_members = True
+
     def __init__(self,voting=False):
         self.voting = voting
         self.resampler = None
     
+    @timed('create_aggregator')
     def create_aggregator(self,params,members,x,y,train_set,valid_set):
         if 'voting' in self.__dict__ and self.voting:
             return MajorityVotingRunner(members,x,y,params)
         else:
             return AveragingRunner(members,x,y,params)
 
+    @timed('create_member', member = True)
     def create_member(self,x,y):
+        train, sample_weight = self.bootstrap_train()
         resampled = [
-                        self.resampler.make_new_train(self.params.resample_size),
+                        train,
                         self.resampler.get_valid(),
                         self.resampler.get_test()
                     ]
         pretraining_set = make_pretraining_set(resampled,self.params.pretraining)
         self.params.member_number = len(self.members) + 1
-        m = mlp.test_mlp(resampled, self.params,
-                pretraining_set = pretraining_set, x=x, y=y)
+        m = self.train_member(resampled, pretraining_set, sample_weight)
         w = m.get_weights()
         self.members.append(w)
         return m
@@ -200,6 +393,8 @@ class Bagging(EnsembleMethod):
         self.dataset = dataset
         self.resampler = Resampler(dataset)
         self.members = []
+        self.prepare_warm_start()
+        self.prepare_sample_weighting(['poisson', 'multinomial'])
 
     def serialize(self):
         return 'Bagging'
@@ -216,10 +411,13 @@ class DIB(EnsembleMethod):
         self._default_value('incremental_index', -1)
         self._default_value('grow_forward', False)
 
+    @timed('create_aggregator')
     def create_aggregator(self,params,members,x,y,train_set,valid_set):
         return WeightedAveragingRunner(members,x,y,self.alphas,params)
 
+    @timed('create_member', member = True)
     def create_member(self,x,y):
+        import mlp
         self.set_defaults()
         resampled = [self.resampler.make_new_train(self.params.resample_size),
                 self.resampler.get_valid(), self.resampler.get_test()]
@@ -247,19 +445,20 @@ class DIB(EnsembleMethod):
         self.weights['b'] = self.weights['b'][:index] + [ None for i in range(index,len(self.params.n_hidden))]
         self.weights['outb'] = None
         self.weights['outW'] = None
-        orig_train = self.resampler.get_train()
-        yhat = m.classify(sharedX(orig_train[0]))
-        errors = T.neq(orig_train[1], yhat)
-        e = T.sum((errors * self.D)).eval()
-        alpha = .5 * math.log((1-e)/e)
-        w = T.switch(T.eq(errors,1),self.D * T.exp(alpha), self.D * T.exp(-alpha))
-        self.D = w / w.sum()
-        self.resampler.update_weights(self.D.eval())
+        with profiling.phase('boosting_update'):
+            errors = member_errors(m, self.resampler.get_train(),
+                    autotune.inference_batch_size(self.params))
+            alpha, self.D = boosting_update(self.D, errors)
+            self.resampler.update_weights(self.D.eval())
         self.members.append(m)
         self.alphas.append(alpha)
         return m
 
     def prepare(self, params, dataset):
+        #DIB continues each member from the previous one by itself, and
+        #trains it through mlp.test_mlp, which takes no instance weights
+        self.reject_options('warm_start', 'warm_start_file',
+                'warm_start_noise', 'early_termination', 'sample_weighting')
         self.params = copy.deepcopy(params)
         self.dataset = dataset
         self.resampler = WeightedResampler(dataset, seed = params.random_seed)
@@ -268,6 +467,28 @@ class DIB(EnsembleMethod):
         self.members = []
         self.alphas = []
 
+    def get_state(self):
+        return { 'D': self.D.eval(),
+                 'alphas': self.alphas,
+                 'weights': self.weights,
+                 'n_hidden': self.params.__dict__.get('n_hidden'),
+                 'n_epochs': self.params.n_epochs,
+               }
+
+    def set_state(self, state):
+        self.D = theano.shared(numpy.asarray(state['D'],
+                dtype=theano.config.floatX))
+        self.resampler.update_weights(state['D'])
+        self.alphas = list(state['alphas'])
+        self.weights = state['weights']
+        if state['n_hidden'] is not None:
+            self.params.n_hidden = state['n_hidden']
+        self.params.n_epochs = state['n_epochs']
+
+    def restore_members(self, archive):
+        #only counted from here on, so the weights do instead of models
+        self.members = [archive.member_weights(i) for i in range(len(archive))]
+
     def serialize(self):
         self.set_defaults()
         return """
@@ -290,25 +511,31 @@ class AdaBoost_M1(EnsembleMethod):
 
     yaml_tag = u'!AdaBoostM1'
 
+    @timed('create_aggregator')
     def create_aggregator(self,params,members,x,y,train_set,valid_set):
             return WeightedAveragingRunner(members,x,y,self.alphas,params)
 
+    @timed('create_member', member = True)
     def create_member(self,x,y):
-        resampled = [self.resampler.make_new_train(self.params.resample_size),
-                self.resampler.get_valid(), self.resampler.get_test()]
+        if self.sample_weighting is None:
+            train = self.resampler.make_new_train(self.params.resample_size)
+            sample_weight = None
+        else:
+            #scaled to a mean of 1, so the loss keeps its usual scale
+            train = self.resampler.get_train()
+            D = numpy.asarray(self.D.eval())
+            sample_weight = (D * len(D)).astype(theano.config.floatX)
+        resampled = [train, self.resampler.get_valid(),
+                self.resampler.get_test()]
         pretraining_set = make_pretraining_set(resampled,self.params.pretraining)
         self.params.member_number = len(self.members) + 1
-        m = mlp.test_mlp(resampled, self.params,
-                pretraining_set = pretraining_set, x=x, y=y)
-        orig_train = self.resampler.get_train()
-        yhat = m.classify(sharedX(orig_train[0]))
-        errors = T.neq(orig_train[1], yhat)
-        e = T.sum((errors * self.D)).eval()
-        alpha = .5 * math.log((1-e)/e)
-        w = T.switch(T.eq(errors,1),self.D * T.exp(alpha), self.D * T.exp(-alpha))
-        self.D = w / w.sum()
-        self.resampler.update_weights(self.D.eval())
-        self.alphas.append(alpha)
+        m = self.train_member(resampled, pretraining_set, sample_weight)
+        with profiling.phase('boosting_update'):
+            errors = member_errors(m, self.resampler.get_train(),
+                    autotune.inference_batch_size(self.params))
+            alpha, self.D = boosting_update(self.D, errors)
+            self.resampler.update_weights(self.D.eval())
+            self.alphas.append(alpha)
         self.members.append(m)
         return m
 
@@ -319,6 +546,24 @@ class AdaBoost_M1(EnsembleMethod):
         self.D = sharedX(self.resampler.weights)
         self.members = []
         self.alphas = []
+        self.prepare_warm_start()
+        self.prepare_sample_weighting(['distribution'])
+
+    def get_state(self):
+        state = EnsembleMethod.get_state(self)
+        state.update({ 'D': self.D.eval(), 'alphas': self.alphas })
+        return state
+
+    def set_state(self, state):
+        EnsembleMethod.set_state(self, state)
+        self.D = theano.shared(numpy.asarray(state['D'],
+                dtype=theano.config.floatX))
+        self.resampler.update_weights(state['D'])
+        self.alphas = list(state['alphas'])
+
+    def restore_members(self, archive):
+        #only counted from here on, so the weights do instead of models
+        self.members = [archive.member_weights(i) for i in range(len(archive))]
 
     def serialize(self):
         return 'AdaBoostM1'
@@ -326,10 +571,14 @@ class AdaBoost_M1(EnsembleMethod):
 
 class Stacking(EnsembleMethod):
     """
-    Create a Stacking Runner from parameters
+    Create a Stacking Runner from parameters. The stack head is a network
+    (head: mlp), or is fitted directly (head: logistic, nnls or ridge, see
+    stacking.py). With folds, a fitted head learns from out-of-fold
+    predictions.
     """
 
     yaml_tag = u'!Stacking'
+    independent_members = True
 
     def __init__(self,n_hidden,update_rule,n_epochs,batch_size,learning_rate,
             pretraining=None,pretraining_passes=1,training_method='normal',
@@ -345,7 +594,11 @@ class Stacking(EnsembleMethod):
         self.L1_reg = self.L1_reg
         self.L2_reg = self.L2_reg
 
+    @timed('create_aggregator')
     def create_aggregator(self,params,members,x,y,train_set,valid_set):
+        if self.head != 'mlp':
+            return self.fit_head(members, train_set,
+                    self.meta_features(len(members)))
         self.main_params = self.params
         for p in self.params.__dict__:
             if p not in self.__dict__:
@@ -353,22 +606,158 @@ class Stacking(EnsembleMethod):
         return StackingRunner(members,x,y,train_set,valid_set,
                 Parameters(**self.__dict__))
 
+    def fit_head(self, members, train_set, features = None):
+        """
+        Fit a closed-form stack head (head: logistic, nnls or ridge, with an
+        L2 penalty of head_l2) on the members' outputs over the training
+        set, or on `features`, returning an EnsemblePredictor that runs it
+        """
+        import serving
+        predictor = serving.EnsemblePredictor(members,
+                batch_size = autotune.inference_batch_size(self.params))
+        if features is None:
+            features = predictor.member_outputs(train_set[0])
+        self.stack_head = stacking.make_head(self.head, self.head_l2)
+        self.stack_head.fit(features, train_set[1])
+        predictor.head = self.stack_head
+        return predictor
+
+    def meta_features(self, n_members = None):
+        """
+        With folds set, the stack head is trained on the out-of-fold
+        predictions of `n_members` members (see stacking.py), computed by
+        fold_workers processes and cached in meta_cache, instead of on their
+        predictions for the data they were trained on
+        """
+        if self.folds is None:
+            return None
+        if n_members is None:
+            n_members = self.params.ensemble_size
+        return stacking.out_of_fold_features(self.params, self.dataset,
+                n_members, self.folds,
+                cache_dir = self.meta_cache, workers = self.fold_workers)
+
+    @timed('create_member', member = True)
     def create_member(self,x,y):
-        resampled = [self.resampler.make_new_train(self.params.resample_size),
-                self.resampler.get_valid()]
+        train, sample_weight = self.bootstrap_train()
+        resampled = [train, self.resampler.get_valid(),
+                self.resampler.get_test()]
         pretraining_set = make_pretraining_set(resampled,self.params.pretraining)
         self.params.member_number = len(self.members) + 1
-        m = mlp.test_mlp(resampled, self.params,
-                pretraining_set = pretraining_set, x=x, y=y)
+        m = self.train_member(resampled, pretraining_set, sample_weight)
         w = m.get_weights()
         self.members.append(w)
         return m
 
     def prepare(self, params, dataset):
+        if sharded.is_sharded_dataset(dataset):
+            raise ValueError("Stacking does not support sharded datasets")
         self.params = params
         self.dataset = dataset
         self.resampler = Resampler(dataset)
         self.members = []
+        self.prepare_warm_start()
+        self.prepare_sample_weighting(['poisson', 'multinomial'])
+        self._default_value('folds', None)
+        self._default_value('fold_workers', 1)
+        self._default_value('meta_cache', None)
+        self._default_value('head', 'mlp')
+        self._default_value('head_l2', None)
+        if self.head != 'mlp':
+            stacking.make_head(self.head)
+        elif self.folds is not None:
+            raise ValueError("out-of-fold stacking (folds) needs a "
+                    "closed-form head: logistic, nnls or ridge")
 
     def serialize(self):
         return 'Stacking'
+
+
+class Snapshot(EnsembleMethod):
+    """
+    Create a Snapshot Ensemble from parameters: a single network is trained
+    with a cyclic learning rate for ensemble_size cycles, and the weights at
+    the end of each cycle are the members
+    """
+
+    yaml_tag = u'!Snapshot'
+
+    def set_defaults(self):
+        self._default_value('cycle_epochs', None)
+        self._default_value('lr_max', None)
+
+    @timed('create_aggregator')
+    def create_aggregator(self,params,members,x,y,train_set,valid_set):
+        return AveragingRunner(members,x,y,params)
+
+    def train_snapshots(self):
+        import mlp
+        params = copy.copy(self.params)
+        if self.cycle_epochs is None:
+            cycle_epochs = max(1, params.n_epochs // params.ensemble_size)
+        else:
+            cycle_epochs = self.cycle_epochs
+        params.n_epochs = cycle_epochs * params.ensemble_size
+        params.early_stopping = None
+        train_size = len(self.dataset[0][0])
+        batches_per_epoch = int(math.ceil(float(train_size) / params.batch_size))
+        snapshots = mlp.CosineAnnealingSnapshots(cycle_epochs, batches_per_epoch,
+                self.lr_max)
+        mlp.sequential_model(self.dataset, params,
+                callbacks = [snapshots])
+        self.snapshots = snapshots.snapshots
+
+    @timed('create_member', member = True)
+    def create_member(self,x,y):
+        import mlp
+        if self.snapshots is None:
+            self.train_snapshots()
+        index = len(self.members)
+        if index >= len(self.snapshots):
+            raise ValueError("only {0} snapshots were taken".format(
+                len(self.snapshots)))
+        self.params.member_number = index + 1
+        w = self.snapshots[index]
+        self.members.append(w)
+        return mlp.build_model(self.params.model_file, w)
+
+    def prepare(self, params, dataset):
+        #the members are snapshots of a single training run
+        self.reject_options('warm_start', 'warm_start_file',
+                'warm_start_noise', 'n_epochs_after_first',
+                'early_termination', 'sample_weighting')
+        self.set_defaults()
+        self.params = params
+        self.dataset = dataset
+        self.resampler = Resampler(dataset)
+        self.members = []
+        self.snapshots = None
+
+    def get_state(self):
+        """
+        Only the snapshots not yet emitted as members, the others are in the
+        archive already
+        """
+        state = EnsembleMethod.get_state(self)
+        state['emitted'] = len(self.members)
+        if self.snapshots is None:
+            state['snapshots'] = None
+        else:
+            state['snapshots'] = self.snapshots[len(self.members):]
+        return state
+
+    def set_state(self, state):
+        EnsembleMethod.set_state(self, state)
+        if state['snapshots'] is None:
+            self.snapshots = None
+        else:
+            self.snapshots = [None] * state['emitted'] + state['snapshots']
+
+    def serialize(self):
+        self.set_defaults()
+        return """
+Snapshot {{
+    cycle_epochs: {0},
+    lr_max: {1}
+}}
+        """.format(self.cycle_epochs, self.lr_max)
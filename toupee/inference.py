@@ -0,0 +1,440 @@
+#!/usr/bin/python
+"""
+A NumPy forward pass for the Keras Sequential models toupee trains, to run
+saved members without Theano or Keras. export() turns a saved ensemble into
+a single-file bundle, which load_bundle() reads with NumPy alone, so that a
+predictor starts without importing or compiling anything else.
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import json
+import collections
+import numpy
+
+import archive
+import serving
+
+BUNDLE_VERSION = 1
+
+
+def softmax(x):
+    e = numpy.exp(x - x.max(axis = -1, keepdims = True))
+    return e / e.sum(axis = -1, keepdims = True)
+
+
+def sigmoid(x):
+    return 1. / (1. + numpy.exp(-x))
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: numpy.maximum(x, 0.),
+    'tanh': numpy.tanh,
+    'sigmoid': sigmoid,
+    'hard_sigmoid': lambda x: numpy.clip(0.2 * x + 0.5, 0., 1.),
+    'softplus': lambda x: numpy.logaddexp(0., x),
+    'softmax': softmax,
+}
+
+
+def activation(name):
+    if name not in ACTIVATIONS:
+        raise ValueError("unsupported activation {0}".format(name))
+    return ACTIVATIONS[name]
+
+
+def float_weights(w):
+    """
+    A weight array as float32, dequantizing it if needed
+    """
+    if hasattr(w, 'dequantize'):
+        return w.dequantize()
+    return numpy.asarray(w, dtype = 'float32')
+
+
+class Layer:
+    """
+    A layer with no weights that leaves its input alone
+    """
+
+    #the axis of the kernel (the first weight array) holding the output
+    #channels
+    channel_axis = None
+
+    def __init__(self, config):
+        self.config = config
+        self.weights = []
+
+    def set_weights(self, weights):
+        self.weights = list(weights)
+
+    def forward(self, x, weights):
+        return x
+
+
+class Dense(Layer):
+    channel_axis = 1
+
+    def __init__(self, config):
+        Layer.__init__(self, config)
+        self.activation = activation(config.get('activation', 'linear'))
+
+    def forward(self, x, weights):
+        x = numpy.dot(x, weights[0])
+        if len(weights) > 1:
+            x += weights[1]
+        return self.activation(x)
+
+
+class Convolution2D(Layer):
+    """
+    2D convolution over (samples, channels, rows, cols) inputs, flipping
+    the kernels as Theano does
+    """
+
+    channel_axis = 0
+
+    def __init__(self, config):
+        Layer.__init__(self, config)
+        if config.get('dim_ordering', 'th') != 'th':
+            raise ValueError("only dim_ordering th is supported")
+        self.border_mode = config.get('border_mode', 'valid')
+        if self.border_mode not in ('valid', 'same'):
+            raise ValueError("unsupported border_mode {0}".format(
+                self.border_mode))
+        self.subsample = tuple(config.get('subsample', (1, 1)))
+        self.activation = activation(config.get('activation', 'linear'))
+
+    def forward(self, x, weights):
+        W = weights[0][:, :, ::-1, ::-1]
+        n_filters, channels, rows, cols = W.shape
+        if self.border_mode == 'same':
+            x = numpy.pad(x, ((0, 0), (0, 0), (rows // 2, (rows - 1) // 2),
+                              (cols // 2, (cols - 1) // 2)), mode = 'constant')
+        #every (rows, cols) patch as a row of a matrix
+        n, c, h, w = x.shape
+        sr, sc = self.subsample
+        out_h = (h - rows) // sr + 1
+        out_w = (w - cols) // sc + 1
+        s = x.strides
+        patches = numpy.lib.stride_tricks.as_strided(x,
+                shape = (n, out_h, out_w, c, rows, cols),
+                strides = (s[0], s[2] * sr, s[3] * sc, s[1], s[2], s[3]))
+        patches = patches.reshape(n * out_h * out_w, c * rows * cols)
+        out = numpy.dot(patches, W.reshape(n_filters, -1).T)
+        if len(weights) > 1:
+            out += weights[1]
+        out = out.reshape(n, out_h, out_w, n_filters).transpose(0, 3, 1, 2)
+        return self.activation(numpy.ascontiguousarray(out))
+
+
+class MaxPooling2D(Layer):
+
+    def __init__(self, config):
+        Layer.__init__(self, config)
+        if config.get('border_mode', 'valid') != 'valid' or \
+                config.get('dim_ordering', 'th') != 'th':
+            raise ValueError("only valid, th max pooling is supported")
+        self.pool_size = tuple(config.get('pool_size', (2, 2)))
+        self.strides = tuple(config.get('strides') or self.pool_size)
+
+    def forward(self, x, weights):
+        n, c, h, w = x.shape
+        pr, pc = self.pool_size
+        sr, sc = self.strides
+        out_h = (h - pr) // sr + 1
+        out_w = (w - pc) // sc + 1
+        x = numpy.ascontiguousarray(x)
+        s = x.strides
+        windows = numpy.lib.stride_tricks.as_strided(x,
+                shape = (n, c, out_h, out_w, pr, pc),
+                strides = (s[0], s[1], s[2] * sr, s[3] * sc, s[2], s[3]))
+        return windows.max(axis = (4, 5))
+
+
+class Flatten(Layer):
+
+    def forward(self, x, weights):
+        return x.reshape((x.shape[0], -1))
+
+
+class Activation(Layer):
+
+    def __init__(self, config):
+        Layer.__init__(self, config)
+        self.activation = activation(config['activation'])
+
+    def forward(self, x, weights):
+        return self.activation(x)
+
+
+class Dropout(Layer):
+    """
+    Only scales at training time, so it is the identity here
+    """
+    pass
+
+
+LAYERS = { 'Dense': Dense,
+           'Convolution2D': Convolution2D,
+           'MaxPooling2D': MaxPooling2D,
+           'Flatten': Flatten,
+           'Activation': Activation,
+           'Dropout': Dropout }
+
+
+def weight_count(class_name, config):
+    """
+    How many weight arrays Keras keeps for a layer
+    """
+    if class_name in ('Dense', 'Convolution2D'):
+        return 2 if config.get('bias', True) else 1
+    return 0
+
+
+def parse_architecture(architecture):
+    """
+    The (class_name, config) pairs of the layers of a Keras Sequential model
+    serialised as YAML or JSON, and its input shape
+    """
+    import yaml
+    spec = yaml.load(architecture)
+    if spec['class_name'] != 'Sequential':
+        raise ValueError("only Sequential models are supported")
+    layers = [(l['class_name'], l['config']) for l in spec['config']]
+    input_shape = layers[0][1].get('batch_input_shape')
+    if input_shape is None:
+        input_shape = (None, layers[0][1]['input_dim'])
+    return layers, [int(d) for d in input_shape[1:]]
+
+
+class NumpyModel:
+    """
+    A Sequential model run with NumPy. The weights can be float32 arrays, or
+    any object with a `dequantize()` method returning one, such as the
+    quantized weights of quantization.py.
+    """
+
+    def __init__(self, layers, input_shape, weights):
+        self.layers = []
+        self.input_shape = list(input_shape)
+        weights = list(weights)
+        for class_name, config in layers:
+            if class_name not in LAYERS:
+                raise ValueError("unsupported layer {0}".format(class_name))
+            layer = LAYERS[class_name](config)
+            n = weight_count(class_name, config)
+            layer.set_weights(weights[:n])
+            weights = weights[n:]
+            self.layers.append(layer)
+        if len(weights) > 0:
+            raise ValueError("{0} weight arrays left over".format(len(weights)))
+
+    @classmethod
+    def from_architecture(cls, architecture, weights):
+        layers, input_shape = parse_architecture(architecture)
+        return cls(layers, input_shape, weights)
+
+    def get_weights(self):
+        return [w for l in self.layers for w in l.weights]
+
+    def float_weights(self):
+        """
+        The float32 weights of every layer, dequantized
+        """
+        return [[float_weights(w) for w in l.weights] for l in self.layers]
+
+    def predict(self, x, batch_size = 100, weights = None):
+        """
+        Run `x` through the model, with the float32 `weights` of
+        float_weights() if they have been kept, or dequantizing them for
+        this call only
+        """
+        x = numpy.asarray(x, dtype = 'float32')
+        x = x.reshape([x.shape[0]] + self.input_shape)
+        if weights is None:
+            weights = self.float_weights()
+        out = []
+        for start in xrange(0, x.shape[0], batch_size):
+            b = x[start:start + batch_size]
+            for layer, w in zip(self.layers, weights):
+                b = layer.forward(b, w)
+            out.append(b)
+        return numpy.concatenate(out)
+
+
+class NumpyEnsemblePredictor(serving.EnsemblePredictor):
+    """
+    An EnsemblePredictor whose members are NumpyModels. A quantized member
+    is dequantized when it is first used, and its float32 weights are kept
+    for the following requests, for at most `max_loaded` members at a time
+    (all of them by default), the least recently used being dropped first.
+    """
+
+    def __init__(self, members, weights = None, voting = False,
+            batch_size = 100, head = None, max_loaded = None):
+        if max_loaded is not None and max_loaded < 1:
+            raise ValueError("at least one member has to be kept loaded")
+        serving.EnsemblePredictor.__init__(self, members, weights = weights,
+                voting = voting, batch_size = batch_size, head = head)
+        self.max_loaded = max_loaded
+        self.loaded = collections.OrderedDict()
+
+    def member_weights(self, member):
+        key = id(member)
+        if key in self.loaded:
+            weights = self.loaded.pop(key)
+        else:
+            weights = member.float_weights()
+        self.loaded[key] = weights
+        if self.max_loaded is not None:
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last = False)
+        return weights
+
+    def member_output(self, member, x):
+        return member.predict(x, batch_size = self.batch_size,
+                weights = self.member_weights(member))
+
+    def input_shape(self):
+        return list(self.members[0].input_shape)
+
+    @classmethod
+    def from_archive(cls, archive, batch_size = 100):
+        head = archive.head()
+        serving.check_aggregation(archive.method, head)
+        members = [NumpyModel.from_architecture(archive.architecture,
+                                                archive.member_weights(i))
+                   for i in range(len(archive))]
+        weights = serving.aggregation_weights(archive.method, archive.alphas,
+                len(members))
+        return cls(members, weights = weights,
+                voting = archive.voting, batch_size = batch_size, head = head)
+
+    @classmethod
+    def from_members(cls, members, method, architecture = None,
+            batch_size = 100):
+        """
+        Convert Keras models, or lists of weights of the network serialised
+        in `architecture`, aggregated as `method` aggregates them
+        """
+        head = method.__dict__.get('stack_head')
+        serving.check_aggregation(archive.method_name(method), head)
+        converted = []
+        for m in members:
+            if isinstance(m, (list, tuple)):
+                if architecture is None:
+                    raise ValueError("an architecture is needed to convert "
+                            "members saved as weights")
+                converted.append(NumpyModel.from_architecture(architecture, m))
+            else:
+                converted.append(NumpyModel.from_architecture(m.to_yaml(),
+                                                              m.get_weights()))
+        weights = serving.aggregation_weights(method,
+                getattr(method, 'alphas', None), len(members))
+        voting = 'voting' in method.__dict__ and bool(method.voting)
+        return cls(converted, weights = weights, voting = voting,
+                batch_size = batch_size, head = head)
+
+
+def export(ensemble_file, filename, model_file = None, method = None):
+    """
+    Write an ensemble archive, or the members pickled by save_ensemble.py
+    (with the `model_file` and `method` they were trained with), as a bundle
+    """
+    if archive.is_archive(ensemble_file):
+        predictor = NumpyEnsemblePredictor.from_archive(
+                archive.EnsembleArchive(ensemble_file))
+    else:
+        import dill
+        with open(ensemble_file, 'rb') as f:
+            members = dill.load(f)
+        architecture = None
+        if model_file is not None:
+            with open(model_file) as f:
+                architecture = f.read()
+        predictor = NumpyEnsemblePredictor.from_members(members, method,
+                architecture)
+    save_bundle(filename, predictor)
+    return predictor
+
+
+def is_bundle(filename):
+    return filename.endswith('.npz') and os.path.isfile(filename)
+
+
+def save_bundle(filename, predictor):
+    """
+    Write a NumpyEnsemblePredictor to a single .npz file: a JSON manifest
+    with the layers and the aggregation, and the arrays of every member.
+    Quantized weights are kept as their values, scales and channel axis.
+    """
+    first = predictor.members[0]
+    manifest = { 'format_version': BUNDLE_VERSION,
+                 'layers': [[l.__class__.__name__, l.config]
+                            for l in first.layers],
+                 'input_shape': first.input_shape,
+                 'weights': None,
+                 'voting': predictor.voting,
+                 'members': [] }
+    if predictor.weights is not None:
+        manifest['weights'] = [float(w) for w in predictor.weights]
+    arrays = {}
+    if predictor.head is not None:
+        manifest['head'] = predictor.head.name
+        for k, v in predictor.head.get_state().items():
+            arrays['head_' + k] = v
+    for j, m in enumerate(predictor.members):
+        entries = []
+        for i, w in enumerate(m.get_weights()):
+            key = 'm{0}_w{1}'.format(j, i)
+            if hasattr(w, 'dequantize'):
+                arrays[key] = w.values
+                arrays['m{0}_s{1}'.format(j, i)] = w.scale
+                entries.append({ 'axis': w.axis })
+            else:
+                arrays[key] = numpy.asarray(w)
+                entries.append({})
+        manifest['members'].append(entries)
+    arrays['__manifest__'] = numpy.array(json.dumps(manifest))
+    with open(filename, 'wb') as f:
+        numpy.savez(f, **arrays)
+
+
+def load_bundle(filename, batch_size = 100, max_loaded = None):
+    """
+    Read a predictor written by save_bundle, which keeps the dequantized
+    weights of at most `max_loaded` members
+    """
+    import quantization
+    f = numpy.load(filename)
+    manifest = json.loads(str(f['__manifest__']))
+    if manifest['format_version'] > BUNDLE_VERSION:
+        raise ValueError("{0} was written by a newer toupee (format {1})"
+                .format(filename, manifest['format_version']))
+    members = []
+    for j, entries in enumerate(manifest['members']):
+        weights = []
+        for i, entry in enumerate(entries):
+            w = f['m{0}_w{1}'.format(j, i)]
+            if 'axis' in entry:
+                w = quantization.QuantizedArray(w,
+                        f['m{0}_s{1}'.format(j, i)], entry['axis'])
+            weights.append(w)
+        members.append(NumpyModel(manifest['layers'], manifest['input_shape'],
+                                  weights))
+    head = None
+    if manifest.get('head') is not None:
+        import stacking
+        head = stacking.load_head(manifest['head'], dict(
+            (k[len('head_'):], f[k]) for k in f.files if k.startswith('head_')))
+    return NumpyEnsemblePredictor(members, weights = manifest['weights'],
+            voting = manifest['voting'], batch_size = batch_size, head = head,
+            max_loaded = max_loaded)
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+"""
+Bounded-memory ensembles: every member is moved to an ensemble archive as
+soon as it is trained, and only rebuilt, a few at a time, when it is used
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import shutil
+import tempfile
+import collections
+import numpy
+import numpy.random
+
+from archive import EnsembleArchive
+
+OUTPUTS_DIR = 'outputs'
+
+
+class MemberStore:
+    """
+    The members of an ensemble, kept on disk in an EnsembleArchive instead
+    of as live models. Indexing or iterating rebuilds a member as a Keras
+    model, and at most `cache_size` of those are kept, the least recently
+    used being dropped first. The outputs of the members on named sets
+    (e.g. the validation set) can be stored alongside them, so that the
+    ensemble can be scored without rebuilding any member.
+    """
+
+    def __init__(self, archive, cache_size = 2, temporary = False):
+        if cache_size < 1:
+            raise ValueError("a member store has to keep at least one member "
+                    "loaded")
+        self.archive = archive
+        self.cache_size = cache_size
+        self.temporary = temporary
+        self.models = collections.OrderedDict()
+
+    @classmethod
+    def create(cls, model_yaml, method = None, params = None, cache_size = 2,
+            path = None):
+        """
+        A store in a new archive at `path`, or in a temporary directory that
+        is removed by close()
+        """
+        temporary = path is None
+        if temporary:
+            path = tempfile.mkdtemp(prefix = 'toupee-members-')
+        return cls(EnsembleArchive.create(path, model_yaml, method, params),
+                cache_size, temporary)
+
+    def close(self):
+        self.models.clear()
+        if self.temporary and os.path.isdir(self.archive.path):
+            shutil.rmtree(self.archive.path)
+
+    def __len__(self):
+        return len(self.archive)
+
+    def add(self, member, alpha = None):
+        """
+        Write the weights of a model (or a list of weight arrays) to the
+        archive, returning its index. The model itself is not kept.
+        """
+        if isinstance(member, (list, tuple)):
+            weights = member
+        else:
+            weights = member.get_weights()
+        return self.archive.add_member(weights, alpha)
+
+    def weights(self, index):
+        """
+        The weights of a member, memory mapped rather than read
+        """
+        return self.archive.member_weights(index)
+
+    def load(self, index):
+        model = self.models.pop(index, None)
+        if model is None:
+            #building a model draws initial weights from the global
+            #generator, which must not change the members trained after
+            state = numpy.random.get_state()
+            try:
+                model = self.archive.load_member(index)
+            finally:
+                numpy.random.set_state(state)
+            while len(self.models) >= self.cache_size:
+                self.models.popitem(last = False)
+        self.models[index] = model
+        return model
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.load(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("member {0} out of {1}".format(index, len(self)))
+        return self.load(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.load(i)
+
+    def outputs_file(self, name, index):
+        return os.path.join(self.archive.path, OUTPUTS_DIR,
+                '{0}_{1:04d}.npy'.format(name, index))
+
+    def has_outputs(self, name, index):
+        return os.path.isfile(self.outputs_file(name, index))
+
+    def save_outputs(self, name, index, p):
+        filename = self.outputs_file(name, index)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        tmp = filename + '.tmp.npy'
+        numpy.save(tmp, numpy.asarray(p))
+        os.rename(tmp, filename)
+
+    def outputs(self, name):
+        """
+        The stored outputs of every member on set `name`, memory mapped and
+        in member order, or None unless all of them are stored
+        """
+        if not all(self.has_outputs(name, i) for i in range(len(self))):
+            return None
+        return [numpy.load(self.outputs_file(name, i), mmap_mode = 'r')
+                for i in range(len(self))]
@@ -16,17 +16,22 @@ import os
 import sys
 import time
 import copy
+import inspect
 import numpy
-import scipy
 import math
-from pymongo import MongoClient
 import json
+import resource
 
 import data
-from data import Resampler, Transformer
+from data import Resampler, Transformer, CompactArray
 import config 
 import common
 import utils
+import sharded
+import profiling
+import parallel
+import autotune
+from profiling import timed
 
 import keras
 import keras.preprocessing.image
@@ -43,13 +48,13 @@ class DataHolder:
         self.orig_train_set_y = dataset[0][1]
         self.orig_valid_set_x = dataset[1][0]
         self.orig_valid_set_y = dataset[1][1]
-        self.orig_test_set_x = dataset[2][0]
-        self.orig_test_set_y = dataset[2][1]
         self.train_set_x = self.orig_train_set_x
         self.train_set_y = self.orig_train_set_y
         self.valid_set_x = self.orig_valid_set_x
         self.valid_set_y = self.orig_valid_set_y
         if len(dataset) > 2:
+            self.orig_test_set_x = dataset[2][0]
+            self.orig_test_set_y = dataset[2][1]
             self.test_set_x = self.orig_test_set_x
             self.test_set_y = self.orig_test_set_y
         else:
@@ -58,6 +63,17 @@ class DataHolder:
     def has_test(self):
         return self.test_set_x is not None
 
+    def is_sharded(self):
+        return isinstance(self.train_set_x, sharded.ShardedArray)
+
+    def is_batched(self):
+        """
+        Whether the inputs have to be read a minibatch at a time, from
+        shards or from a compact storage dtype
+        """
+        return isinstance(self.train_set_x,
+                (sharded.ShardedArray, CompactArray))
+
     def reshape_inputs(self,shape):
         self.train_set_x = self.orig_train_set_x.reshape([self.train_set_x.shape[0]] + shape)
         self.valid_set_x = self.orig_valid_set_x.reshape([self.valid_set_x.shape[0]] + shape)
@@ -93,19 +109,67 @@ class TrainingState:
         self.epoch = 0
 
 
-def sequential_model(dataset, params, pretraining_set = None, model_weights = None,
-        return_results = False):
+@timed('evaluate')
+def evaluate(model, set_x, set_y, batch_size):
     """
-    Initialize the parameters and create the network.
+    Evaluate a model on an in-memory, a compact or a sharded set
     """
+    if isinstance(set_x, (sharded.ShardedArray, CompactArray)):
+        return model.evaluate_generator(
+                sharded.iterate_minibatches(set_x, set_y, batch_size,
+                    forever = True),
+                len(set_x))
+    return model.evaluate(set_x, set_y, batch_size = batch_size)
 
-    print "loading model..."
-    with open(params.model_file, 'r') as model_file:
-        model_yaml = model_file.read()
+
+def build_model(model_file, model_weights = None):
+    """
+    Create the network described by a serialised Keras model file, optionally
+    setting its weights.
+    """
+    with open(model_file, 'r') as f:
+        model_yaml = f.read()
     model = keras.models.model_from_yaml(model_yaml)
-    total_weights = 0
     if model_weights is not None:
         model.set_weights(model_weights)
+    return model
+
+
+def best_weights_checkpointer():
+    """
+    A callback that keeps the weights with the lowest val_loss, in memory
+    """
+    if hasattr(keras.callbacks, 'ModelCheckpointInMemory'):
+        return keras.callbacks.ModelCheckpointInMemory(verbose=1,
+                monitor = 'val_loss',
+                mode = 'min')
+    return BestWeights('val_loss')
+
+
+def test_data_argument(fit, data_holder):
+    """
+    The test set for a fit method that also evaluates it after every epoch,
+    if this version of Keras has one and there is a test set
+    """
+    if not data_holder.has_test() or \
+            'test_data' not in inspect.getargspec(fit).args:
+        return {}
+    return { 'test_data': (data_holder.test_set_x, data_holder.test_set_y) }
+
+
+@timed('sequential_model')
+def sequential_model(dataset, params, pretraining_set = None, model_weights = None,
+        return_results = False, callbacks = None, sample_weight = None):
+    """
+    Initialize the parameters and create the network. `callbacks` are
+    additional Keras callbacks to train with, and `sample_weight` weighs
+    the loss of every training instance.
+    """
+
+    print "loading model..."
+    with profiling.phase('build_model'):
+        model = build_model(params.model_file, model_weights)
+    total_weights = 0
 
     #TODO: weight count
     print "total weight count: {0}".format(total_weights)
@@ -135,66 +199,123 @@ def sequential_model(dataset, params, pretraining_set = None, model_weights = No
     if 'additional_metrics' in params.__dict__:
         metrics = metrics + additional_metrics
 
-    model.compile(optimizer = params.update_rule,
-                  loss = params.cost_function,
-                  metrics = metrics
-    )
+    with profiling.phase('compile'):
+        model.compile(optimizer = params.update_rule,
+                      loss = params.cost_function,
+                      metrics = metrics
+        )
 
-    checkpointer = keras.callbacks.ModelCheckpointInMemory(verbose=1,
-            monitor = 'val_loss',
-            mode = 'min')
-    callbacks = [checkpointer]
+    checkpointer = best_weights_checkpointer()
+    if callbacks is None:
+        callbacks = []
+    callbacks = [checkpointer, EpochHooks(common.training_hooks(params))] + \
+            callbacks
     if params.early_stopping is not None:
         earlyStopping=keras.callbacks.EarlyStopping(monitor='val_loss',
             patience=params.early_stopping['patience'], verbose=0, mode='auto')
         callbacks.append(earlyStopping)
 
-    if params.online_transform is not None:
-        datagen = keras.preprocessing.image.ImageDataGenerator(
-            featurewise_center=False,
-            samplewise_center=False,
-            featurewise_std_normalization=False,
-            samplewise_std_normalization=False,
-            zca_whitening=False,
-            rotation_range=0,
-            width_shift_range=0.1,
-            height_shift_range=0.1,
-            horizontal_flip=True,
-            vertical_flip=False)
-        datagen.fit(data_holder.train_set_x)
-        hist = model.fit_generator(
-                            datagen.flow(
-                                data_holder.train_set_x,
+    if sample_weight is not None and params.online_transform is not None:
+        raise ValueError("sample weights are not supported with "
+                "online_transform")
+    if data_holder.is_batched() and params.online_transform is not None:
+        raise ValueError("online_transform is not supported for sharded "
+                "or compact datasets")
+    if params.training_method in parallel.METHODS and \
+            params.online_transform is not None:
+        raise ValueError("online_transform is not supported with {0} "
+                "training".format(params.training_method))
+
+    predict_batch_size = autotune.inference_batch_size(params)
+    with profiling.phase('fit'), \
+            autotune.blas_threads(params.__dict__.get('blas_threads')):
+        if params.training_method in parallel.METHODS:
+            hist = parallel.fit(model, data_holder.train_set_x,
                                 data_holder.train_set_y,
+                                params.batch_size, params.n_epochs,
+                                method = params.training_method,
+                                processes = params.training_processes,
+                                callbacks = callbacks,
+                                validate = lambda: evaluate(model,
+                                    data_holder.valid_set_x,
+                                    data_holder.valid_set_y,
+                                    predict_batch_size),
                                 shuffle = params.shuffle_dataset,
-                                batch_size = params.batch_size
-                            ),
-                            samples_per_epoch = data_holder.train_set_x.shape[0],
-                            nb_epoch = params.n_epochs,
-                            callbacks = callbacks,
-                            validation_data = (data_holder.valid_set_x,
-                                data_holder.valid_set_y),
-                            test_data = (data_holder.test_set_x,
-                                data_holder.test_set_y),
-                           )
-    else:
-        hist = model.fit(data_holder.train_set_x, data_holder.train_set_y,
-                  batch_size = params.batch_size,
-                  nb_epoch = params.n_epochs,
-                  validation_data = (data_holder.valid_set_x, data_holder.valid_set_y),
-                  test_data = (data_holder.test_set_x, data_holder.test_set_y),
-                  callbacks = callbacks,
-                  shuffle = params.shuffle_dataset)
+                                rng = rng,
+                                sample_weight = sample_weight
+                               )
+        elif params.online_transform is not None:
+            datagen = keras.preprocessing.image.ImageDataGenerator(
+                featurewise_center=False,
+                samplewise_center=False,
+                featurewise_std_normalization=False,
+                samplewise_std_normalization=False,
+                zca_whitening=False,
+                rotation_range=0,
+                width_shift_range=0.1,
+                height_shift_range=0.1,
+                horizontal_flip=True,
+                vertical_flip=False)
+            datagen.fit(data_holder.train_set_x)
+            hist = model.fit_generator(
+                                datagen.flow(
+                                    data_holder.train_set_x,
+                                    data_holder.train_set_y,
+                                    shuffle = params.shuffle_dataset,
+                                    batch_size = params.batch_size
+                                ),
+                                samples_per_epoch = data_holder.train_set_x.shape[0],
+                                nb_epoch = params.n_epochs,
+                                callbacks = callbacks,
+                                validation_data = (data_holder.valid_set_x,
+                                    data_holder.valid_set_y),
+                                **test_data_argument(model.fit_generator,
+                                    data_holder)
+                               )
+        elif data_holder.is_batched():
+            hist = model.fit_generator(
+                                sharded.iterate_minibatches(
+                                    data_holder.train_set_x,
+                                    data_holder.train_set_y,
+                                    params.batch_size,
+                                    shuffle = params.shuffle_dataset,
+                                    rng = rng,
+                                    forever = True,
+                                    weights = sample_weight
+                                ),
+                                samples_per_epoch = state.train_examples,
+                                nb_epoch = params.n_epochs,
+                                callbacks = callbacks,
+                                validation_data = sharded.iterate_minibatches(
+                                    data_holder.valid_set_x,
+                                    data_holder.valid_set_y,
+                                    params.batch_size,
+                                    forever = True
+                                ),
+                                nb_val_samples = state.valid_examples,
+                               )
+        else:
+            hist = model.fit(data_holder.train_set_x, data_holder.train_set_y,
+                      batch_size = params.batch_size,
+                      nb_epoch = params.n_epochs,
+                      validation_data = (data_holder.valid_set_x, data_holder.valid_set_y),
+                      callbacks = callbacks,
+                      shuffle = params.shuffle_dataset,
+                      sample_weight = sample_weight,
+                      **test_data_argument(model.fit, data_holder))
     model.set_weights(checkpointer.best_model)
-    train_metrics = model.evaluate(data_holder.train_set_x,data_holder.train_set_y)
-    valid_metrics = model.evaluate(data_holder.valid_set_x,data_holder.valid_set_y)
+    with autotune.blas_threads(params.__dict__.get('inference_blas_threads')):
+        train_metrics = evaluate(model, data_holder.train_set_x,
+                data_holder.train_set_y, predict_batch_size)
+        valid_metrics = evaluate(model, data_holder.valid_set_x,
+                data_holder.valid_set_y, predict_batch_size)
+        if data_holder.has_test():
+            test_metrics = evaluate(model, data_holder.test_set_x,
+                    data_holder.test_set_y, predict_batch_size)
+    all_metrics = [('train', train_metrics), ('valid', valid_metrics)]
     if data_holder.has_test():
-        test_metrics = model.evaluate(data_holder.test_set_x,data_holder.test_set_y)
-    for metrics_name,metrics in (
-            ('train', train_metrics),
-            ('valid', valid_metrics),
-            ('test', test_metrics)
-        ):
+        all_metrics.append(('test', test_metrics))
+    for metrics_name,metrics in all_metrics:
         print "{0}:".format(metrics_name)
         for i in range(len(metrics)):
             print "  {0} = {1}".format(model.metrics_names[i], metrics[i])
@@ -218,21 +339,138 @@ def sequential_model(dataset, params, pretraining_set = None, model_weights = No
         print('Selection : Best valid score of {0} %'.format(
               valid_metrics[1] * 100.))
 
-    if 'results_db' in params.__dict__ :
-        if 'results_host' in params.__dict__:
-            host = params.results_host
-        else:
-            host = None
-        conn = MongoClient(host=host)
-        db = conn[params.results_db]
-        if 'results_table' in params.__dict__: 
-            table_name = params.results_table
-        else:
-            table_name = 'results'
-        table = db[table_name]
-        print "saving results to {0}@{1}:{2}".format(params.results_db,host,table)
-        table.insert(json.loads(json.dumps(results.__dict__,default=common.serialize)))
+    with profiling.phase('save_results'):
+        common.save_results(results.__dict__, params)
     if return_results:
         return model, results
     else:
         return model
+
+
+class BestWeights(keras.callbacks.Callback):
+    """
+    Keep the weights of the epoch with the lowest `monitor`, like
+    ModelCheckpointInMemory does in the Keras versions that have it
+    """
+
+    def __init__(self, monitor = 'val_loss'):
+        keras.callbacks.Callback.__init__(self)
+        self.monitor = monitor
+        self.best = numpy.inf
+        self.best_model = None
+        self.best_epoch = 0
+
+    def on_train_begin(self, logs = {}):
+        self.best = numpy.inf
+        self.best_model = self.model.get_weights()
+        self.best_epoch = 0
+
+    def on_epoch_end(self, epoch, logs = {}):
+        value = logs.get(self.monitor)
+        if value is not None and value < self.best:
+            self.best = value
+            self.best_model = self.model.get_weights()
+            self.best_epoch = epoch
+
+
+class CosineAnnealingSnapshots(keras.callbacks.Callback):
+    """
+    Anneal the learning rate from lr_max to zero along a cosine during each
+    cycle, restarting at lr_max at the start of the next one, and keep the
+    weights reached at the end of every cycle
+    """
+
+    def __init__(self, cycle_epochs, batches_per_epoch, lr_max = None):
+        keras.callbacks.Callback.__init__(self)
+        self.cycle_epochs = cycle_epochs
+        self.cycle_length = cycle_epochs * batches_per_epoch
+        self.lr_max = lr_max
+        self.iteration = 0
+        self.snapshots = []
+
+    def on_train_begin(self, logs = {}):
+        if self.lr_max is None:
+            self.lr_max = float(keras.backend.get_value(self.model.optimizer.lr))
+
+    def on_batch_begin(self, batch, logs = {}):
+        t = float(self.iteration % self.cycle_length) / self.cycle_length
+        lr = self.lr_max / 2. * (math.cos(math.pi * t) + 1.)
+        keras.backend.set_value(self.model.optimizer.lr, lr)
+        self.iteration += 1
+
+    def on_epoch_end(self, epoch, logs = {}):
+        if (epoch + 1) % self.cycle_epochs == 0:
+            self.snapshots.append(self.model.get_weights())
+
+
+class SuccessiveHalvingStopping(keras.callbacks.Callback):
+    """
+    Report the monitored metric of run `run` to a scheduling.SuccessiveHalving
+    scheduler at the end of every epoch, and stop training when it says the
+    run is doing worse than the others
+    """
+
+    def __init__(self, scheduler, run):
+        keras.callbacks.Callback.__init__(self)
+        self.scheduler = scheduler
+        self.run = run
+        self.stopped_at = None
+
+    def on_epoch_end(self, epoch, logs = {}):
+        if self.scheduler.metric not in logs:
+            return
+        value = float(logs[self.scheduler.metric])
+        if not self.scheduler.report(self.run, epoch + 1, value):
+            print "successive halving: stopping {0} after {1} epochs".format(
+                    self.run, epoch + 1)
+            self.stopped_at = epoch + 1
+            self.model.stop_training = True
+
+
+class EpochHooks(keras.callbacks.Callback):
+    """
+    Fire the epoch hooks of a common.Toupee at the end of every epoch, with
+    the epoch's wall time, training throughput, time spent waiting for
+    batches, time spent on validation and the process's memory high-water
+    mark in KB, along with Keras' logs. The reset hooks fire when training
+    starts.
+    """
+
+    def __init__(self, toupee):
+        keras.callbacks.Callback.__init__(self)
+        self.toupee = toupee
+
+    def on_train_begin(self, logs = {}):
+        self.toupee.training_reset()
+
+    def on_epoch_begin(self, epoch, logs = {}):
+        self.epoch_start = time.time()
+        self.last_batch_end = self.epoch_start
+        self.data_wait = 0.
+        self.train_time = 0.
+        self.samples = 0
+
+    def on_batch_begin(self, batch, logs = {}):
+        self.batch_start = time.time()
+        self.data_wait += self.batch_start - self.last_batch_end
+
+    def on_batch_end(self, batch, logs = {}):
+        self.last_batch_end = time.time()
+        self.train_time += self.last_batch_end - self.batch_start
+        self.samples += int(logs.get('size', 0))
+
+    def on_epoch_end(self, epoch, logs = {}):
+        now = time.time()
+        stats = dict((k, float(v)) for k, v in logs.items())
+        stats.update({
+            'epoch': epoch + 1,
+            'wall_time': now - self.epoch_start,
+            'train_time': self.train_time,
+            'samples': self.samples,
+            'samples_per_sec': self.samples / max(
+                self.last_batch_end - self.epoch_start, 1e-9),
+            'data_wait': self.data_wait,
+            'validation_time': now - self.last_batch_end,
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+        self.toupee.epoch_done(stats)
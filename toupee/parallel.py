@@ -0,0 +1,344 @@
+#!/usr/bin/python
+"""
+Data-parallel training of a single network on several CPU processes, either
+synchronously, by summing the gradients of every process in shared memory,
+or asynchronously and without locks (Hogwild)
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import multiprocessing
+import numpy
+
+import keras.backend as K
+import keras.models
+import keras.callbacks
+import keras.optimizers
+
+#the values of training_method that are run here
+METHODS = ['allreduce', 'hogwild']
+
+
+class Barrier:
+    """
+    A reusable barrier for `n` processes, which raises instead of waiting
+    forever once `alive()` is false, i.e. another process has died
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.count = multiprocessing.RawValue('i', 0)
+        self.generation = multiprocessing.RawValue('i', 0)
+        self.condition = multiprocessing.Condition()
+
+    def wait(self, alive = None):
+        with self.condition:
+            generation = self.generation.value
+            self.count.value += 1
+            if self.count.value == self.n:
+                self.count.value = 0
+                self.generation.value += 1
+                self.condition.notify_all()
+                return
+            while generation == self.generation.value:
+                self.condition.wait(1.)
+                if alive is not None and not alive():
+                    raise RuntimeError("a training process has died")
+
+
+def shared_floats(shape):
+    raw = multiprocessing.RawArray('f', int(numpy.prod(shape)))
+    return numpy.frombuffer(raw, dtype = 'float32').reshape(shape)
+
+
+class FlatWeights:
+    """
+    Copies between the trainable weights of a model, or gradients of the
+    same shapes, and a single flat float32 vector
+    """
+
+    def __init__(self, model):
+        self.variables = model.trainable_weights
+        self.shapes = [K.get_variable_shape(v) for v in self.variables]
+        self.sizes = [int(numpy.prod(s)) for s in self.shapes]
+        self.size = sum(self.sizes)
+
+    def flatten(self, arrays, out = None, scale = 1.):
+        if out is None:
+            out = numpy.empty(self.size, dtype = 'float32')
+        start = 0
+        for a, size in zip(arrays, self.sizes):
+            numpy.multiply(numpy.ravel(a), scale, out = out[start:start + size])
+            start += size
+        return out
+
+    def unflatten(self, flat):
+        arrays = []
+        start = 0
+        for shape, size in zip(self.shapes, self.sizes):
+            arrays.append(flat[start:start + size].reshape(shape))
+            start += size
+        return arrays
+
+    def get(self, out = None):
+        return self.flatten(K.batch_get_value(self.variables), out)
+
+    def set(self, flat):
+        K.batch_set_value(zip(self.variables,
+            [a.astype(K.floatx()) for a in self.unflatten(flat)]))
+
+
+def compiled_model(model):
+    """
+    The model that holds the losses and training functions, which for a
+    Sequential model is the one it wraps
+    """
+    if isinstance(model, keras.models.Sequential):
+        return model.model
+    return model
+
+
+def gradient_function(model):
+    """
+    The loss, the metrics and the gradients of the trainable weights of a
+    compiled model on a batch
+    """
+    model = compiled_model(model)
+    inputs = model.inputs + model.targets + model.sample_weights
+    if model.uses_learning_phase and type(K.learning_phase()) is not int:
+        inputs.append(K.learning_phase())
+    grads = K.gradients(model.total_loss, model.trainable_weights)
+    return K.function(inputs, [model.total_loss] + model.metrics_tensors +
+            grads, updates = model.updates)
+
+
+def clip_gradients(optimizer, grads):
+    if getattr(optimizer, 'clipnorm', 0) > 0:
+        norm = K.sqrt(sum([K.sum(K.square(g)) for g in grads]))
+        grads = [keras.optimizers.clip_norm(g, optimizer.clipnorm, norm)
+                 for g in grads]
+    if getattr(optimizer, 'clipvalue', 0) > 0:
+        grads = [K.clip(g, -optimizer.clipvalue, optimizer.clipvalue)
+                 for g in grads]
+    return grads
+
+
+def apply_function(model):
+    """
+    A function that applies the model's optimizer to given gradients
+    """
+    model = compiled_model(model)
+    optimizer = model.optimizer
+    grads = [K.placeholder(shape = K.get_variable_shape(w))
+             for w in model.trainable_weights]
+    #the optimizer asks for the gradients of the loss, which are the inputs
+    optimizer.get_gradients = lambda loss, params: clip_gradients(optimizer,
+            grads)
+    try:
+        updates = optimizer.get_updates(model.trainable_weights,
+                model.constraints, model.total_loss)
+    finally:
+        del optimizer.get_gradients
+    return K.function(grads, [], updates = updates)
+
+
+def batch_inputs(model, x, y, sample_weight, rows):
+    model = compiled_model(model)
+    w = None
+    if sample_weight is not None:
+        w = numpy.asarray(sample_weight)[rows]
+    x, y, w = model._standardize_user_data(x[rows], y[rows],
+            sample_weight = w, check_batch_dim = True)
+    ins = x + y + w
+    if model.uses_learning_phase and type(K.learning_phase()) is not int:
+        ins.append(1.)
+    return ins
+
+
+class Trainer:
+    """
+    The state shared by the training processes, which are forked from the
+    one calling fit() and numbered from 1; the calling process is number 0,
+    the only one to run the callbacks and the validation
+    """
+
+    def __init__(self, model, method, processes):
+        if method not in METHODS:
+            raise ValueError("unknown training method {0}, use one of {1}"
+                    .format(method, ', '.join(METHODS)))
+        self.model = model
+        self.method = method
+        self.processes = processes
+        self.weights = FlatWeights(model)
+        self.barrier = Barrier(processes)
+        self.shared_weights = shared_floats(self.weights.size)
+        self.weights.get(self.shared_weights)
+        self.stop = multiprocessing.RawValue('i', 0)
+        if method == 'allreduce':
+            self.gradients = shared_floats(self.weights.size)
+            self.stats = shared_floats((processes, len(model.metrics_names)))
+            self.chunks = numpy.array_split(numpy.arange(self.weights.size),
+                    processes)
+            self.chunks = [slice(c[0], c[-1] + 1) if len(c) else slice(0, 0)
+                           for c in self.chunks]
+            self.locks = [multiprocessing.Lock() for c in self.chunks]
+            self.grad_f = gradient_function(model)
+            self.apply_f = apply_function(model)
+        else:
+            compiled_model(model)._make_train_function()
+        self.workers = []
+        self.parent = os.getpid()
+
+    def alive(self):
+        if os.getpid() == self.parent:
+            return all(p.is_alive() or p.exitcode == 0 for p in self.workers)
+        return os.getppid() == self.parent
+
+    def wait(self):
+        self.barrier.wait(self.alive)
+
+    def accumulate(self, rank, gradients):
+        """
+        Add a process's gradients to the shared sum, a chunk at a time and
+        starting from a different chunk in every process, so that the
+        processes rarely wait for each other's locks
+        """
+        for k in range(self.processes):
+            i = (rank + k) % self.processes
+            with self.locks[i]:
+                self.gradients[self.chunks[i]] += gradients[self.chunks[i]]
+
+    def allreduce_step(self, rank, x, y, sample_weight, rows):
+        mine = rows[rank::self.processes]
+        if rank > 0:
+            self.weights.set(self.shared_weights)
+        if len(mine) > 0:
+            outs = self.grad_f(batch_inputs(self.model, x, y, sample_weight,
+                mine))
+            n_stats = len(self.model.metrics_names)
+            scale = len(mine) / float(len(rows))
+            self.stats[rank] = numpy.asarray(outs[:n_stats]) * scale
+            self.accumulate(rank, self.weights.flatten(outs[n_stats:],
+                scale = scale))
+        else:
+            self.stats[rank] = 0.
+        self.wait()
+        stats = None
+        if rank == 0:
+            stats = self.stats.sum(axis = 0)
+            self.apply_f(self.weights.unflatten(self.gradients))
+            self.gradients[:] = 0.
+            self.weights.get(self.shared_weights)
+        self.wait()
+        return stats
+
+    def hogwild_step(self, rank, x, y, sample_weight, rows):
+        start = numpy.array(self.shared_weights)
+        self.weights.set(start)
+        train = compiled_model(self.model).train_function
+        outs = train(batch_inputs(self.model, x, y, sample_weight, rows))
+        #racing with the other processes, by design
+        self.shared_weights += self.weights.get() - start
+        return outs
+
+    def run(self, rank, x, y, batch_size, nb_epoch, shuffle, rng,
+            sample_weight, callbacks = None, validate = None):
+        n = len(x)
+        starts = range(0, n, batch_size)
+        for epoch in range(nb_epoch):
+            if rank == 0:
+                callbacks.on_epoch_begin(epoch)
+            if shuffle:
+                order = rng.permutation(n)
+            else:
+                order = numpy.arange(n)
+            if self.method == 'hogwild':
+                batches = range(rank, len(starts), self.processes)
+            else:
+                batches = range(len(starts))
+            for batch in batches:
+                rows = order[starts[batch]:starts[batch] + batch_size]
+                logs = { 'batch': batch, 'size': len(rows) }
+                if rank == 0:
+                    callbacks.on_batch_begin(batch, logs)
+                if self.method == 'hogwild':
+                    stats = self.hogwild_step(rank, x, y, sample_weight, rows)
+                else:
+                    stats = self.allreduce_step(rank, x, y, sample_weight,
+                            rows)
+                if rank == 0:
+                    logs.update(zip(self.model.metrics_names, stats))
+                    callbacks.on_batch_end(batch, logs)
+            self.wait()
+            if rank == 0:
+                if self.method == 'hogwild':
+                    self.weights.set(self.shared_weights)
+                logs = {}
+                if validate is not None:
+                    logs = dict(('val_' + name, value) for name, value in
+                            zip(self.model.metrics_names, validate()))
+                callbacks.on_epoch_end(epoch, logs)
+                self.stop.value = int(bool(self.model.stop_training))
+            self.wait()
+            if self.stop.value:
+                break
+
+
+def fit(model, x, y, batch_size, nb_epoch, method = 'allreduce',
+        processes = None, callbacks = None, validate = None, shuffle = True,
+        rng = None, sample_weight = None):
+    """
+    Train a compiled model on `processes` processes (one per CPU by default)
+    and return its History, like model.fit. `method` is either:
+    - allreduce: every minibatch is split between the processes, whose
+      gradients are summed in shared memory and applied once by the
+      optimizer, so training follows the same path as on a single process
+    - hogwild: every process trains on its own minibatches, and adds its
+      updates to the shared weights without any locking
+    The callbacks see the batches of the calling process only, and
+    `validate()`, which gives the validation metrics, is run at the end of
+    every epoch.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if rng is None:
+        rng = numpy.random.RandomState()
+    history = keras.callbacks.History()
+    metrics = model.metrics_names
+    if validate is not None:
+        metrics = metrics + ['val_' + m for m in metrics]
+    callbacks = keras.callbacks.CallbackList([keras.callbacks.BaseLogger()] +
+            (callbacks or []) + [history])
+    callbacks._set_model(model)
+    callbacks._set_params({ 'batch_size': batch_size, 'nb_epoch': nb_epoch,
+                            'nb_sample': len(x), 'verbose': 0,
+                            'do_validation': validate is not None,
+                            'metrics': metrics })
+    trainer = Trainer(model, method, processes)
+    def work(rank):
+        trainer.run(rank, x, y, batch_size, nb_epoch, shuffle, rng,
+                sample_weight)
+    #forked, so every process starts with the same model and generator
+    trainer.workers = [multiprocessing.Process(target = work, args = (rank,))
+                       for rank in range(1, processes)]
+    model.stop_training = False
+    callbacks.on_train_begin()
+    for p in trainer.workers:
+        p.start()
+    try:
+        trainer.run(0, x, y, batch_size, nb_epoch, shuffle, rng,
+                sample_weight, callbacks, validate)
+    except:
+        for p in trainer.workers:
+            p.terminate()
+        raise
+    for p in trainer.workers:
+        p.join()
+    callbacks.on_train_end()
+    return history
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+"""
+Opt-in timing of the phases of a run, reported per ensemble member and
+in aggregate
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import sys
+import json
+import time
+import atexit
+import functools
+import contextlib
+import collections
+
+
+class Profiler:
+    """
+    Records how long each named phase takes. Phases nest, and are reported
+    by their path (e.g. create_member/sequential_model/fit). Phases entered
+    while a member is being created are also attributed to that member.
+    Does nothing until enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = None
+        self.output = None
+        self.reset()
+
+    def reset(self):
+        self.records = []
+        self.stack = []
+        self.member = None
+        self.n_members = 0
+        self.start_time = time.time()
+
+    def enable(self, cprofile = False, output = None, report_at_exit = True):
+        """
+        Start recording. With `cprofile` the whole run is also sampled by
+        cProfile, and with `output` the records (and cProfile stats, in
+        output + '.prof') are written there when reporting
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        self.output = output
+        self.reset()
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        if report_at_exit:
+            atexit.register(self.finish)
+
+    @contextlib.contextmanager
+    def phase(self, name, member = False):
+        """
+        Time the enclosed block as phase `name`; with `member` it starts the
+        next ensemble member
+        """
+        if not self.enabled:
+            yield
+            return
+        outer_member = self.member
+        if member and self.member is None:
+            self.member = self.n_members
+            self.n_members += 1
+        self.stack.append(name)
+        path = '/'.join(self.stack)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.records.append((self.member, path, time.time() - start))
+            self.stack.pop()
+            self.member = outer_member
+
+    def summary(self):
+        """
+        {'total': seconds since enabled, 'phases': {path: [calls, seconds]},
+         'members': [{path: [calls, seconds]}, ...]}
+        """
+        phases = collections.OrderedDict()
+        members = [collections.OrderedDict() for i in range(self.n_members)]
+        for member, path, seconds in self.records:
+            targets = [phases]
+            if member is not None:
+                targets.append(members[member])
+            for t in targets:
+                calls, total = t.get(path, (0, 0.))
+                t[path] = [calls + 1, total + seconds]
+        return { 'total': time.time() - self.start_time,
+                 'phases': phases,
+                 'members': members }
+
+    def report(self, out = sys.stdout):
+        summary = self.summary()
+        total = summary['total']
+
+        def table(phases):
+            for path in sorted(phases):
+                calls, seconds = phases[path]
+                print >> out, "  {0:<50} {1:>6} {2:>10.3f}s {3:>10.3f}s {4:>6.1f}%".format(
+                        path, calls, seconds, seconds / calls,
+                        100. * seconds / max(total, 1e-9))
+
+        print >> out, "profile ({0:.3f}s in total):".format(total)
+        print >> out, "  {0:<50} {1:>6} {2:>11} {3:>11} {4:>7}".format(
+                'phase', 'calls', 'total', 'mean', 'share')
+        table(summary['phases'])
+        for i, phases in enumerate(summary['members']):
+            print >> out, "member {0}:".format(i)
+            table(phases)
+        return summary
+
+    def finish(self):
+        """
+        Print the report, and write it to the output file if there is one
+        """
+        if not self.enabled:
+            return
+        summary = self.report()
+        if self.cprofile is not None:
+            import pstats
+            self.cprofile.disable()
+            stats = pstats.Stats(self.cprofile)
+            stats.sort_stats('cumulative').print_stats(25)
+            if self.output is not None:
+                stats.dump_stats(self.output + '.prof')
+        if self.output is not None:
+            with open(self.output, 'w') as f:
+                json.dump(summary, f, indent = 2)
+        self.enabled = False
+
+
+profiler = Profiler()
+
+
+def phase(name, member = False):
+    return profiler.phase(name, member)
+
+
+def timed(name, member = False):
+    """
+    Decorator timing every call of a function as phase `name`
+    """
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with profiler.phase(name, member):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def configure(config):
+    """
+    Enable the profiler from the experiment's `profile` setting: true, or
+    a dict with cprofile and output
+    """
+    if not config:
+        return
+    if not isinstance(config, dict):
+        config = {}
+    profiler.enable(cprofile = config.get('cprofile', False),
+                    output = config.get('output'))
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+"""
+Post-training quantization of saved ensembles to int8 or float16 weights,
+run with the NumPy forward pass of inference.py
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import time
+import numpy
+
+from inference import NumpyModel, NumpyEnsemblePredictor, float_weights
+
+#the fractions of each channel's largest weight tried as the int8 range
+CLIP_RATIOS = [1., 0.999, 0.995, 0.99, 0.98, 0.95, 0.9]
+
+
+class QuantizedArray:
+    """
+    Symmetric int8 values with a float32 scale per output channel along
+    `axis`, dequantized to float32 when used
+    """
+
+    def __init__(self, values, scale, axis):
+        self.values = values
+        self.scale = scale
+        self.axis = axis
+
+    @classmethod
+    def quantize(cls, w, axis, clip = 1.):
+        """
+        Quantize `w`, saturating each channel at `clip` times its largest
+        absolute value
+        """
+        w = numpy.asarray(w, dtype = 'float32')
+        others = tuple(a for a in range(w.ndim) if a != axis)
+        peak = numpy.abs(w).max(axis = others, keepdims = True) * clip
+        scale = numpy.where(peak > 0., peak / 127., 1.).astype('float32')
+        values = numpy.clip(numpy.round(w / scale), -127, 127).astype('int8')
+        return cls(values, scale, axis)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.scale.nbytes
+
+    def dequantize(self):
+        return self.values.astype('float32') * self.scale
+
+
+def quantize_layer(layer, weights, mode, x = None, clip_ratios = CLIP_RATIOS):
+    """
+    The quantized weights of one layer. In int8, the kernel's clipping
+    ratio is the one that best reproduces the layer's output on the
+    calibration inputs `x`; biases are kept in float32.
+    """
+    if layer.channel_axis is None or len(weights) == 0:
+        return weights
+    if mode == 'float16':
+        return [weights[0].astype('float16')] + weights[1:]
+    if mode != 'int8':
+        raise ValueError("unknown quantization mode {0}".format(mode))
+    if x is None:
+        return [QuantizedArray.quantize(weights[0], layer.channel_axis)] + \
+                weights[1:]
+    best, best_error = None, numpy.inf
+    target = layer.forward(x, weights)
+    for clip in clip_ratios:
+        candidate = [QuantizedArray.quantize(weights[0], layer.channel_axis,
+                                             clip)] + weights[1:]
+        out = layer.forward(x, [float_weights(w) for w in candidate])
+        error = numpy.mean((out - target) ** 2)
+        if error < best_error:
+            best, best_error = candidate, error
+    return best
+
+
+def quantize_model(model, mode = 'int8', calibration_x = None):
+    """
+    A quantized copy of a float NumpyModel, calibrated layer by layer on
+    `calibration_x`, the inputs of which follow the float model
+    """
+    x = None
+    if calibration_x is not None:
+        x = numpy.asarray(calibration_x, dtype = 'float32')
+        x = x.reshape([x.shape[0]] + model.input_shape)
+    weights = []
+    for layer in model.layers:
+        float_w = [float_weights(w) for w in layer.weights]
+        weights.extend(quantize_layer(layer, float_w, mode, x))
+        if x is not None:
+            x = layer.forward(x, float_w)
+    return NumpyModel([(l.__class__.__name__, l.config) for l in model.layers],
+                      model.input_shape, weights)
+
+
+def quantize_ensemble(predictor, mode = 'int8', calibration_x = None):
+    """
+    Quantize every member of a NumpyEnsemblePredictor, keeping its
+    aggregation
+    """
+    members = [quantize_model(m, mode, calibration_x)
+               for m in predictor.members]
+    return NumpyEnsemblePredictor(members, weights = predictor.weights,
+            voting = predictor.voting, batch_size = predictor.batch_size,
+            head = predictor.head,
+            max_loaded = getattr(predictor, 'max_loaded', None))
+
+
+def weight_bytes(predictor):
+    """
+    The size of the weights of all the members of a Keras or NumPy predictor
+    """
+    return sum(int(w.nbytes) for m in predictor.members
+               for w in m.get_weights())
+
+
+def latency(predictor, x, repeats = 20):
+    """
+    The median time to answer one request for `x`, once the predictor has
+    answered a first one
+    """
+    predictor.predict(x)
+    times = []
+    for i in range(repeats):
+        start = time.time()
+        predictor.predict(x)
+        times.append(time.time() - start)
+    return float(numpy.median(times))
+
+
+def accuracy_report(reference, quantized, x, y, request_size = 1):
+    """
+    Compare a quantized ensemble with the float32 one it was made from
+    (either predictor) on an (x, y) set, and in latency on requests of
+    `request_size` instances
+    """
+    y = numpy.asarray(y)
+    if y.ndim > 1:
+        y = y.argmax(axis = 1)
+    x = numpy.asarray(x)
+    report = {}
+    for name, predictor in (('reference', reference),
+                            ('quantized', quantized)):
+        start = time.time()
+        predictions = predictor.predict(x)
+        report[name + '_seconds'] = time.time() - start
+        report[name + '_accuracy'] = float(numpy.mean(predictions == y))
+        report[name + '_bytes'] = weight_bytes(predictor)
+        report[name + '_latency'] = latency(predictor, x[:request_size])
+        report[name + '_predictions'] = predictions
+    report['accuracy_delta'] = report['quantized_accuracy'] - \
+            report['reference_accuracy']
+    report['agreement'] = float(numpy.mean(
+        report.pop('reference_predictions') ==
+        report.pop('quantized_predictions')))
+    return report
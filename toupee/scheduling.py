@@ -0,0 +1,99 @@
+#!/usr/bin/python
+"""
+Asynchronous successive halving: stop runs that are doing clearly worse
+than the others at the same epoch
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import json
+import fcntl
+import numpy
+
+
+class SuccessiveHalving:
+    """
+    Rungs are placed at min_epochs, min_epochs * reduction_factor,
+    min_epochs * reduction_factor^2, ... epochs. A run reaching a rung
+    reports its metric there, and is stopped unless it is within the best
+    1 / reduction_factor of all the runs that have reached that rung so far.
+    Runs never wait for each other, so early runs are judged against fewer
+    results, as in ASHA.
+
+    The results are kept in memory, or in a JSON file under a lock when
+    `path` is given, so that runs in several processes can share them.
+    """
+
+    def __init__(self, path = None, min_epochs = 1, reduction_factor = 3,
+            max_epochs = 1000, metric = 'val_loss', mode = 'min',
+            min_reports = None):
+        if not reduction_factor > 1:
+            raise ValueError("reduction_factor has to be above 1, not {0}"
+                    .format(reduction_factor))
+        if not min_epochs >= 1:
+            raise ValueError("min_epochs has to be at least 1, not {0}"
+                    .format(min_epochs))
+        if mode not in ('min', 'max'):
+            raise ValueError("mode has to be min or max, not {0}".format(mode))
+        self.path = path
+        self.reduction_factor = reduction_factor
+        self.metric = metric
+        self.mode = mode
+        if min_reports is None:
+            min_reports = reduction_factor
+        self.min_reports = min_reports
+        self.rungs = []
+        r = min_epochs
+        while r < max_epochs:
+            self.rungs.append(r)
+            r *= reduction_factor
+        self.results = {}
+
+    @classmethod
+    def from_config(cls, config, path = None, max_epochs = 1000):
+        config = dict(config)
+        config.setdefault('max_epochs', max_epochs)
+        return cls(path = path, **config)
+
+    def _update(self, rung, run, value):
+        if self.path is None:
+            results = self.results
+            results.setdefault(str(rung), {})[str(run)] = value
+            return results[str(rung)]
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                results = json.loads(content) if content else {}
+                results.setdefault(str(rung), {})[str(run)] = value
+                f.seek(0)
+                f.truncate()
+                json.dump(results, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return results[str(rung)]
+
+    def report(self, run, epoch, value):
+        """
+        Record `value` for `run` after `epoch` epochs, returning False if the
+        run should be stopped
+        """
+        if epoch not in self.rungs:
+            return True
+        at_rung = numpy.asarray(self._update(epoch, run, value).values(),
+                dtype = 'float64')
+        if len(at_rung) < self.min_reports:
+            return True
+        if self.mode == 'min':
+            cutoff = numpy.percentile(at_rung, 100. / self.reduction_factor)
+            return value <= cutoff
+        cutoff = numpy.percentile(at_rung, 100. - 100. / self.reduction_factor)
+        return value >= cutoff
+
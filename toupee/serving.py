@@ -0,0 +1,443 @@
+#!/usr/bin/python
+"""
+Serve predictions from a trained ensemble, micro-batching concurrent requests
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import json
+import time
+import threading
+import collections
+import Queue
+import SocketServer
+import BaseHTTPServer
+import numpy
+
+import archive
+from member_store import MemberStore
+
+
+def check_aggregation(method, head = None):
+    """
+    Stacked ensembles are aggregated by a trained head. Only the closed-form
+    heads of stacking.py (given as the fitted head or its name) are run by
+    the predictor, so other stacked ensembles cannot be served or scored as
+    an average
+    """
+    if method == 'Stacking' and (head is None or head == 'mlp'):
+        raise ValueError("Stacking ensembles need their stack head, which "
+                "EnsemblePredictor only supports for the closed-form heads")
+
+
+#methods whose members are averaged with the weights (alphas) they learnt
+WEIGHTED_METHODS = ['AdaBoostM1', 'DIB']
+
+
+def aggregation_weights(method, alphas, n_members):
+    """
+    The weights to average `n_members` members with: the alphas, if there
+    is one per member. A weighted method cannot be served without them,
+    e.g. from a method loaded from the YAML rather than the one that trained
+    the members, as an unweighted average is a different ensemble.
+    """
+    if alphas is not None and len(alphas) == n_members:
+        return [float(a) for a in alphas]
+    if archive.method_name(method) in WEIGHTED_METHODS:
+        raise ValueError("{0} ensembles need one alpha per member, "
+                "{1} members have {2}".format(archive.method_name(method),
+                    n_members, 0 if alphas is None else len(alphas)))
+    return None
+
+
+def member_output(member, x, batch_size = 100):
+    shape = list(member.inputs[0]._keras_shape[1:])
+    x = x.reshape([x.shape[0]] + shape)
+    return member.predict(x, batch_size = batch_size, verbose = 0)
+
+
+class EnsemblePredictor:
+    """
+    Run a batch of inputs through every member and aggregate the outputs the
+    same way the ensemble's aggregator does: plain averaging, weighted
+    averaging (AdaBoost/DIB alphas), majority voting or a closed-form stack
+    head.
+    """
+
+    def __init__(self, members, weights = None, voting = False,
+            batch_size = 100, head = None):
+        self.members = members
+        self.weights = weights
+        self.voting = voting
+        self.batch_size = batch_size
+        self.head = head
+
+    @classmethod
+    def from_method(cls, members, method, batch_size = 100):
+        head = method.__dict__.get('stack_head')
+        check_aggregation(archive.method_name(method), head)
+        weights = aggregation_weights(method,
+                getattr(method, 'alphas', None), len(members))
+        voting = 'voting' in method.__dict__ and bool(method.voting)
+        return cls(members, weights = weights, voting = voting,
+                batch_size = batch_size, head = head)
+
+    @classmethod
+    def from_archive(cls, archive, batch_size = 100, max_loaded = None):
+        """
+        A predictor for a saved ensemble, whose members are only rebuilt
+        when they are first used. All of them are then kept, or only the
+        `max_loaded` most recently used.
+        """
+        head = archive.head()
+        check_aggregation(archive.method, head)
+        if max_loaded is None:
+            max_loaded = max(1, len(archive))
+        weights = aggregation_weights(archive.method, archive.alphas,
+                len(archive))
+        return cls(MemberStore(archive, max_loaded), weights = weights,
+                voting = archive.voting, batch_size = batch_size, head = head)
+
+    def member_output(self, member, x):
+        return member_output(member, x, self.batch_size)
+
+    def input_shape(self):
+        """
+        The shape of one instance, as the members take it
+        """
+        return list(self.members[0].inputs[0]._keras_shape[1:])
+
+    def member_outputs(self, x):
+        """
+        The (instances, members, classes) outputs of every member
+        """
+        x = numpy.asarray(x)
+        return numpy.stack([self.member_output(m, x) for m in self.members],
+                axis = 1)
+
+    def predict_proba(self, x):
+        if self.head is not None:
+            return self.head.predict_proba(self.member_outputs(x))
+        x = numpy.asarray(x)
+        return self.combine(self.member_output(m, x) for m in self.members)
+
+    def combine(self, outputs):
+        """
+        Aggregate the outputs of the members, given in member order, e.g.
+        those stored by a MemberStore
+        """
+        if self.head is not None:
+            return self.head.predict_proba(numpy.stack(list(outputs), axis = 1))
+        acc = None
+        n = 0
+        for i, p in enumerate(outputs):
+            n += 1
+            if self.voting:
+                votes = numpy.zeros_like(p)
+                votes[numpy.arange(p.shape[0]), p.argmax(axis = 1)] = 1.
+                p = votes
+            if self.weights is not None:
+                p = p * self.weights[i]
+            if acc is None:
+                acc = numpy.array(p)
+            else:
+                acc += p
+        if self.weights is None:
+            return acc / n
+        return acc / sum(self.weights)
+
+    def predict(self, x):
+        return self.predict_proba(x).argmax(axis = 1)
+
+
+def load_members(filename, model_file = None):
+    """
+    Load the members saved by examples/save_ensemble.py. These are either
+    an ensemble archive, pickled model objects or, as kept in
+    `method.members` by Bagging and Stacking, lists of weight arrays, which
+    are set on fresh copies of the network in `model_file`.
+    """
+    if archive.is_archive(filename):
+        return list(archive.EnsembleArchive(filename).iter_members())
+    import dill
+    with open(filename, 'rb') as f:
+        members = dill.load(f)
+    if len(members) > 0 and isinstance(members[0], (list, tuple)):
+        if model_file is None:
+            raise ValueError("{0} contains weights only, a model file is "
+                    "needed to rebuild the members".format(filename))
+        import mlp
+        members = [mlp.build_model(model_file, w) for w in members]
+    return members
+
+
+class ServingMetrics:
+    """
+    Keep a rolling window of per-request latencies and per-batch sizes
+    """
+
+    def __init__(self, window = 10000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen = window)
+        self.batch_sizes = collections.deque(maxlen = window)
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record_batch(self, n_rows, n_requests):
+        with self.lock:
+            self.batches += 1
+            self.batch_sizes.append((n_rows, n_requests))
+
+    def record_request(self, latency, failed = False):
+        with self.lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+            self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = numpy.asarray(self.latencies, dtype = 'float64')
+            batch_sizes = numpy.asarray(self.batch_sizes, dtype = 'float64')
+            s = { 'requests': self.requests,
+                  'batches': self.batches,
+                  'errors': self.errors,
+                }
+        if len(latencies) > 0:
+            ms = latencies * 1000.
+            s['latency_ms'] = { 'mean': float(ms.mean()),
+                                'p50': float(numpy.percentile(ms, 50)),
+                                'p90': float(numpy.percentile(ms, 90)),
+                                'p99': float(numpy.percentile(ms, 99)),
+                                'max': float(ms.max()),
+                              }
+        if len(batch_sizes) > 0:
+            s['batch_rows'] = { 'mean': float(batch_sizes[:,0].mean()),
+                                'max': int(batch_sizes[:,0].max()),
+                              }
+            s['batch_requests'] = { 'mean': float(batch_sizes[:,1].mean()),
+                                    'max': int(batch_sizes[:,1].max()),
+                                  }
+        return s
+
+
+class PendingRequest:
+
+    def __init__(self, x):
+        self.x = x
+        self.arrival = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.batch_rows = 0
+
+    def wait(self, timeout = None):
+        if not self.done.wait(timeout):
+            raise RuntimeError("prediction timed out")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class MicroBatcher:
+    """
+    Collect concurrent prediction requests and run them through `predict_fn`
+    together. A batch is dispatched as soon as it holds `max_batch_size` rows
+    or its oldest request has waited `max_latency` seconds. Only requests
+    whose instances have the same shape are batched together.
+    """
+
+    def __init__(self, predict_fn, max_batch_size = 64, max_latency = 0.005,
+            metrics = None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.metrics = metrics if metrics is not None else ServingMetrics()
+        self.queue = Queue.Queue()
+        self.carried = None
+        self.running = False
+        self.worker = None
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.worker = threading.Thread(target = self._loop)
+            self.worker.daemon = True
+            self.worker.start()
+        return self
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.queue.put(None)
+            self.worker.join()
+
+    def submit(self, x):
+        x = numpy.asarray(x)
+        if x.ndim == 1:
+            x = x.reshape((1, x.shape[0]))
+        request = PendingRequest(x)
+        self.queue.put(request)
+        return request
+
+    def predict(self, x, timeout = None):
+        request = self.submit(x)
+        return request.wait(timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        rows = first.x.shape[0]
+        deadline = first.arrival + self.max_latency
+        while rows < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    request = self.queue.get(timeout = remaining)
+                else:
+                    request = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if request is None:
+                self.running = False
+                break
+            if rows + request.x.shape[0] > self.max_batch_size or \
+                    request.x.shape[1:] != first.x.shape[1:]:
+                #does not fit, so it opens the next batch
+                self.carried = request
+                break
+            batch.append(request)
+            rows += request.x.shape[0]
+        return batch, rows
+
+    def _loop(self):
+        while self.running:
+            if self.carried is not None:
+                first, self.carried = self.carried, None
+            else:
+                first = self.queue.get()
+            if first is None:
+                break
+            batch, rows = self._collect(first)
+            self.metrics.record_batch(rows, len(batch))
+            try:
+                x = numpy.concatenate([r.x for r in batch])
+                out = self.predict_fn(x)
+                start = 0
+                for r in batch:
+                    end = start + r.x.shape[0]
+                    r.result = out[start:end]
+                    start = end
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+            now = time.time()
+            for r in batch:
+                r.batch_rows = rows
+                self.metrics.record_request(now - r.arrival,
+                        failed = r.error is not None)
+                r.done.set()
+
+
+class PredictionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    POST /predict with {"x": [[...], ...]} returns the class probabilities
+    and predicted classes, GET /metrics returns the serving metrics.
+    Instances that do not have the server's input_shape (once flattened)
+    are refused with a 400.
+    """
+
+    def address_string(self):
+        #unix sockets have no client address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                    *args)
+
+    def _reply(self, code, body):
+        payload = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, self.server.batcher.metrics.snapshot())
+        elif self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'unknown path {0}'.format(self.path)})
+
+    def check_shape(self, x):
+        expected = self.server.input_shape
+        if expected is None:
+            return
+        if x.ndim < 2 or numpy.prod(x.shape[1:]) != numpy.prod(expected):
+            raise ValueError("expected instances of shape {0}, got {1}"
+                    .format(list(expected), list(x.shape[1:])))
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._reply(404, {'error': 'unknown path {0}'.format(self.path)})
+            return
+        try:
+            length = int(self.headers.getheader('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            x = numpy.asarray(request['x'], dtype = 'float32')
+            if x.ndim == 1:
+                x = x.reshape((1, x.shape[0]))
+            self.check_shape(x)
+        except Exception as e:
+            self._reply(400, {'error': str(e)})
+            return
+        start = time.time()
+        try:
+            p = self.server.batcher.predict(x,
+                    timeout = self.server.request_timeout)
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, { 'p': p.tolist(),
+                           'y': p.argmax(axis = 1).tolist(),
+                           'latency_ms': (time.time() - start) * 1000.,
+                         })
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(batcher, address, timeout = 60., verbose = False,
+        input_shape = None):
+    """
+    Create the server for a started batcher. `address` is either a
+    (host, port) tuple for TCP or a path for a unix socket. With
+    `input_shape`, requests of another shape are refused.
+    """
+    if isinstance(address, tuple):
+        server = HTTPServer(address, PredictionHandler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = UnixHTTPServer(address, PredictionHandler)
+    server.batcher = batcher
+    server.request_timeout = timeout
+    server.verbose = verbose
+    server.input_shape = input_shape
+    return server
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+"""
+Sharded datasets, for data sets that do not fit in memory
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import json
+import collections
+import numpy
+
+INDEX = 'index.json'
+SPLITS = ['train', 'valid', 'test']
+
+
+def is_sharded(path):
+    return os.path.isfile(os.path.join(path, INDEX))
+
+
+def is_sharded_dataset(dataset):
+    """
+    Whether any split of a loaded (train, valid, test) dataset is sharded
+    """
+    return any(isinstance(x, ShardedArray) for x, y in dataset)
+
+
+class ShardCache:
+    """
+    Keep the `size` most recently used shards open
+    """
+
+    def __init__(self, directory, files, size = 4, mmap = True):
+        self.directory = directory
+        self.files = files
+        self.size = size
+        self.mmap_mode = 'r' if mmap else None
+        self.shards = collections.OrderedDict()
+
+    def get(self, i):
+        shard = self.shards.pop(i, None)
+        if shard is None:
+            shard = numpy.load(os.path.join(self.directory, self.files[i]),
+                    mmap_mode = self.mmap_mode)
+            if len(self.shards) >= self.size:
+                self.shards.popitem(last = False)
+        self.shards[i] = shard
+        return shard
+
+
+class ShardedArray:
+    """
+    An array split over fixed-size shards on disk, that can be indexed like a
+    numpy array (integers, slices or index arrays) and only reads the shards
+    it needs. `subset` and `reshape` return views that share the cache.
+    """
+
+    def __init__(self, cache, n, shard_size, row_shape, dtype, index = None,
+            transform = None, n_classes = None):
+        self.cache = cache
+        self.n = n
+        self.shard_size = shard_size
+        self.row_shape = tuple(row_shape)
+        self.dtype = numpy.dtype(dtype)
+        self.index = index
+        self.transform = transform
+        self.n_classes = n_classes
+
+    def __len__(self):
+        if self.index is not None:
+            return len(self.index)
+        return self.n
+
+    @property
+    def shape(self):
+        return (len(self),) + self.row_shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def _view(self, **changes):
+        attrs = dict(cache = self.cache, n = self.n,
+                     shard_size = self.shard_size, row_shape = self.row_shape,
+                     dtype = self.dtype, index = self.index,
+                     transform = self.transform, n_classes = self.n_classes)
+        attrs.update(changes)
+        return ShardedArray(**attrs)
+
+    def rows(self, positions):
+        """
+        The rows in the underlying shards that `positions` refer to
+        """
+        if self.index is not None:
+            return self.index[positions]
+        return positions
+
+    def subset(self, positions):
+        return self._view(index = self.rows(numpy.asarray(positions,
+            dtype = 'int64')))
+
+    def reshape(self, shape):
+        shape = tuple(shape)
+        if shape[0] != len(self):
+            raise ValueError("cannot reshape {0} rows into {1}".format(
+                len(self), shape))
+        return self._view(row_shape = shape[1:])
+
+    def with_transform(self, transform):
+        return self._view(transform = transform)
+
+    def gather(self, positions):
+        rows = self.rows(numpy.asarray(positions, dtype = 'int64'))
+        out = None
+        shard_ids = rows // self.shard_size
+        order = numpy.argsort(shard_ids, kind = 'mergesort')
+        boundaries = numpy.flatnonzero(numpy.diff(shard_ids[order])) + 1
+        for group in numpy.split(order, boundaries):
+            if len(group) == 0:
+                continue
+            s = shard_ids[group[0]]
+            shard = self.cache.get(s)
+            values = shard[rows[group] - s * self.shard_size]
+            if out is None:
+                out = numpy.empty((len(rows),) + values.shape[1:],
+                        dtype = values.dtype)
+            out[group] = values
+        if out is None:
+            out = numpy.empty((0,) + self.row_shape, dtype = self.dtype)
+        out = out.reshape((len(rows),) + self.row_shape)
+        if self.transform is not None:
+            out = self.transform(out)
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.gather(numpy.arange(*key.indices(len(self))))
+        if isinstance(key, (int, long, numpy.integer)):
+            if key < 0:
+                key += len(self)
+            return self.gather([key])[0]
+        return self.gather(key)
+
+    def __array__(self, dtype = None):
+        a = self.gather(numpy.arange(len(self)))
+        if dtype is not None:
+            a = a.astype(dtype)
+        return a
+
+    def locality_order(self, rng = None):
+        """
+        A visiting order that touches one shard at a time: shuffled shard by
+        shard, and within each shard, if `rng` is given, otherwise in order
+        of the underlying rows.
+        """
+        shard_ids = self.rows(numpy.arange(len(self))) // self.shard_size
+        if rng is None:
+            return numpy.argsort(self.rows(numpy.arange(len(self))),
+                    kind = 'mergesort')
+        shard_keys = rng.permutation(shard_ids.max() + 1)
+        return numpy.lexsort((rng.rand(len(self)), shard_keys[shard_ids]))
+
+
+def iterate_minibatches(x, y, batch_size, shuffle = False, rng = None,
+        forever = False, weights = None):
+    """
+    Yield (x, y) minibatches of a pair of sharded (or plain) arrays, or
+    (x, y, w) with per-instance `weights`. Sharded arrays are visited one
+    shard at a time so that each shard is read once per epoch.
+    """
+    if shuffle and rng is None:
+        rng = numpy.random
+    while True:
+        if isinstance(x, ShardedArray):
+            order = x.locality_order(rng if shuffle else None)
+        elif shuffle:
+            order = rng.permutation(len(x))
+        else:
+            order = numpy.arange(len(x))
+        for start in xrange(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            if isinstance(x, ShardedArray):
+                b = (x.gather(batch), y.gather(batch))
+            else:
+                b = (x[batch], y[batch])
+            if weights is not None:
+                b = b + (weights[batch],)
+            yield b
+        if not forever:
+            return
+
+
+class ShardWriter:
+    """
+    Write one split of a sharded dataset, a block of rows at a time
+    """
+
+    def __init__(self, path, split, shard_size):
+        self.path = path
+        self.split = split
+        self.shard_size = shard_size
+        self.shards = []
+        self.buffer_x = []
+        self.buffer_y = []
+        self.buffered = 0
+        self.n = 0
+        self.n_classes = 0
+        self.x_info = None
+        self.y_info = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def append(self, x, y):
+        x = numpy.asarray(x)
+        y = numpy.asarray(y)
+        if self.x_info is None:
+            self.x_info = { 'dtype': x.dtype.str, 'shape': list(x.shape[1:]) }
+            self.y_info = { 'dtype': y.dtype.str, 'shape': list(y.shape[1:]) }
+        if y.ndim == 1 and len(y) > 0 and y.dtype.kind in 'iu':
+            self.n_classes = max(self.n_classes, int(y.max()) + 1)
+        self.buffer_x.append(x)
+        self.buffer_y.append(y)
+        self.buffered += len(x)
+        while self.buffered >= self.shard_size:
+            self._flush(self.shard_size)
+
+    def _flush(self, size):
+        x = numpy.concatenate(self.buffer_x)
+        y = numpy.concatenate(self.buffer_y)
+        i = len(self.shards)
+        names = ('{0}_x_{1:05d}.npy'.format(self.split, i),
+                 '{0}_y_{1:05d}.npy'.format(self.split, i))
+        numpy.save(os.path.join(self.path, names[0]), x[:size])
+        numpy.save(os.path.join(self.path, names[1]), y[:size])
+        self.shards.append({ 'x': names[0], 'y': names[1], 'n': size })
+        self.n += size
+        self.buffer_x = [x[size:]]
+        self.buffer_y = [y[size:]]
+        self.buffered -= size
+
+    def close(self):
+        if self.buffered > 0:
+            self._flush(self.buffered)
+        return { 'n': self.n,
+                 'shard_size': self.shard_size,
+                 'n_classes': self.n_classes,
+                 'x': self.x_info,
+                 'y': self.y_info,
+                 'shards': self.shards,
+               }
+
+
+def write_split(path, split, x, y, shard_size = 10000):
+    """
+    Write the shards of one split, returning its entry in the index
+    """
+    writer = ShardWriter(path, split, shard_size)
+    for start in xrange(0, len(x), shard_size):
+        writer.append(x[start:start + shard_size],
+                      y[start:start + shard_size])
+    return writer.close()
+
+
+def write_index(path, index):
+    with open(os.path.join(path, INDEX), 'w') as f:
+        json.dump(index, f, indent = 2)
+
+
+def write_sharded(path, dataset, shard_size = 10000):
+    """
+    Write a (train, valid, test) dataset of in-memory or memory-mapped
+    arrays in sharded form
+    """
+    index = {}
+    for split, (x, y) in zip(SPLITS, dataset):
+        index[split] = write_split(path, split, x, y, shard_size)
+    write_index(path, index)
+
+
+def load_split(path, split, cache_size = 4, mmap = True):
+    """
+    Open one split of a sharded dataset as a pair of ShardedArrays
+    """
+    with open(os.path.join(path, INDEX)) as f:
+        info = json.load(f)[split]
+    arrays = []
+    for key in ['x', 'y']:
+        cache = ShardCache(path, [s[key] for s in info['shards']],
+                size = cache_size, mmap = mmap)
+        arrays.append(ShardedArray(cache, info['n'], info['shard_size'],
+            info[key]['shape'], info[key]['dtype'],
+            n_classes = info['n_classes']))
+    return tuple(arrays)
@@ -0,0 +1,392 @@
+#!/usr/bin/python
+"""
+Stacking helpers: out-of-fold meta-features, for which every base member is
+trained once per fold without that fold and predicts it, so that the stack
+head learns from predictions on instances the members have not seen; and
+stack heads that are fitted in closed form or by convex optimisation rather
+than by training a network
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import gc
+import json
+import hashlib
+import tempfile
+import multiprocessing
+import numpy
+
+import common
+import sweep
+import autotune
+from parameters import Parameters
+
+optimize = common.LazyModule('scipy.optimize')
+
+FEATURES_FILE = 'features.npy'
+FOLDS_FILE = 'folds.npy'
+#parameters that change between members or trials without changing what
+#a member learns
+VOLATILE_PARAMS = ['method', 'member_number', 'trial', 'trial_overrides']
+
+DEFAULT_CACHE = os.path.join(tempfile.gettempdir(), 'toupee-stacking')
+
+
+def data_digest(arrays, chunk_size = 10000):
+    """
+    A digest of the contents of `arrays`, read a chunk of rows at a time so
+    that none of them is converted as a whole
+    """
+    digest = hashlib.sha1()
+    for a in arrays:
+        for start in xrange(0, len(a), chunk_size):
+            chunk = numpy.ascontiguousarray(a[start:start + chunk_size])
+            digest.update('{0}{1}'.format(chunk.dtype, chunk.shape))
+            digest.update(chunk.data)
+    return digest.hexdigest()
+
+
+def cache_key(params, n_members, folds, train_set):
+    """
+    A digest of everything the meta-features depend on, including the
+    training data itself, so that a dataset regenerated in place is not
+    matched with stale features, but not of the stack head, so that heads
+    can be changed without retraining members
+    """
+    with open(params.model_file) as f:
+        model = f.read()
+    settings = dict((k, v) for k, v in params.__dict__.items()
+                    if k not in VOLATILE_PARAMS)
+    description = json.dumps({ 'model': model, 'params': settings,
+                               'n_members': n_members, 'folds': folds,
+                               'n_train': len(train_set[0]),
+                               'data': data_digest(train_set) },
+                             sort_keys = True, default = common.serialize)
+    return hashlib.sha1(description).hexdigest()
+
+
+def take(a, rows):
+    if hasattr(a, 'subset'):
+        return a.subset(rows)
+    return numpy.asarray(a)[rows]
+
+
+def train_and_predict(train_set, valid_set, x, params):
+    """
+    Train a member and return its output on `x`
+    """
+    import mlp
+    model = mlp.sequential_model([train_set, valid_set], params)
+    x = numpy.asarray(x)
+    shape = list(model.inputs[0]._keras_shape[1:])
+    p = model.predict(x.reshape([x.shape[0]] + shape),
+            batch_size = autotune.inference_batch_size(params),
+            verbose = 0)
+    del model
+    gc.collect()
+    return p
+
+
+class MetaFeatures:
+    """
+    The (n_train, n_members, n_classes) out-of-fold predictions of the base
+    members, in a memory-mapped file in `directory`, which every worker
+    writes its folds into. A task is done once its marker file exists, so
+    an interrupted run carries on where it stopped.
+    """
+
+    def __init__(self, directory, n_train, n_members, n_classes, folds,
+            seed):
+        self.directory = directory
+        self.features_file = os.path.join(directory, FEATURES_FILE)
+        if not os.path.isfile(self.features_file):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fold_ids = numpy.arange(n_train) % folds
+            numpy.random.RandomState(seed).shuffle(fold_ids)
+            numpy.save(os.path.join(directory, FOLDS_FILE), fold_ids)
+            tmp = self.features_file + '.tmp.npy'
+            features = numpy.lib.format.open_memmap(tmp, mode = 'w+',
+                    dtype = 'float32', shape = (n_train, n_members, n_classes))
+            del features
+            os.rename(tmp, self.features_file)
+        self.fold_ids = numpy.load(os.path.join(directory, FOLDS_FILE))
+        self.n_members = n_members
+        self.folds = folds
+
+    def done_file(self, member, fold):
+        return os.path.join(self.directory,
+                'member_{0:04d}_fold_{1:02d}.done'.format(member, fold))
+
+    def pending(self):
+        return [(m, f) for m in range(self.n_members)
+                for f in range(self.folds)
+                if not os.path.isfile(self.done_file(m, f))]
+
+    def write(self, member, fold, rows, p):
+        features = numpy.load(self.features_file, mmap_mode = 'r+')
+        features[rows, member] = p
+        features.flush()
+        del features
+        open(self.done_file(member, fold), 'w').close()
+
+    def load(self):
+        return numpy.load(self.features_file, mmap_mode = 'r')
+
+
+#set in the parent before the pool forks, so it is inherited by the workers
+stacking_state = {}
+
+
+def run_task(task):
+    """
+    Train `member` without `fold`, on a bootstrap sample of the other
+    folds, and write its predictions for the fold
+    """
+    member, fold = task
+    params = stacking_state['params']
+    features = stacking_state['features']
+    train_x, train_y = stacking_state['dataset'][0]
+    held_out = numpy.flatnonzero(features.fold_ids == fold)
+    kept = numpy.flatnonzero(features.fold_ids != fold)
+    seed = [0 if params.random_seed is None else params.random_seed,
+            member, fold]
+    rng = numpy.random.RandomState(seed)
+    size = int(round(params.resample_size * len(kept) /
+                     float(len(features.fold_ids))))
+    sample = kept[rng.randint(0, len(kept), size)]
+    #the initial weights are drawn from the global generator
+    numpy.random.seed(seed)
+    #a copy, as the parameters are the caller's own on a single worker
+    params = Parameters(**params.__dict__)
+    params.member_number = member + 1
+    p = stacking_state['train']((take(train_x, sample), take(train_y, sample)),
+            stacking_state['dataset'][1], take(train_x, held_out), params)
+    features.write(member, fold, held_out, p)
+    return task
+
+
+def n_classes(y):
+    y = numpy.asarray(y)
+    if y.ndim > 1:
+        return y.shape[1]
+    return int(y.max()) + 1
+
+
+def out_of_fold_features(params, dataset, n_members, folds,
+        cache_dir = None, workers = 1, train = train_and_predict):
+    """
+    The out-of-fold meta-features of `n_members` members on the training set
+    of `dataset`, computed by `workers` processes with `train`, or read from
+    the cache if they have been computed before
+    """
+    if folds < 2:
+        raise ValueError("out-of-fold stacking needs at least 2 folds")
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE
+    train_x, train_y = dataset[0]
+    n_train = len(train_x)
+    directory = os.path.join(cache_dir,
+            cache_key(params, n_members, folds, dataset[0]))
+    features = MetaFeatures(directory, n_train, n_members,
+            n_classes(train_y), folds, params.random_seed)
+    tasks = features.pending()
+    if len(tasks) == 0:
+        print "reusing the meta-features in {0}".format(directory)
+        return features.load()
+    stacking_state['params'] = params
+    stacking_state['features'] = features
+    stacking_state['train'] = train
+    print "training {0} member folds on {1} workers".format(len(tasks),
+            workers)
+    if workers > 1:
+        stacking_state['dataset'] = sweep.share_dataset(dataset)
+        #imported before forking, so that the workers inherit Keras
+        import mlp
+        pool = multiprocessing.Pool(workers)
+        try:
+            for member, fold in pool.imap_unordered(run_task, tasks):
+                print "member {0} fold {1} done".format(member, fold)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        stacking_state['dataset'] = dataset
+        for task in tasks:
+            run_task(task)
+    stacking_state.clear()
+    return features.load()
+
+
+def one_hot_targets(y, n_classes):
+    y = numpy.asarray(y)
+    if y.ndim > 1:
+        return y.astype('float64')
+    targets = numpy.zeros((len(y), n_classes))
+    targets[numpy.arange(len(y)), y] = 1.
+    return targets
+
+
+def softmax(z):
+    e = numpy.exp(z - z.max(axis = 1, keepdims = True))
+    return e / e.sum(axis = 1, keepdims = True)
+
+
+def with_bias(x):
+    return numpy.hstack([x, numpy.ones((x.shape[0], 1))])
+
+
+class LogisticHead:
+    """
+    Multinomial logistic regression on the concatenated member outputs,
+    with an L2 penalty of `l2` on the weights, fitted with L-BFGS
+    """
+
+    name = 'logistic'
+
+    def __init__(self, l2 = 1e-3, max_iter = 500):
+        self.l2 = l2
+        self.max_iter = max_iter
+        self.W = None
+
+    def inputs(self, features):
+        features = numpy.asarray(features, dtype = 'float64')
+        return with_bias(features.reshape((features.shape[0], -1)))
+
+    def fit(self, features, y):
+        x = self.inputs(features)
+        targets = one_hot_targets(y, features.shape[2])
+        n, d = x.shape
+        shape = (d, targets.shape[1])
+        penalised = numpy.ones(shape)
+        penalised[-1] = 0.
+        def loss(w):
+            W = w.reshape(shape)
+            z = x.dot(W)
+            top = z.max(axis = 1, keepdims = True)
+            log_norm = top + numpy.log(numpy.exp(z - top).sum(axis = 1,
+                keepdims = True))
+            value = (log_norm.sum() - (targets * z).sum()) / n + \
+                    0.5 * self.l2 * ((W * penalised) ** 2).sum()
+            grad = x.T.dot(numpy.exp(z - log_norm) - targets) / n + \
+                    self.l2 * W * penalised
+            return value, grad.ravel()
+        w, value, info = optimize.fmin_l_bfgs_b(loss, numpy.zeros(shape).ravel(),
+                maxiter = self.max_iter)
+        self.W = w.reshape(shape)
+        return self
+
+    def predict_proba(self, features):
+        return softmax(self.inputs(features).dot(self.W))
+
+    def get_state(self):
+        return { 'W': self.W, 'l2': self.l2 }
+
+    def set_state(self, state):
+        self.W = state['W']
+        self.l2 = float(state['l2'])
+
+
+class NNLSHead:
+    """
+    A non-negative weight per member, fitted by least squares between the
+    weighted sum of the members' outputs and the one-hot targets, and
+    normalised to a weighted average. With `l2`, the weights are penalised
+    as in RidgeHead, by l2 times the number of instances, through rows of
+    sqrt(l2 * n) * I with zero targets appended to the system.
+    """
+
+    name = 'nnls'
+
+    def __init__(self, l2 = None):
+        self.l2 = l2
+        self.weights = None
+
+    def fit(self, features, y):
+        features = numpy.asarray(features, dtype = 'float64')
+        n, n_members, n_classes = features.shape
+        a = features.transpose(0, 2, 1).reshape((n * n_classes, n_members))
+        b = one_hot_targets(y, n_classes).ravel()
+        if self.l2:
+            a = numpy.vstack([a, numpy.sqrt(self.l2 * n) * numpy.eye(n_members)])
+            b = numpy.concatenate([b, numpy.zeros(n_members)])
+        w, residual = optimize.nnls(a, b)
+        if w.sum() == 0.:
+            w = numpy.ones(n_members)
+        self.weights = w / w.sum()
+        return self
+
+    def predict_proba(self, features):
+        return numpy.tensordot(numpy.asarray(features, dtype = 'float64'),
+                self.weights, axes = ([1], [0]))
+
+    def get_state(self):
+        return { 'weights': self.weights }
+
+    def set_state(self, state):
+        self.weights = state['weights']
+
+
+class RidgeHead:
+    """
+    Ridge regression from the members' log-probabilities to the one-hot
+    targets, solved in closed form; the scores are clipped at zero and
+    normalised
+    """
+
+    name = 'ridge'
+
+    def __init__(self, l2 = 1e-3):
+        self.l2 = l2
+        self.W = None
+
+    def inputs(self, features):
+        features = numpy.asarray(features, dtype = 'float64')
+        logits = numpy.log(numpy.clip(features, 1e-7, 1.))
+        return with_bias(logits.reshape((features.shape[0], -1)))
+
+    def fit(self, features, y):
+        x = self.inputs(features)
+        targets = one_hot_targets(y, features.shape[2])
+        penalty = self.l2 * len(x) * numpy.eye(x.shape[1])
+        penalty[-1, -1] = 0.
+        self.W = numpy.linalg.solve(x.T.dot(x) + penalty, x.T.dot(targets))
+        return self
+
+    def predict_proba(self, features):
+        scores = numpy.maximum(self.inputs(features).dot(self.W), 0.)
+        totals = scores.sum(axis = 1, keepdims = True)
+        uniform = numpy.ones_like(scores) / scores.shape[1]
+        return numpy.where(totals > 0., scores / numpy.maximum(totals, 1e-12),
+                uniform)
+
+    def get_state(self):
+        return { 'W': self.W, 'l2': self.l2 }
+
+    def set_state(self, state):
+        self.W = state['W']
+        self.l2 = float(state['l2'])
+
+
+HEADS = dict((h.name, h) for h in [LogisticHead, NNLSHead, RidgeHead])
+
+
+def make_head(name, l2 = None):
+    if name not in HEADS:
+        raise ValueError("unknown stack head {0}, use mlp or one of {1}"
+                .format(name, ', '.join(sorted(HEADS))))
+    if l2 is None:
+        return HEADS[name]()
+    return HEADS[name](l2 = l2)
+
+
+def load_head(name, state):
+    head = make_head(name)
+    head.set_state(state)
+    return head
@@ -0,0 +1,262 @@
+#!/usr/bin/python
+"""
+Run a hyperparameter sweep over one experiment description, with the
+dataset loaded once and shared by parallel trials
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import gc
+import copy
+import os
+import json
+import mmap
+import time
+import random
+import itertools
+import traceback
+import tempfile
+import multiprocessing
+import numpy
+
+import common
+import data
+import autotune
+
+
+def sample_value(spec, rng):
+    """
+    Draw one value for a random search: a list is a choice, a dict gives a
+    distribution (uniform, log_uniform or int, between low and high)
+    """
+    if isinstance(spec, list):
+        return spec[rng.randint(0, len(spec) - 1)]
+    if isinstance(spec, dict):
+        distribution = spec.get('distribution', 'uniform')
+        low, high = spec['low'], spec['high']
+        if distribution == 'uniform':
+            return rng.uniform(low, high)
+        if distribution == 'log_uniform':
+            return float(numpy.exp(rng.uniform(numpy.log(low), numpy.log(high))))
+        if distribution == 'int':
+            return rng.randint(low, high)
+        raise ValueError("unknown distribution {0}".format(distribution))
+    return spec
+
+
+def expand(spec):
+    """
+    Turn a sweep description into the list of parameter overrides of each
+    trial. With mode: grid every combination of the listed values is a
+    trial, with mode: random n_trials are sampled.
+    """
+    parameters = spec['parameters']
+    names = sorted(parameters.keys())
+    mode = spec.get('mode', 'grid')
+    if mode == 'grid':
+        values = []
+        for name in names:
+            v = parameters[name]
+            if not isinstance(v, list):
+                v = [v]
+            values.append(v)
+        return [dict(zip(names, combination))
+                for combination in itertools.product(*values)]
+    if mode == 'random':
+        rng = random.Random(spec.get('seed'))
+        return [dict((name, sample_value(parameters[name], rng))
+                     for name in names)
+                for i in range(spec['n_trials'])]
+    raise ValueError("unknown sweep mode {0}".format(mode))
+
+
+def apply_overrides(params, overrides):
+    """
+    A copy of `params` with the trial's overrides set. Dotted names set an
+    attribute of a nested object, e.g. method.voting
+    """
+    params = copy.deepcopy(params)
+    for name, value in overrides.items():
+        target = params
+        path = name.split('.')
+        for attr in path[:-1]:
+            target = getattr(target, attr)
+        setattr(target, path[-1], value)
+    return params
+
+
+def share_array(a):
+    """
+    Copy an array into an anonymous shared mapping, which worker processes
+    forked afterwards see without a copy of their own
+    """
+    if not isinstance(a, numpy.ndarray) or a.nbytes == 0:
+        return a
+    buf = mmap.mmap(-1, a.nbytes)
+    shared = numpy.frombuffer(buf, dtype = a.dtype).reshape(a.shape)
+    shared[...] = a
+    shared.flags.writeable = False
+    return shared
+
+
+def share_dataset(dataset):
+    """
+    Sharded sets are left alone, the page cache already shares their shards,
+    and compact sets are shared in their storage dtype
+    """
+    def share(a):
+        if isinstance(a, data.CompactArray):
+            return a._view(base = share_array(a.base))
+        return share_array(a)
+    return tuple((share(x), share(y)) for x, y in dataset)
+
+
+#set in the parent before the pool forks, so it is inherited by the workers
+sweep_state = {}
+
+
+def run_trial(trial):
+    index, overrides = trial
+    params = apply_overrides(sweep_state['params'], overrides)
+    params.trial = index
+    params.trial_overrides = overrides
+    dataset = sweep_state['dataset']
+    record = { 'trial': index, 'overrides': overrides }
+    start = time.time()
+    try:
+        if sweep_state['ensemble']:
+            record.update(run_ensemble_trial(params, dataset))
+        else:
+            import mlp
+            callbacks = sweep_state['callbacks'](index)
+            if sweep_state['scheduler'] is not None:
+                callbacks.append(mlp.SuccessiveHalvingStopping(
+                    sweep_state['scheduler'], index))
+            model, results = mlp.sequential_model(dataset, params,
+                    return_results = True, callbacks = callbacks)
+            record['best_valid'] = results.best_valid
+            record['best_test'] = results.__dict__.get('best_test')
+            record['best_epoch'] = results.best_epoch
+            for c in callbacks:
+                if getattr(c, 'stopped_at', None) is not None:
+                    record['stopped_at'] = c.stopped_at
+            del model
+    except Exception as e:
+        traceback.print_exc()
+        record['error'] = str(e)
+    record['seconds'] = time.time() - start
+    gc.collect()
+    return record
+
+
+def run_ensemble_trial(params, dataset):
+    """
+    Train a whole ensemble and score it on the validation and test sets
+    """
+    from checkpoint import train_ensemble
+    from serving import EnsemblePredictor, check_aggregation
+    from archive import method_name
+    method = params.method
+    #refused before training rather than after
+    check_aggregation(method_name(method), method.__dict__.get('head'))
+    method.prepare(params, dataset)
+    max_loaded = params.__dict__.get('max_loaded_members')
+    cached_sets = None
+    if max_loaded is not None:
+        #scored from the stored outputs rather than by rebuilding members
+        cached_sets = { 'best_valid': dataset[1][0],
+                        'best_test': dataset[2][0] }
+    members = train_ensemble(method, params, None, None,
+            max_loaded = max_loaded, cached_sets = cached_sets)
+    try:
+        if method_name(method) == 'Stacking':
+            predictor = method.create_aggregator(params, members, None, None,
+                    dataset[0], dataset[1])
+        else:
+            predictor = EnsemblePredictor.from_method(members, method,
+                    batch_size = autotune.inference_batch_size(params))
+        scores = {}
+        for name, (x, y) in zip(['best_valid', 'best_test'], dataset[1:]):
+            y = numpy.asarray(y)
+            if y.ndim > 1:
+                y = y.argmax(axis = 1)
+            outputs = None
+            if max_loaded is not None:
+                outputs = members.outputs(name)
+            if outputs is None:
+                p = predictor.predict(x)
+            else:
+                p = predictor.combine(outputs).argmax(axis = 1)
+            scores[name] = float(numpy.mean(p == y)) * 100.
+        ensemble_size = len(members)
+    finally:
+        if max_loaded is not None:
+            members.close()
+    record = dict(scores)
+    record['ensemble_size'] = ensemble_size
+    summary = dict((k, v) for k, v in params.__dict__.items() if k != 'method')
+    summary['method'] = method.serialize()
+    common.save_results({ 'params': summary,
+                          'ensemble_valid': scores['best_valid'],
+                          'ensemble_test': scores['best_test'] }, params)
+    return record
+
+
+def no_callbacks(index):
+    return []
+
+
+def run_sweep(params, dataset, spec, workers = None, output = None,
+        callbacks = no_callbacks):
+    """
+    Run every trial of `spec` on a pool of `workers` processes, returning
+    the trial records sorted from best to worst validation score.
+    `callbacks(index)` gives the extra Keras callbacks for a trial.
+    With an early_termination section (scheduling.SuccessiveHalving
+    arguments), trials falling behind the others are stopped early.
+    """
+    trials = list(enumerate(expand(spec)))
+    if workers is None:
+        workers = spec.get('workers', multiprocessing.cpu_count())
+    sweep_state['params'] = params
+    sweep_state['dataset'] = share_dataset(dataset)
+    sweep_state['ensemble'] = spec.get('ensemble', False)
+    sweep_state['callbacks'] = callbacks
+    sweep_state['scheduler'] = None
+    rungs_file = None
+    if spec.get('early_termination'):
+        import scheduling
+        fd, rungs_file = tempfile.mkstemp(prefix = 'toupee-rungs-',
+                suffix = '.json')
+        os.close(fd)
+        sweep_state['scheduler'] = scheduling.SuccessiveHalving.from_config(
+                spec['early_termination'], path = rungs_file,
+                max_epochs = params.n_epochs)
+    print "running {0} trials on {1} workers".format(len(trials), workers)
+    #imported once here rather than in every worker, which inherits Keras
+    #and the compiled Theano modules; each trial frees its own model
+    import mlp
+    records = []
+    pool = multiprocessing.Pool(workers)
+    out = open(output, 'a') if output is not None else None
+    try:
+        for record in pool.imap_unordered(run_trial, trials):
+            records.append(record)
+            print "trial {0} {1}: valid {2}".format(record['trial'],
+                    record['overrides'], record.get('best_valid'))
+            if out is not None:
+                out.write(json.dumps(record, default = common.serialize) + '\n')
+                out.flush()
+    finally:
+        pool.close()
+        pool.join()
+        if out is not None:
+            out.close()
+        if rungs_file is not None:
+            os.remove(rungs_file)
+    return sorted(records, key = lambda r: -(r.get('best_valid') or 0.))
@@ -13,6 +13,7 @@ import theano.tensor as T
 import yaml
 import theano.tensor.extra_ops as TE
 from math import floor
+from common import sharedX
 
 class AppliedOnAllBatchesXY():
 
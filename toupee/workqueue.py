@@ -0,0 +1,273 @@
+#!/usr/bin/python
+"""
+Train the members of an ensemble on several processes or nodes, through a
+work queue kept as lock files in a directory on a shared filesystem
+
+Alan Mosca
+Department of Computer Science and Information Systems
+Birkbeck, University of London
+
+All code released under Apachev2.0 licensing.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import gc
+import json
+import time
+import socket
+import threading
+import contextlib
+import numpy
+import numpy.random
+
+import archive
+import scheduling
+from checkpoint import save_head
+from member_store import MemberStore
+
+QUEUE_FILE = 'queue.json'
+TASKS_DIR = 'tasks'
+MEMBERS_DIR = 'members'
+RUNGS_FILE = 'rungs.json'
+
+
+class WorkQueue:
+    """
+    A queue of `ensemble_size` member-training tasks:
+    - queue.json: the method and the number of members
+    - tasks/member_NNNN.claim: created exclusively by the worker training
+      that member, and touched regularly while it does
+    - members/member_NNNN.npz: the member's weights, renamed into place once
+      fully written, which marks the task as done
+
+    Only atomic file creation and renames are relied on, so the directory
+    can be shared between nodes over NFS. A claim that has not been touched
+    for `lease` seconds belongs to a dead worker and can be taken over.
+    """
+
+    def __init__(self, path, lease = 600.):
+        self.path = path
+        self.lease = lease
+        with open(os.path.join(path, QUEUE_FILE)) as f:
+            self.info = json.load(f)
+
+    @classmethod
+    def create(cls, path, method, ensemble_size, lease = 600.):
+        """
+        Create the queue, or open it if it already exists for the same method
+        """
+        if os.path.isfile(os.path.join(path, QUEUE_FILE)):
+            queue = cls(path, lease)
+            queue.check(method)
+            return queue
+        for d in [TASKS_DIR, MEMBERS_DIR]:
+            try:
+                os.makedirs(os.path.join(path, d))
+            except OSError:
+                #created by another worker
+                if not os.path.isdir(os.path.join(path, d)):
+                    raise
+        info = { 'method': archive.method_name(method),
+                 'ensemble_size': ensemble_size }
+        tmp = os.path.join(path, '{0}.{1}.{2}.tmp'.format(QUEUE_FILE,
+                socket.gethostname(), os.getpid()))
+        with open(tmp, 'w') as f:
+            json.dump(info, f)
+        os.rename(tmp, os.path.join(path, QUEUE_FILE))
+        return cls(path, lease)
+
+    def __len__(self):
+        return self.info['ensemble_size']
+
+    def check(self, method):
+        if self.info['method'] != archive.method_name(method):
+            raise ValueError("{0} is a queue for {1}, not {2}".format(
+                self.path, self.info['method'], archive.method_name(method)))
+
+    def claim_file(self, index):
+        return os.path.join(self.path, TASKS_DIR,
+                'member_{0:04d}.claim'.format(index))
+
+    def member_file(self, index):
+        return os.path.join(self.path, MEMBERS_DIR,
+                'member_{0:04d}.npz'.format(index))
+
+    def is_done(self, index):
+        return os.path.isfile(self.member_file(index))
+
+    def done(self):
+        return [i for i in range(len(self)) if self.is_done(i)]
+
+    def finished(self):
+        return len(self.done()) == len(self)
+
+    def _create_claim(self, index):
+        try:
+            fd = os.open(self.claim_file(index),
+                    os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            return False
+        os.write(fd, json.dumps({ 'host': socket.gethostname(),
+                                  'pid': os.getpid() }))
+        os.close(fd)
+        return True
+
+    def _is_stale(self, index):
+        try:
+            return time.time() - os.path.getmtime(self.claim_file(index)) \
+                    > self.lease
+        except OSError:
+            return False
+
+    def claim(self):
+        """
+        Claim the first member that is neither done nor being trained,
+        taking over stale claims, returning its index or None
+        """
+        for i in range(len(self)):
+            if self.is_done(i):
+                continue
+            if self._create_claim(i):
+                return i
+            if self._is_stale(i):
+                #only one of the workers taking over a claim renames it
+                stale = '{0}.stale.{1}.{2}'.format(self.claim_file(i),
+                        socket.gethostname(), os.getpid())
+                try:
+                    os.rename(self.claim_file(i), stale)
+                except OSError:
+                    continue
+                os.remove(stale)
+                if self._create_claim(i):
+                    return i
+        return None
+
+    @contextlib.contextmanager
+    def heartbeat(self, index):
+        """
+        Keep touching the claim of member `index` while it is trained
+        """
+        stop = threading.Event()
+        def touch():
+            while not stop.wait(self.lease / 4.):
+                try:
+                    os.utime(self.claim_file(index), None)
+                except OSError:
+                    pass
+        thread = threading.Thread(target = touch)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, index, weights):
+        """
+        Publish the weights of member `index`
+        """
+        weights = [numpy.asarray(w) for w in weights]
+        tmp = '{0}.{1}.{2}.tmp'.format(self.member_file(index),
+                socket.gethostname(), os.getpid())
+        with open(tmp, 'wb') as f:
+            numpy.savez(f, *weights)
+        os.rename(tmp, self.member_file(index))
+
+    def member_weights(self, index):
+        f = numpy.load(self.member_file(index))
+        return [f['arr_{0}'.format(i)] for i in range(len(f.files))]
+
+    def scheduler(self, config, max_epochs):
+        """
+        A successive halving scheduler whose results are shared by all the
+        workers through the queue directory
+        """
+        return scheduling.SuccessiveHalving.from_config(config,
+                path = os.path.join(self.path, RUNGS_FILE),
+                max_epochs = max_epochs)
+
+
+def check_distributable(method):
+    """
+    Only methods whose members do not depend on each other can be trained
+    by several workers
+    """
+    if not getattr(method, 'independent_members', False):
+        raise ValueError("{0} members cannot be trained independently".format(
+            archive.method_name(method)))
+    if method.__dict__.get('warm_start') is not None:
+        raise ValueError("warm_start chains members, it cannot be used with "
+                "a work queue")
+
+
+def train_task(method, queue, index, x, y):
+    """
+    Train member `index` of a prepared method, with a random state of its
+    own so that it does not depend on which worker trains it, returning its
+    weights
+    """
+    check_distributable(method)
+    seed = method.params.random_seed
+    numpy.random.seed([0 if seed is None else seed, index])
+    #numbered as in a serial run
+    method.members = [None] * index
+    config = method.__dict__.get('early_termination')
+    if config:
+        method.scheduler = queue.scheduler(config, method.params.n_epochs)
+        method.members_started = index
+    m = method.create_member(x, y)
+    weights = [numpy.array(w) for w in method.members[-1]]
+    method.members = []
+    del m
+    gc.collect()
+    return weights
+
+
+def run_worker(queue, method, x, y, wait = True, poll = 10.):
+    """
+    Claim and train members of a prepared method until the queue is
+    finished, returning the indices of the members trained here. Without
+    `wait`, stop as soon as there is nothing left to claim, even if other
+    workers have not finished yet.
+    """
+    queue.check(method)
+    check_distributable(method)
+    trained = []
+    while True:
+        index = queue.claim()
+        if index is None:
+            if not wait or queue.finished():
+                return trained
+            time.sleep(poll)
+            continue
+        print 'worker {0} training member {1}'.format(os.getpid(), index)
+        with queue.heartbeat(index):
+            weights = train_task(method, queue, index, x, y)
+        queue.complete(index, weights)
+        trained.append(index)
+
+
+def wait_for_members(queue, poll = 10.):
+    while not queue.finished():
+        time.sleep(poll)
+
+
+def assemble(queue, method, params, path):
+    """
+    Once every member has landed, write them to an ensemble archive in
+    member order and hand them to the method. A closed-form stack head is
+    then fitted on them and saved in the archive.
+    """
+    if not queue.finished():
+        raise ValueError("{0} of {1} members are done".format(
+            len(queue.done()), len(queue)))
+    members = [queue.member_weights(i) for i in range(len(queue))]
+    with open(params.model_file) as f:
+        model_yaml = f.read()
+    method.members = members
+    saved = archive.save_ensemble(path, model_yaml, members, method = method,
+            params = params)
+    save_head(method, MemberStore(saved, 1), saved)
+    return saved